@@ -3,6 +3,11 @@ ASGI config for kiyo_construction project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The async streaming endpoint (``/api/chat/stream/async/``) only avoids pinning
+a worker thread per conversation when served through this entry point, e.g.:
+
+    uvicorn kiyo_construction.asgi:application --workers 2
+
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
@@ -80,6 +80,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'kiyo_construction.wsgi.application'
+ASGI_APPLICATION = 'kiyo_construction.asgi.application'
 
 
 # Database
@@ -93,6 +94,43 @@ DATABASES = {
     )
 }
 
+# Optional server-side connection pool (Postgres with psycopg 3). Agent
+# checkpoints are read and written from worker threads, which a pool serves
+# better than one persistent connection per thread.
+if os.getenv('DATABASE_POOL', 'False') == 'True' and DATABASES['default'].get('ENGINE', '').endswith('postgresql'):
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default'].setdefault('OPTIONS', {})['pool'] = {
+        'min_size': int(os.getenv('DATABASE_POOL_MIN_SIZE', '2')),
+        'max_size': int(os.getenv('DATABASE_POOL_MAX_SIZE', '10')),
+    }
+
+# SQLite (local runs and tests): checkpoints are written from several threads
+# at once, so take the write lock when a transaction starts and wait for it
+if DATABASES['default'].get('ENGINE', '').endswith('sqlite3'):
+    DATABASES['default'].setdefault('OPTIONS', {}).update({'transaction_mode': 'IMMEDIATE', 'timeout': 20})
+
+# Where agent conversation checkpoints live: 'database' (shared across
+# workers) or 'memory' (this process only)
+AGENT_CHECKPOINTER = os.getenv('AGENT_CHECKPOINTER', 'database')
+
+# 'database' checkpointer: checkpoints kept per conversation (0 keeps all of
+# them) and threads running its queries, which hold its database connections
+AGENT_CHECKPOINT_HISTORY = int(os.getenv('AGENT_CHECKPOINT_HISTORY', '20'))
+AGENT_CHECKPOINT_DB_THREADS = int(os.getenv('AGENT_CHECKPOINT_DB_THREADS', '4'))
+
+# Limits of the 'memory' checkpointer: memory budget, idle TTL (0 disables it)
+# and an optional directory that evicted conversations are spilled to
+AGENT_MEMORY_MAX_BYTES = int(os.getenv('AGENT_MEMORY_MAX_BYTES', str(256 * 1024 * 1024)))
+AGENT_MEMORY_TTL_SECONDS = float(os.getenv('AGENT_MEMORY_TTL_SECONDS', '0'))
+AGENT_MEMORY_SPILL_DIR = os.getenv('AGENT_MEMORY_SPILL_DIR', '')
+
+# Threads extracting the text of uploaded documents in the background
+# (0 extracts during the upload request instead)
+DOCUMENT_INGEST_WORKERS = int(os.getenv('DOCUMENT_INGEST_WORKERS', '2'))
+# Seconds after which a document still 'processing' is taken to be lost
+# (its worker crashed or restarted) and queued again
+DOCUMENT_PROCESSING_TIMEOUT_SECONDS = float(os.getenv('DOCUMENT_PROCESSING_TIMEOUT_SECONDS', '600'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -0,0 +1,243 @@
+"""
+Upload-once document ingestion.
+
+Uploaded PDFs are stored as Document rows and their text is extracted in the
+background, on a small process-wide thread pool that hands the parsing to the
+PDF extraction pool (and its text cache). Chat requests then reference the
+documents by ID, so the streaming path reads stored text instead of parsing
+uploads before it can respond.
+
+Queued extractions live in process memory, so a restart can lose a
+document's queued task (it stays 'pending') or its running one (it stays
+'processing'). Documents found in either state when they are requested
+are queued again; see requeue_stale_documents.
+"""
+
+import logging
+import threading
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, IO, Iterable, List, Optional, Set
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from leveling.models import Document
+from leveling.modules.kiyo_agents.pdf_processor import extract_pdfs
+
+logger = logging.getLogger(__name__)
+
+
+class DocumentNotReadyError(Exception):
+    """Raised when a chat request references documents whose text is not extracted yet."""
+
+    def __init__(self, documents: List[Document]):
+        self.documents = documents
+        super().__init__(f"Documents not ready: {', '.join(str(document.id) for document in documents)}")
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+# Documents queued on this process's pool and not extracted yet
+_queued: Set[int] = set()
+_queued_lock = threading.Lock()
+
+
+def _get_executor() -> Optional[ThreadPoolExecutor]:
+    """Return the process-wide ingestion pool (None when DOCUMENT_INGEST_WORKERS is 0: extract inline)."""
+    global _executor
+    if settings.DOCUMENT_INGEST_WORKERS <= 0:
+        return None
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.DOCUMENT_INGEST_WORKERS, thread_name_prefix="document-ingest")
+    return _executor
+
+
+def extract_document(document_id: int) -> None:
+    """Extract and store the text of one document, recording the failure if it cannot be read."""
+    try:
+        updated = Document.objects.filter(id=document_id, status=Document.STATUS_PENDING).update(
+            status=Document.STATUS_PROCESSING, processing_started_at=timezone.now()
+        )
+        if not updated:
+            # Already picked up, or deleted since it was queued
+            return
+        document = Document.objects.get(id=document_id)
+        try:
+            path = document.file.path
+        except NotImplementedError:
+            # Storage without local paths: parse from the stored file
+            path = None
+        if path is not None:
+            extracted = extract_pdfs([path])[0]
+        else:
+            with document.file.open('rb') as stored_file:
+                extracted = extract_pdfs([stored_file])[0]
+
+        document.sha256 = extracted.sha256 or ''
+        document.processed_at = timezone.now()
+        if extracted.error:
+            document.status = Document.STATUS_FAILED
+            document.error = extracted.error
+        else:
+            document.status = Document.STATUS_READY
+            document.extracted_text = extracted.text
+            document.page_offsets = extracted.page_offsets
+        document.save(update_fields=['status', 'sha256', 'extracted_text', 'page_offsets', 'error', 'processed_at'])
+        logger.info(f"Document {document_id} ({document.name}) {document.status}")
+    except Exception as e:
+        logger.error(f"Error ingesting document {document_id}: {e}", exc_info=True)
+        Document.objects.filter(id=document_id).update(status=Document.STATUS_FAILED, error=str(e), processed_at=timezone.now())
+
+
+def _extract_in_background(document_id: int) -> None:
+    # Pool threads outlive requests, so they manage their own database connections
+    close_old_connections()
+    try:
+        extract_document(document_id)
+    finally:
+        with _queued_lock:
+            _queued.discard(document_id)
+        close_old_connections()
+
+
+def _submit(executor: ThreadPoolExecutor, document_id: int) -> None:
+    """Queue a document's extraction on the pool, unless this process has already queued it."""
+    with _queued_lock:
+        if document_id in _queued:
+            return
+        _queued.add(document_id)
+    executor.submit(_extract_in_background, document_id)
+
+
+def requeue_stale_documents(document_ids: Optional[Iterable[int]] = None) -> None:
+    """
+    Queue the extraction of documents whose queued or running task was lost.
+
+    Documents 'processing' for longer than DOCUMENT_PROCESSING_TIMEOUT_SECONDS
+    are reset to 'pending', and pending documents this process has not queued
+    are queued (or extracted inline without a pool). Another process may still
+    hold them in its queue: whichever task claims a document first extracts it,
+    and the others find it no longer pending.
+
+    Args:
+        document_ids: Documents to check (all documents if omitted)
+    """
+    documents = Document.objects.all()
+    if document_ids is not None:
+        documents = documents.filter(id__in=list(document_ids))
+    stale_before = timezone.now() - timedelta(seconds=settings.DOCUMENT_PROCESSING_TIMEOUT_SECONDS)
+    reclaimed = documents.filter(status=Document.STATUS_PROCESSING).filter(
+        Q(processing_started_at__lt=stale_before) | Q(processing_started_at__isnull=True)
+    ).update(status=Document.STATUS_PENDING)
+    if reclaimed:
+        logger.warning(f"Requeued {reclaimed} documents whose extraction did not finish within {settings.DOCUMENT_PROCESSING_TIMEOUT_SECONDS}s")
+
+    executor = _get_executor()
+    for document_id in documents.filter(status=Document.STATUS_PENDING).values_list('id', flat=True):
+        if executor is None:
+            extract_document(document_id)
+        else:
+            _submit(executor, document_id)
+
+
+def ingest_uploads(files: List[IO], project_id: Optional[int] = None) -> List[Document]:
+    """
+    Store uploaded PDFs and queue their text extraction.
+
+    Args:
+        files: Uploaded files
+        project_id: Project the documents belong to, if any
+
+    Returns:
+        The new documents, still pending unless extraction runs inline
+    """
+    executor = _get_executor()
+    documents = []
+    for uploaded_file in files:
+        document = Document.objects.create(name=uploaded_file.name, file=uploaded_file, project_id=project_id)
+        if executor is None:
+            extract_document(document.id)
+            document.refresh_from_db()
+        else:
+            # Workers must see the committed row
+            transaction.on_commit(lambda document_id=document.id: _submit(executor, document_id))
+        documents.append(document)
+    return documents
+
+
+def document_status(document: Document) -> Dict[str, Any]:
+    """The public view of a document's ingestion state."""
+    return {
+        'id': document.id,
+        'name': document.name,
+        'status': document.status,
+        'sha256': document.sha256 or None,
+        'page_count': len(document.page_offsets) if document.status == Document.STATUS_READY else None,
+        'error': document.error or None,
+        'uploaded_at': document.uploaded_at.isoformat(),
+        'processed_at': document.processed_at.isoformat() if document.processed_at else None,
+    }
+
+
+def load_documents(document_ids: List[int]) -> List[Dict[str, Any]]:
+    """
+    Return the stored text of documents in the shape of processed PDFs, in request order.
+    Documents whose extraction was lost are queued again (see requeue_stale_documents).
+
+    Raises:
+        ValueError: If a document does not exist or its extraction failed
+        DocumentNotReadyError: If a document is still being processed
+    """
+    if not document_ids:
+        return []
+    documents = Document.objects.in_bulk(document_ids)
+    missing = [document_id for document_id in document_ids if document_id not in documents]
+    if missing:
+        raise ValueError(f"Unknown document_ids: {', '.join(str(document_id) for document_id in missing)}")
+    unfinished = [
+        document.id for document in documents.values()
+        if document.status in (Document.STATUS_PENDING, Document.STATUS_PROCESSING)
+    ]
+    if unfinished:
+        requeue_stale_documents(unfinished)
+        # Without a pool, requeued documents were extracted just now
+        documents.update(Document.objects.in_bulk(unfinished))
+    failed = [document for document in documents.values() if document.status == Document.STATUS_FAILED]
+    if failed:
+        raise ValueError(f"Documents could not be processed: {', '.join(str(document.id) for document in failed)}")
+    not_ready = [document for document in documents.values() if document.status != Document.STATUS_READY]
+    if not_ready:
+        raise DocumentNotReadyError(not_ready)
+
+    processed_pdfs = []
+    seen_digests = set()
+    for document_id in document_ids:
+        document = documents[document_id]
+        if document.sha256 in seen_digests:
+            logger.info(f"Skipping document {document_id}: the same file is already referenced by this message.")
+            continue
+        seen_digests.add(document.sha256)
+        if document.extracted_text:
+            processed_pdfs.append({'filename': document.name, 'content': document.extracted_text, 'page_offsets': document.page_offsets})
+    return processed_pdfs
+
+
+def parse_document_ids(value: Any) -> List[int]:
+    """Parse document IDs from a JSON list or a comma-separated string."""
+    if value in (None, '', []):
+        return []
+    if isinstance(value, str):
+        value = [part for part in value.split(',') if part.strip()]
+    if not isinstance(value, (list, tuple)):
+        value = [value]
+    try:
+        document_ids = [int(str(document_id).strip()) for document_id in value]
+    except ValueError:
+        raise ValueError(f"Invalid document_ids: {value}")
+    # Keep the first occurrence of each ID
+    return list(dict.fromkeys(document_ids))
@@ -1,11 +1,13 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from langsmith import Client
 import os
 import pandas as pd
 from typing import Dict, Any, List
 
-from leveling.modules.evaluation.evaluation import run_evaluation_pipeline
-from leveling.modules.config.model_configs import get_config, get_config_names
+from leveling.modules.evaluation.runner import DEFAULT_MAX_CONCURRENCY, DEFAULT_PROVIDER_LIMITS, ExperimentSummary, run_evaluations
+from leveling.modules.config.model_configs import get_config_names
+from leveling.modules.kiyo_agents.llm_cassette import llm_replay_active
+from leveling.management.replay import add_replay_arguments, apply_replay_options
 
 class Command(BaseCommand):
     help = 'Evaluate the construction agent using LangSmith'
@@ -47,11 +49,45 @@ class Command(BaseCommand):
             default=1,
             help='Number of repetitions per configuration'
         )
+        parser.add_argument(
+            '--max-concurrency',
+            type=int,
+            default=None,
+            help=f'Number of examples evaluated at once, across all configurations (default: {DEFAULT_MAX_CONCURRENCY} per configuration)'
+        )
+        parser.add_argument(
+            '--provider-limits',
+            type=str,
+            nargs='+',
+            default=[],
+            metavar='PROVIDER=N',
+            help=f"Concurrent call caps per provider (defaults: {', '.join(f'{p}={n}' for p, n in DEFAULT_PROVIDER_LIMITS.items())})"
+        )
+        parser.add_argument(
+            '--config-workers',
+            type=int,
+            default=None,
+            help='Number of configurations evaluated at once (default: all of them)'
+        )
+        parser.add_argument(
+            '--sheet-pool-size',
+            type=int,
+            default=0,
+            help='Sheets per template converted ahead of the runs that use them (0 creates each on demand)'
+        )
+        parser.add_argument(
+            '--run-id',
+            type=str,
+            help='Run ID naming the Drive folders of the run (default: a timestamp, or the cassette name with --http-cassette)'
+        )
+        add_replay_arguments(parser)
 
     def handle(self, *args, **options):
+        apply_replay_options(options)
+
         # Get OpenAI API key from arguments or environment
         api_key = os.getenv('OPENAI_API_KEY')
-        if not api_key:
+        if not api_key and not llm_replay_active():
             self.stderr.write(self.style.ERROR('OpenAI API key is required. Set OPENAI_API_KEY environment variable'))
             return
 
@@ -63,34 +99,46 @@ class Command(BaseCommand):
         
         configs_to_run = self._get_configs_to_run(options)
         
-        # Run evaluations for each configuration
-        results = {}
-        for config_name in configs_to_run:
-            self.stdout.write(f"Running evaluation for configuration: {config_name}")
-            
-            try:
-                # Get the configuration
-                config = get_config(config_name)
-                
-                # Run evaluation for this configuration
-                experiment_results = run_evaluation_pipeline(
-                    client=client,
-                    dataset_name=options['dataset_name'],
-                    google_access_token=google_access_token,
-                    num_repetitions=options['repetitions'],
-                    config=config,
-                    experiment_prefix=config_name
-                )
-                
-                # Store results
-                results[config_name] = experiment_results
-                
-                # Log completion
-                self.stdout.write(self.style.SUCCESS(f"Completed evaluation for {config_name}"))
-                
-            except Exception as e:
-                self.stderr.write(self.style.ERROR(f"Error running evaluation for {config_name}: {str(e)}"))
-            
+        provider_limits = self._parse_provider_limits(options['provider_limits'])
+
+        # The run folder's name is part of the recorded Drive requests, so a
+        # recording and its replays must use the same run ID
+        run_id = options['run_id']
+        if not run_id and options.get('http_cassette'):
+            run_id = f"run_{os.path.splitext(os.path.basename(options['http_cassette']))[0]}"
+
+        def report(experiment: ExperimentSummary):
+            if experiment.error:
+                self.stderr.write(self.style.ERROR(f"Error running evaluation for {experiment.config_name}: {experiment.error}"))
+            else:
+                self.stdout.write(self.style.SUCCESS(f"Completed evaluation for {experiment.config_name} in {experiment.wall_seconds:.1f}s"))
+
+        # Run the evaluations of all configurations concurrently
+        summary = run_evaluations(
+            client=client,
+            config_names=configs_to_run,
+            dataset_name=options['dataset_name'],
+            google_access_token=google_access_token,
+            num_repetitions=options['repetitions'],
+            max_concurrency=options['max_concurrency'],
+            provider_limits=provider_limits,
+            config_workers=options['config_workers'],
+            sheet_pool_size=options['sheet_pool_size'],
+            on_complete=report,
+            run_id=run_id,
+        )
+
+        self.stdout.write(summary.format())
+
+    def _parse_provider_limits(self, values: List[str]) -> Dict[str, int]:
+        """Parse PROVIDER=N pairs into per-provider concurrency caps."""
+        limits = {}
+        for value in values:
+            provider, _, limit = value.partition('=')
+            if not provider or not limit.isdigit() or int(limit) < 1:
+                raise CommandError(f"Invalid provider limit '{value}', expected PROVIDER=N with N >= 1")
+            limits[provider.lower()] = int(limit)
+        return limits
 
     def _get_configs_to_run(self, options: Dict[str, Any]) -> List[str]:
         """Get the configurations to run based on the command options."""
@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
 from leveling.modules.kiyo_agents.construction_agent import ConstructionAgent
+from leveling.management.replay import add_replay_arguments, apply_replay_options
 import os
 
 class Command(BaseCommand):
@@ -22,9 +23,11 @@ class Command(BaseCommand):
             type=str,
             help='Google access token'
         )
+        add_replay_arguments(parser)
 
     def handle(self, *args, **options):
- 
+        apply_replay_options(options)
+
         # Get Google credentials
         google_access_token = options['google_token'] or os.getenv('DEV_GOOGLE_ACCESS_TOKEN')
         spreadsheet_id = options['spreadsheet_id'] or os.getenv('DEV_SPREADSHEET_ID')
@@ -44,23 +47,18 @@ class Command(BaseCommand):
 
         # Process the message and stream the response
         try:
-            accumulated_text = ""
             for chunk in agent.process_message_stream(message, conversation_id="simulation"):
                 if chunk.get('type') == 'message':
-                    # Only write the new part of the text
-                    new_text = chunk['text']
-                    if new_text.startswith(accumulated_text):
-                        new_part = new_text[len(accumulated_text):]
-                        if new_part:
-                            self.stdout.write(new_part, ending='')
-                            self.stdout.flush()
-                    else:
-                        # If the text doesn't start with accumulated text, write the whole thing
-                        self.stdout.write(new_text, ending='')
-                        self.stdout.flush()
-                    accumulated_text = new_text
-                elif chunk.get('type') == 'tool_call':
-                    self.stdout.write(self.style.WARNING(f'\nTool call: {chunk["tool_calls"]}'))
+                    # Chunks carry only the new text
+                    self.stdout.write(chunk['delta'], ending='')
+                    self.stdout.flush()
+                elif chunk.get('type') == 'tool_start':
+                    self.stdout.write(self.style.WARNING(f'\nTool {chunk["tool"]} started ({chunk["range"] or "-"})'))
+                elif chunk.get('type') == 'tool_end':
+                    self.stdout.write(self.style.WARNING(
+                        f'Tool {chunk["tool"]} finished: {chunk["status"]} in {chunk["duration_ms"]} ms, '
+                        f'read {chunk["bytes_read"]} B, wrote {chunk["bytes_written"]} B'
+                    ))
             self.stdout.write('\n')
         except Exception as e:
             self.stderr.write(self.style.ERROR(f'Error occurred: {str(e)}')) 
\ No newline at end of file
@@ -0,0 +1,79 @@
+"""
+Command-line options shared by the commands that run the agent, for
+recording and replaying its external traffic: Google Sheets/Drive calls
+and the model's responses.
+"""
+
+from leveling.modules.kiyo_agents.http_cassette import CASSETTE_MODES, MODE_REPLAY
+from leveling.modules.kiyo_agents.http_client import use_http_cassette
+from leveling.modules.kiyo_agents.llm_cassette import use_llm_cassette
+
+
+def add_replay_arguments(parser) -> None:
+    """Add the record/replay flags to a command's parser."""
+    parser.add_argument(
+        '--http-cassette',
+        type=str,
+        help='Cassette file to record Google Sheets/Drive traffic to, or replay it from'
+    )
+    parser.add_argument(
+        '--http-cassette-mode',
+        type=str,
+        choices=CASSETTE_MODES,
+        default=MODE_REPLAY,
+        help='Record the traffic to the cassette, or replay it without network access'
+    )
+    parser.add_argument(
+        '--http-replay-latency',
+        type=str,
+        default='0',
+        help="Latency of replayed responses: 'recorded', or milliseconds per response"
+    )
+    parser.add_argument(
+        '--http-replay-latency-scale',
+        type=float,
+        default=1.0,
+        help='Factor applied to recorded latencies'
+    )
+    parser.add_argument(
+        '--llm-cassette',
+        type=str,
+        help="Cassette file to record the model's responses to, or replay them from"
+    )
+    parser.add_argument(
+        '--llm-cassette-mode',
+        type=str,
+        choices=CASSETTE_MODES,
+        default=MODE_REPLAY,
+        help='Record the responses to the cassette, or replay them without calling the provider'
+    )
+    parser.add_argument(
+        '--llm-replay-latency',
+        type=str,
+        default='0',
+        help="Wait before the first token of a replayed response: 'recorded', or milliseconds"
+    )
+    parser.add_argument(
+        '--llm-tokens-per-second',
+        type=float,
+        default=0.0,
+        help='Pace of replayed tokens (0 streams each response at once)'
+    )
+
+
+def apply_replay_options(options) -> None:
+    """Route the agent's traffic through the cassettes given on the command line, if any."""
+    if options.get('http_cassette'):
+        use_http_cassette(
+            options['http_cassette'],
+            options['http_cassette_mode'],
+            options['http_replay_latency'],
+            options['http_replay_latency_scale'],
+        )
+    if options.get('llm_cassette'):
+        use_llm_cassette(
+            options['llm_cassette'],
+            options['llm_cassette_mode'],
+            options['llm_replay_latency'],
+            options['llm_tokens_per_second'],
+        )
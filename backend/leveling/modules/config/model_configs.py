@@ -4,11 +4,16 @@ from .prompts import (
     CONSTRUCTION_AGENT_INSTRUCTIONS_EVALUATION
 )
 
+# Token budget for the conversation sent to the model on each call; older
+# tool outputs and PDF text are compacted beyond it (None disables compaction)
+DEFAULT_CONTEXT_TOKEN_BUDGET = 60000
+
 # Default configurations
 DEFAULT_CONFIG = {
     "configurable": {
         "model": "gpt-4o",
         "system_instructions": CONSTRUCTION_AGENT_INSTRUCTIONS,
+        "context_token_budget": DEFAULT_CONTEXT_TOKEN_BUDGET,
     },
     "recursion_limit": 50
 }
@@ -21,6 +26,7 @@ CONFIGS = {
         "configurable": {
             "model": "gpt-4o",
             "system_instructions": CONSTRUCTION_AGENT_INSTRUCTIONS_EVALUATION,
+            "context_token_budget": DEFAULT_CONTEXT_TOKEN_BUDGET,
         },
         "recursion_limit": 50
     },
@@ -29,6 +35,7 @@ CONFIGS = {
         "configurable": {
             "model": "gpt-4.1",
             "system_instructions": CONSTRUCTION_AGENT_INSTRUCTIONS_EVALUATION,
+            "context_token_budget": DEFAULT_CONTEXT_TOKEN_BUDGET,
         },
         "recursion_limit": 50   
     },
@@ -37,6 +44,7 @@ CONFIGS = {
         "configurable": {
             "model": "o3",
             "system_instructions": CONSTRUCTION_AGENT_INSTRUCTIONS_EVALUATION,
+            "context_token_budget": DEFAULT_CONTEXT_TOKEN_BUDGET,
         },
         "recursion_limit": 50
     },
@@ -45,6 +53,7 @@ CONFIGS = {
         "configurable": {
             "model": "o4-mini",
             "system_instructions": CONSTRUCTION_AGENT_INSTRUCTIONS_EVALUATION,
+            "context_token_budget": DEFAULT_CONTEXT_TOKEN_BUDGET,
         },
         "recursion_limit": 50
     },
@@ -53,6 +62,7 @@ CONFIGS = {
         "configurable": {
             "model": "o3-mini",
             "system_instructions": CONSTRUCTION_AGENT_INSTRUCTIONS_EVALUATION,
+            "context_token_budget": DEFAULT_CONTEXT_TOKEN_BUDGET,
         },
         "recursion_limit": 50
     },
@@ -61,6 +71,7 @@ CONFIGS = {
         "configurable": {
             "model": "claude-3-7-sonnet-latest",
             "system_instructions": CONSTRUCTION_AGENT_INSTRUCTIONS_EVALUATION,
+            "context_token_budget": DEFAULT_CONTEXT_TOKEN_BUDGET,
         },
         "recursion_limit": 50
     }
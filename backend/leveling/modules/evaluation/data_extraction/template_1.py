@@ -58,18 +58,14 @@ def extract_template_1(spreadsheet_id: str, access_token: str, range_name: str =
     # Initialize Google Sheets service
     sheets_service = GoogleSheetsService(access_token=access_token)
     
-    # Read data from the sheet
-    raw_data = sheets_service.read_sheet_data(
+    # Read values and formulas for the range in one batch
+    sheet_data = sheets_service.batch_read(
         spreadsheet_id=spreadsheet_id,
-        range_name=range_name
-    )
-    
-    # Read formulas for formula cells
-    formula_data = sheets_service.read_sheet_data(
-        spreadsheet_id=spreadsheet_id,
-        range_name=range_name,
-        value_render_option="FORMULA"
+        ranges=[range_name],
+        value_render_options=["FORMATTED_VALUE", "FORMULA"]
     )
+    raw_data = sheet_data["FORMATTED_VALUE"][0]
+    formula_data = sheet_data["FORMULA"][0]
     
     # Extract supplier names from row 1 (looking at the header cells)
     supplier_names = []
@@ -7,46 +7,72 @@ from typing import Dict, Any, Callable, Optional
 from langsmith import Client
 from leveling.modules.kiyo_agents.construction_agent import ConstructionAgent
 from leveling.modules.kiyo_agents.message_builder import build_agent_input_message
-from leveling.modules.kiyo_agents.pdf_processor import process_pdf_file
+from leveling.modules.kiyo_agents.pdf_processor import extract_pdfs
 import os
 
 from .evaluators.evaluators import EVALUATORS_FUNCTIONS
 from .data_extraction.data_extraction import EXTRACTION_FUNCTIONS
 from .file_processing import create_sheet_from_template, create_run_folder
+from .sheet_pool import TemplateSheetPool
+from .runner import DEFAULT_MAX_CONCURRENCY, ConcurrencyLimiter, ProviderSlotCallback, provider_for_model
 
 logger = logging.getLogger(__name__)
 
 load_dotenv()
-def create_target_function(google_access_token: str, run_folder_id: str, dataset_name: str, config: Dict[str, Any] = None) -> Callable:
-    """Create a target function that processes file inputs and returns agent responses."""
+def create_target_function(
+    google_access_token: str,
+    run_folder_id: str,
+    dataset_name: str,
+    config: Dict[str, Any] = None,
+    limiter: Optional[ConcurrencyLimiter] = None,
+    experiment: str = "default",
+    sheet_pool: Optional[TemplateSheetPool] = None
+) -> Callable:
+    """Create a target function that processes file inputs and returns agent responses.
+
+    With a limiter, each run holds one of its target slots, and each call to the
+    model holds one of its provider's slots (calls to Google hold a Google slot
+    through the HTTP client's request gate, see runner.run_evaluations). With a
+    sheet pool, runs claim a pre-provisioned sheet instead of creating one.
+    """
+    limiter = limiter or ConcurrencyLimiter()
+    model_slots = ProviderSlotCallback(limiter, provider_for_model((config or {}).get("configurable", {}).get("model", "gpt-4o")))
 
     def target_function(inputs: Dict[str, Any]) -> Dict[str, Any]:
+        with limiter.target(experiment):
+            return run_target(inputs)
+
+    def run_target(inputs: Dict[str, Any]) -> Dict[str, Any]:
         # 1. Create Google Sheet from template
         template_path = inputs["template_path"]
-        sheet_id = create_sheet_from_template(template_path, google_access_token, run_folder_id)
+        if sheet_pool:
+            sheet_id = sheet_pool.claim(template_path)
+        else:
+            sheet_id = create_sheet_from_template(template_path, google_access_token, run_folder_id)
         
-        # 2. Process PDFs
+        # 2. Process PDFs (in parallel, on the shared extraction pool)
         pdf_contents = []
-        for pdf_path in inputs["pdf_paths"]:
-            content = process_pdf_file(pdf_path)
-            # Create a dictionary with filename and content
+        for pdf_path, extracted in zip(inputs["pdf_paths"], extract_pdfs(inputs["pdf_paths"])):
+            # Create a dictionary with filename, content and page offsets
             pdf_contents.append({
                 "filename": os.path.basename(pdf_path),
-                "content": content
+                "content": extracted.text,
+                "page_offsets": extracted.page_offsets
             })
         
         # 3. Build combined message
         message = build_agent_input_message(
             message=inputs["message"],
             processed_pdfs=pdf_contents,
-            spreadsheet_id=sheet_id
+            spreadsheet_id=sheet_id,
+            model_name=(config or {}).get("configurable", {}).get("model", "gpt-4o")
         )
 
-        # 4. Initialize agent with configuration
+        # 4. Initialize agent with configuration; its model calls hold a slot of the model's provider
         agent = ConstructionAgent(
             google_access_token=google_access_token,
             spreadsheet_id=sheet_id,
-            config=config  # Pass the config to the agent
+            config={**config, "callbacks": [model_slots]} if config else None
         )
         
         # 5. Process with agent
@@ -71,11 +97,27 @@ def run_evaluation_pipeline(
     google_access_token: str = None,
     num_repetitions: int = 1,
     config: Dict[str, Any] = None,
-    experiment_prefix: str = None
+    experiment_prefix: str = None,
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    limiter: Optional[ConcurrencyLimiter] = None,
+    sheet_pool_size: int = 0,
+    run_id: Optional[str] = None
 ) -> Dict[str, Any]:
-    """Run the full evaluation pipeline."""
-    # Generate a unique run ID for this evaluation
-    run_id = f"run_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    """Run the full evaluation pipeline.
+
+    `max_concurrency` examples (and repetitions) are evaluated at once; pass a
+    shared limiter to bound concurrency across several pipelines run together.
+    With `sheet_pool_size`, up to that many sheets per template are created
+    ahead of the runs that use them.
+
+    The run's Drive folder is named after `run_id` (a timestamp by default) and
+    the experiment prefix. Replayed runs must pass the run ID they were recorded
+    with, since the folder name is part of the recorded Drive requests.
+    """
+    # Generate a unique run ID for this evaluation (experiments can start in the same second)
+    run_id = run_id or f"run_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    if experiment_prefix:
+        run_id = f"{run_id}_{experiment_prefix}"
     
     # Create the run folder before running the evaluation
     run_folder_id = create_run_folder(google_access_token, run_id)
@@ -88,18 +130,34 @@ def run_evaluation_pipeline(
     except Exception as e:
         raise ValueError(f"Dataset {dataset_name} not found. Please create it first using the create_evaluation_dataset command.") from e
     
+    # Start converting the templates of the dataset's examples
+    sheet_pool = None
+    if sheet_pool_size > 0:
+        sheet_pool = TemplateSheetPool(google_access_token, run_folder_id, sheet_pool_size)
+        try:
+            template_paths = [example.inputs["template_path"] for example in client.list_examples(dataset_id=dataset.id)]
+            sheet_pool.warm(template_paths * num_repetitions)
+        except Exception as e:
+            logger.warning(f"Could not warm the sheet pool for {dataset_name}, sheets will be created on demand: {e}")
+
     # Create target function with config
     target_function = create_target_function(
-        google_access_token, run_folder_id, dataset_name, config)
+        google_access_token, run_folder_id, dataset_name, config,
+        limiter=limiter or ConcurrencyLimiter(max_concurrency), experiment=experiment_prefix or "default",
+        sheet_pool=sheet_pool)
     
     # Run evaluation
-    experiment_results = client.evaluate(
-        target_function,
-        data=dataset,
-        evaluators=EVALUATORS_FUNCTIONS[dataset_name],
-        experiment_prefix=experiment_prefix,
-        num_repetitions=num_repetitions,
-        max_concurrency=3
-    )
+    try:
+        experiment_results = client.evaluate(
+            target_function,
+            data=dataset,
+            evaluators=EVALUATORS_FUNCTIONS[dataset_name],
+            experiment_prefix=experiment_prefix,
+            num_repetitions=num_repetitions,
+            max_concurrency=max_concurrency
+        )
+    finally:
+        if sheet_pool:
+            sheet_pool.close()
     
     return experiment_results 
\ No newline at end of file
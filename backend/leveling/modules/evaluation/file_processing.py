@@ -1,13 +1,26 @@
 import logging
-from typing import Optional
+from typing import Dict, Optional, Tuple
 import os
-import requests
+import json
+import uuid
+import threading
+
+from leveling.modules.kiyo_agents.http_client import get_http_client
 
 logger = logging.getLogger(__name__)
 
+XLSX_MIME_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+GOOGLE_SHEET_MIME_TYPE = 'application/vnd.google-apps.spreadsheet'
+
+# Folder IDs found or created so far, by (token, folder name, parent ID)
+_folder_ids: Dict[Tuple[str, str, Optional[str]], str] = {}
+# Held while looking a folder up, so concurrent runs do not create it twice
+_folder_lock = threading.Lock()
+
 def get_or_create_folder(google_access_token: str, folder_name: str, parent_id: str = None) -> str:
     """
     Get or create a folder in Google Drive.
+    Folder IDs are cached for the life of the process, so Drive is only searched once per folder.
     
     Args:
         google_access_token: Google OAuth access token
@@ -17,18 +30,28 @@ def get_or_create_folder(google_access_token: str, folder_name: str, parent_id:
     Returns:
         The ID of the folder
     """
+    key = (google_access_token, folder_name, parent_id)
+    with _folder_lock:
+        if key not in _folder_ids:
+            folder_id = _find_or_create_folder(google_access_token, folder_name, parent_id)
+            if not folder_id:
+                return None
+            _folder_ids[key] = folder_id
+        return _folder_ids[key]
+
+def _find_or_create_folder(google_access_token: str, folder_name: str, parent_id: str = None) -> Optional[str]:
     # Search for existing folder
     query = f"name='{folder_name}' and mimeType='application/vnd.google-apps.folder'"
     if parent_id:
         query += f" and '{parent_id}' in parents"
     
-    search_response = requests.get(
+    search_response = get_http_client().get(
         'https://www.googleapis.com/drive/v3/files',
         headers={'Authorization': f'Bearer {google_access_token}'},
         params={'q': query}
     )
     
-    if search_response.ok:
+    if search_response.is_success:
         folders = search_response.json().get('files', [])
         if folders:
             return folders[0]['id']
@@ -41,7 +64,7 @@ def get_or_create_folder(google_access_token: str, folder_name: str, parent_id:
     if parent_id:
         folder_metadata['parents'] = [parent_id]
     
-    create_response = requests.post(
+    create_response = get_http_client().post(
         'https://www.googleapis.com/drive/v3/files',
         headers={
             'Authorization': f'Bearer {google_access_token}',
@@ -50,7 +73,7 @@ def get_or_create_folder(google_access_token: str, folder_name: str, parent_id:
         json=folder_metadata
     )
     
-    if not create_response.ok:
+    if not create_response.is_success:
         print(f"Failed to create folder: {create_response.text}")
         return None
 
@@ -69,67 +92,40 @@ def create_sheet_from_template(template_path: str, google_access_token: str, run
         The ID of the created Google Sheet, or None if creation failed
     """
     try:
-        # 3. Upload the XLSX file to Google Drive
+        # Upload the XLSX file and have Drive convert it to a Google Sheet in the same request
         file_name = os.path.basename(template_path)
-        
-        # Prepare the file metadata
+        with open(template_path, 'rb') as template_file:
+            file_content = template_file.read()
+
         file_metadata = {
-            'name': file_name,
-            'mimeType': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            'name': f'Sheet from {file_name}',
+            'mimeType': GOOGLE_SHEET_MIME_TYPE,
             'parents': [run_folder_id]
         }
-        
-        # Prepare the multipart request
-        files = {
-            'metadata': ('metadata', str(file_metadata), 'application/json'),
-            'file': (file_name, open(template_path, 'rb'), 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        }
-        
-        # Upload the file
-        upload_response = requests.post(
-            'https://www.googleapis.com/upload/drive/v3/files?uploadType=multipart',
-            headers={'Authorization': f'Bearer {google_access_token}'},
-            files=files
-        )
-        
-        if not upload_response.ok:
-            print(f"Failed to upload template to Google Drive: {upload_response.text}")
-            return None
-            
-        uploaded_file_id = upload_response.json()['id']
-        
-        # 4. Convert the uploaded XLSX to a Google Sheet by copying
-        copy_response = requests.post(
-            f'https://www.googleapis.com/drive/v3/files/{uploaded_file_id}/copy',
+
+        # Drive's multipart upload: a JSON metadata part, then the media part
+        boundary = uuid.uuid4().hex
+        body = (
+            f'--{boundary}\r\nContent-Type: application/json; charset=UTF-8\r\n\r\n'
+            f'{json.dumps(file_metadata)}\r\n'
+            f'--{boundary}\r\nContent-Type: {XLSX_MIME_TYPE}\r\n\r\n'
+        ).encode() + file_content + f'\r\n--{boundary}--\r\n'.encode()
+
+        upload_response = get_http_client().post(
+            'https://www.googleapis.com/upload/drive/v3/files',
+            params={'uploadType': 'multipart', 'fields': 'id'},
             headers={
                 'Authorization': f'Bearer {google_access_token}',
-                'Content-Type': 'application/json'
+                'Content-Type': f'multipart/related; boundary={boundary}'
             },
-            json={
-                'mimeType': 'application/vnd.google-apps.spreadsheet',
-                'name': f'Sheet from {file_name}',
-                'parents': [run_folder_id]
-            }
+            content=body
         )
-        
-        if not copy_response.ok:
-            print(f"Failed to convert template to Google Sheet: {copy_response.text}")
-            # Clean up the uploaded file
-            requests.delete(
-                f'https://www.googleapis.com/drive/v3/files/{uploaded_file_id}',
-                headers={'Authorization': f'Bearer {google_access_token}'}
-            )
+
+        if not upload_response.is_success:
+            print(f"Failed to upload template to Google Drive: {upload_response.text}")
             return None
-            
-        new_sheet_id = copy_response.json()['id']
-        
-        # 5. Clean up the uploaded XLSX file
-        requests.delete(
-            f'https://www.googleapis.com/drive/v3/files/{uploaded_file_id}',
-            headers={'Authorization': f'Bearer {google_access_token}'}
-        )
-        
-        return new_sheet_id
+
+        return upload_response.json()['id']
         
     except Exception as e:
         print(f"Error creating sheet from template: {str(e)}")
@@ -161,3 +157,13 @@ def create_run_folder(google_access_token: str, run_id: str) -> Optional[str]:
     
     return run_folder_id
 
+
+def delete_file(google_access_token: str, file_id: str) -> bool:
+    """Deletes a file from Google Drive, returning whether it succeeded."""
+    response = get_http_client().delete(
+        f'https://www.googleapis.com/drive/v3/files/{file_id}',
+        headers={'Authorization': f'Bearer {google_access_token}'}
+    )
+    if not response.is_success:
+        logger.warning(f"Failed to delete file {file_id}: {response.text}")
+    return response.is_success
@@ -0,0 +1,242 @@
+"""
+Concurrent evaluation runner.
+
+Runs the experiments of several configurations at once. Each configuration
+is evaluated by LangSmith in its own thread, and LangSmith fans its
+examples and repetitions out over its own worker threads. A shared limiter
+bounds how many targets run in total and how many calls each provider
+(the LLM providers, and Google for Sheets/Drive) receives at once, so a
+sweep over all configurations is as fast as the rate limits allow.
+
+Provider slots are held around the calls themselves: model calls through a
+callback on the agent's runs (ProviderSlotCallback), and Google calls
+through the shared Google HTTP client's request gate. A run waiting on its
+tools therefore holds no model slot, and every Google call counts.
+"""
+
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langsmith import Client
+
+from leveling.modules.config.model_configs import get_config
+from leveling.modules.kiyo_agents.http_client import use_request_gate
+
+logger = logging.getLogger(__name__)
+
+PROVIDER_OPENAI = "openai"
+PROVIDER_ANTHROPIC = "anthropic"
+PROVIDER_GOOGLE = "google"
+
+# Default caps on concurrent calls per provider
+DEFAULT_PROVIDER_LIMITS = {
+    PROVIDER_OPENAI: 4,
+    PROVIDER_ANTHROPIC: 2,
+    PROVIDER_GOOGLE: 4,
+}
+
+# Examples evaluated at once per configuration; a run over several
+# configurations allows this many for each of them by default
+DEFAULT_MAX_CONCURRENCY = 3
+
+
+def provider_for_model(model_name: str) -> str:
+    """The provider serving a model, as chosen by the agent when it creates the model."""
+    return PROVIDER_ANTHROPIC if "claude" in model_name else PROVIDER_OPENAI
+
+
+class ConcurrencyLimiter:
+    """
+    Bounds concurrent evaluation work: a cap on targets in flight across all
+    experiments, and a cap per provider on calls in flight.
+
+    Also records how long each target took, for the run summary.
+    """
+
+    def __init__(self, max_concurrency: int = DEFAULT_MAX_CONCURRENCY, provider_limits: Optional[Dict[str, int]] = None):
+        self.max_concurrency = max_concurrency
+        self.provider_limits = {**DEFAULT_PROVIDER_LIMITS, **(provider_limits or {})}
+        self._targets = threading.BoundedSemaphore(max_concurrency)
+        self._providers = {provider: threading.BoundedSemaphore(limit) for provider, limit in self.provider_limits.items()}
+        self._lock = threading.Lock()
+        self.target_durations: Dict[str, List[float]] = {}
+
+    @contextmanager
+    def target(self, experiment: str) -> Iterator[None]:
+        """Hold one of the target slots while an example is evaluated."""
+        with self._targets:
+            started = time.monotonic()
+            try:
+                yield
+            finally:
+                with self._lock:
+                    self.target_durations.setdefault(experiment, []).append(time.monotonic() - started)
+
+    def acquire_provider(self, provider: str) -> None:
+        """Take one of a provider's call slots, waiting for one to free up (providers without a limit are not bounded)."""
+        semaphore = self._providers.get(provider)
+        if semaphore is not None:
+            semaphore.acquire()
+
+    def release_provider(self, provider: str) -> None:
+        semaphore = self._providers.get(provider)
+        if semaphore is not None:
+            semaphore.release()
+
+    @contextmanager
+    def provider(self, provider: str) -> Iterator[None]:
+        """Hold one of a provider's call slots."""
+        self.acquire_provider(provider)
+        try:
+            yield
+        finally:
+            self.release_provider(provider)
+
+
+class ProviderSlotCallback(BaseCallbackHandler):
+    """Holds one of a provider's slots for the duration of each model call of the runs it is attached to."""
+
+    def __init__(self, limiter: ConcurrencyLimiter, provider: str):
+        self.limiter = limiter
+        self.provider = provider
+        self._lock = threading.Lock()
+        self._calls: set = set()
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *, run_id: UUID, **kwargs: Any) -> None:
+        self.limiter.acquire_provider(self.provider)
+        with self._lock:
+            self._calls.add(run_id)
+
+    def _release(self, run_id: UUID) -> None:
+        with self._lock:
+            if run_id not in self._calls:
+                return
+            self._calls.discard(run_id)
+        self.limiter.release_provider(self.provider)
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._release(run_id)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._release(run_id)
+
+
+@dataclass
+class ExperimentSummary:
+    """Outcome of one configuration's experiment."""
+    config_name: str
+    wall_seconds: float
+    target_durations: List[float] = field(default_factory=list)
+    results: Any = None
+    error: Optional[str] = None
+
+
+@dataclass
+class EvaluationSummary:
+    """Outcome of a concurrent evaluation run."""
+    wall_seconds: float
+    experiments: List[ExperimentSummary]
+
+    @property
+    def target_seconds(self) -> float:
+        """Time spent in targets, summed: roughly what running them one at a time would take."""
+        return sum(sum(experiment.target_durations) for experiment in self.experiments)
+
+    def format(self) -> str:
+        lines = []
+        for experiment in self.experiments:
+            durations = experiment.target_durations
+            status = f"failed: {experiment.error}" if experiment.error else "ok"
+            mean = sum(durations) / len(durations) if durations else 0.0
+            lines.append(
+                f"{experiment.config_name}: {status}, {len(durations)} runs in {experiment.wall_seconds:.1f}s "
+                f"(mean {mean:.1f}s, max {max(durations, default=0.0):.1f}s per run)"
+            )
+        speedup = self.target_seconds / self.wall_seconds if self.wall_seconds else 0.0
+        lines.append(
+            f"Total: {sum(len(e.target_durations) for e in self.experiments)} runs in {self.wall_seconds:.1f}s wall clock, "
+            f"{self.target_seconds:.1f}s of run time ({speedup:.1f}x concurrency)"
+        )
+        return "\n".join(lines)
+
+
+def run_evaluations(
+    client: Client,
+    config_names: List[str],
+    dataset_name: str,
+    google_access_token: Optional[str],
+    num_repetitions: int = 1,
+    max_concurrency: Optional[int] = None,
+    provider_limits: Optional[Dict[str, int]] = None,
+    config_workers: Optional[int] = None,
+    sheet_pool_size: int = 0,
+    on_complete: Optional[Callable[[ExperimentSummary], None]] = None,
+    run_id: Optional[str] = None,
+) -> EvaluationSummary:
+    """
+    Run the evaluation of several configurations concurrently.
+
+    Args:
+        client: LangSmith client
+        config_names: Configurations to evaluate, one experiment each
+        dataset_name: Dataset to evaluate on
+        google_access_token: Google access token for the sheets
+        num_repetitions: Repetitions of each example
+        max_concurrency: Examples evaluated at once, across all experiments
+            (default: DEFAULT_MAX_CONCURRENCY per experiment; provider limits still apply)
+        provider_limits: Caps on concurrent calls per provider, overriding DEFAULT_PROVIDER_LIMITS
+        config_workers: Experiments run at once (all of them by default)
+        sheet_pool_size: Sheets per template each experiment provisions ahead of use (0 disables the pool)
+        on_complete: Called with each experiment's summary as it finishes
+        run_id: Run ID naming the experiments' Drive folders (a timestamp by default)
+
+    Returns:
+        The summary of the run, with each experiment's results
+    """
+    # Imported here: the pipeline module imports this one
+    from .evaluation import run_evaluation_pipeline
+
+    max_concurrency = max_concurrency or DEFAULT_MAX_CONCURRENCY * max(1, len(config_names))
+    limiter = ConcurrencyLimiter(max_concurrency, provider_limits)
+
+    def run_experiment(config_name: str) -> ExperimentSummary:
+        started = time.monotonic()
+        summary = ExperimentSummary(config_name=config_name, wall_seconds=0.0)
+        try:
+            summary.results = run_evaluation_pipeline(
+                client=client,
+                dataset_name=dataset_name,
+                google_access_token=google_access_token,
+                num_repetitions=num_repetitions,
+                config=get_config(config_name),
+                experiment_prefix=config_name,
+                max_concurrency=max_concurrency,
+                limiter=limiter,
+                sheet_pool_size=sheet_pool_size,
+                run_id=run_id,
+            )
+        except Exception as e:
+            logger.error(f"Error running evaluation for {config_name}: {e}", exc_info=True)
+            summary.error = str(e)
+        summary.wall_seconds = time.monotonic() - started
+        summary.target_durations = limiter.target_durations.get(config_name, [])
+        if on_complete:
+            on_complete(summary)
+        return summary
+
+    started = time.monotonic()
+    # Every Google call of the run, from the agent's tools, sheet creation or extraction, holds a Google slot
+    use_request_gate(lambda: limiter.provider(PROVIDER_GOOGLE))
+    try:
+        with ThreadPoolExecutor(max_workers=config_workers or max(1, len(config_names)), thread_name_prefix="evaluation") as executor:
+            experiments = list(executor.map(run_experiment, config_names))
+    finally:
+        use_request_gate(None)
+    return EvaluationSummary(wall_seconds=time.monotonic() - started, experiments=experiments)
@@ -0,0 +1,94 @@
+"""
+Warm pool of evaluation sheets.
+
+Creating a sheet from a template is a Drive upload that takes seconds. The
+pool converts templates ahead of time in background threads, so an
+evaluation run claims a ready sheet instead of waiting on Drive for every
+example. Sheets are created in the run folder, as they would be on demand.
+
+Provisioning uploads go through the shared Google HTTP client like any other
+Drive call, so under an evaluation's request gate each one holds a Google
+slot on the pool thread making it. A claim waiting for a provisioned sheet
+holds none.
+"""
+
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Deque, Dict, Iterable, Optional
+
+from .file_processing import create_sheet_from_template, delete_file
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SHEET_POOL_WORKERS = 2
+
+
+class TemplateSheetPool:
+    """
+    Pre-provisions sheets from templates for one evaluation run.
+
+    `warm` declares how many sheets a template will need; up to `size` of
+    them are provisioned ahead of their use, and each claim provisions the
+    next one until the declared number is reached. Claims beyond it, or
+    claims of templates that were never warmed, create their sheet on demand.
+    """
+
+    def __init__(self, google_access_token: str, run_folder_id: str, size: int, workers: int = DEFAULT_SHEET_POOL_WORKERS):
+        self.google_access_token = google_access_token
+        self.run_folder_id = run_folder_id
+        self.size = size
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sheet-pool")
+        self._lock = threading.Lock()
+        self._ready: Dict[str, Deque[Future]] = {}
+        # Sheets of each template still to be provisioned
+        self._remaining: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _provision(self, template_path: str) -> None:
+        # Called with the lock held
+        self._remaining[template_path] -= 1
+        self._ready.setdefault(template_path, deque()).append(
+            self._executor.submit(create_sheet_from_template, template_path, self.google_access_token, self.run_folder_id)
+        )
+
+    def warm(self, template_paths: Iterable[str]) -> None:
+        """Start provisioning sheets, one per occurrence of a template in `template_paths`."""
+        with self._lock:
+            for template_path in template_paths:
+                self._remaining[template_path] = self._remaining.get(template_path, 0) + 1
+            for template_path in self._remaining:
+                while self._remaining[template_path] > 0 and len(self._ready.get(template_path, ())) < self.size:
+                    self._provision(template_path)
+
+    def claim(self, template_path: str) -> Optional[str]:
+        """Return the ID of a sheet created from the template: a provisioned one if available, otherwise a new one."""
+        with self._lock:
+            ready = self._ready.get(template_path)
+            future = ready.popleft() if ready else None
+            if future is not None and self._remaining.get(template_path, 0) > 0:
+                self._provision(template_path)
+
+        sheet_id = future.result() if future is not None else None
+        with self._lock:
+            if sheet_id:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return sheet_id or create_sheet_from_template(template_path, self.google_access_token, self.run_folder_id)
+
+    def close(self) -> None:
+        """Stop provisioning and delete the sheets that were never claimed."""
+        with self._lock:
+            futures = [future for ready in self._ready.values() for future in ready]
+            self._ready.clear()
+            self._remaining.clear()
+        for future in futures:
+            future.cancel()
+        self._executor.shutdown(wait=True)
+        unclaimed = [future.result() for future in futures if not future.cancelled() and future.result()]
+        for sheet_id in unclaimed:
+            delete_file(self.google_access_token, sheet_id)
+        logger.info(f"Sheet pool closed: {self.hits} claims served from the pool, {self.misses} created on demand, {len(unclaimed)} unused sheets deleted")
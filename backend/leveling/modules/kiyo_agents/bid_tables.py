@@ -0,0 +1,234 @@
+"""
+Structured line-item extraction from bid PDFs.
+
+Turns the extracted text of a bid into a compact summary: bidder, base bid,
+exclusions, notes and line items (description, quantity, unit, unit price,
+total) with confidence flags. The agent can then be sent this summary
+instead of the raw page text, which is mostly layout noise around a small
+price table.
+
+Extraction is line based and works on the text produced by pdf_processor.
+It recognises tabular rows ending in `qty [unit] unit_price total`,
+`description: $amount` and `description .... $amount` lines, and
+'Excluded' / 'Included' / 'N/A' in place of an amount.
+"""
+
+import re
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+from typing import List, Optional
+
+# Flags on a line item
+FLAG_ARITHMETIC_MISMATCH = "qty_x_unit_price_mismatch"
+FLAG_ZERO_AMOUNT = "zero_amount"
+FLAG_EXCLUDED = "excluded"
+FLAG_INCLUDED_NO_PRICE = "included_no_price"
+
+# Flags on a bid
+FLAG_NO_LINE_ITEMS = "no_line_items_found"
+FLAG_NO_BASE_BID = "no_base_bid_found"
+FLAG_SUM_MISMATCH = "line_items_do_not_sum_to_base_bid"
+
+# Unparsed lines listed in the compact form before the rest are counted only
+MAX_OTHER_LINES = 40
+
+_AMOUNT = r"\(?-?\$?\s?(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d{1,2})?\)?"
+_NON_PRICE = r"(?:excluded|not included|included|incl\.?|n/?a|by others|tbd)"
+
+_TABLE_ROW = re.compile(
+    rf"^(?P<description>.*?[A-Za-z].*?)\s+(?P<quantity>\d[\d,]*(?:\.\d+)?)\s*(?P<unit>[A-Za-z]{{1,6}}\.?)?\s+"
+    rf"(?P<unit_price>{_AMOUNT})\s+(?P<total>{_AMOUNT})$"
+)
+_AMOUNT_LINE = re.compile(
+    rf"^(?P<description>.*?[A-Za-z].*?)\s*(?::|\.{{2,}}|\s-\s|\t|\s{{2,}})\s*(?P<total>{_AMOUNT}|{_NON_PRICE})$",
+    re.IGNORECASE,
+)
+_BULLET = re.compile(r"^(?:[-*•▪●]|\d{1,3}[.)])\s+")
+_FIELD = re.compile(r"^(?P<name>[A-Za-z][A-Za-z /&]{1,40}?)\s*:\s*(?P<value>.*)$")
+_BIDDER = re.compile(r"\bbid\b\s*[-–:]\s*(?P<name>.+)$", re.IGNORECASE)
+
+_BASE_BID_FIELDS = {"base bid", "total bid", "bid amount", "total", "lump sum", "total base bid", "contract sum"}
+_EXCLUSION_FIELDS = {"exclusions", "excludes", "excluded", "not included"}
+_NOTE_FIELDS = {"notes", "note", "inclusions", "includes", "clarifications", "qualifications", "scope"}
+_BIDDER_FIELDS = {"bidder", "company", "contractor", "subcontractor", "from"}
+# Fields whose numbers are not prices
+_IGNORED_FIELDS = {"date", "bid date", "phone", "tel", "fax", "zip", "license", "license no", "project", "project no", "job", "job no", "page"}
+_SECTION_HEADERS = {"line items", "schedule of values", "breakdown", "pricing", "bid items", "items"}
+
+
+def parse_amount(text: str) -> Optional[Decimal]:
+    """Parse '$1,234.50', '1234' or '(500)' into a Decimal; None if it is not an amount."""
+    cleaned = text.strip()
+    negative = cleaned.startswith("(") and cleaned.endswith(")") or cleaned.startswith("-")
+    cleaned = cleaned.strip("()").replace("$", "").replace(",", "").replace("-", "").strip()
+    try:
+        amount = Decimal(cleaned)
+    except InvalidOperation:
+        return None
+    return -amount if negative else amount
+
+
+def format_amount(amount: Optional[Decimal]) -> str:
+    return "-" if amount is None else f"${amount:,.2f}"
+
+
+@dataclass
+class LineItem:
+    """One priced line of a bid."""
+    description: str
+    total: Optional[Decimal] = None
+    quantity: Optional[Decimal] = None
+    unit: Optional[str] = None
+    unit_price: Optional[Decimal] = None
+    flags: List[str] = field(default_factory=list)
+
+    @property
+    def confidence(self) -> str:
+        if FLAG_ARITHMETIC_MISMATCH in self.flags:
+            return "low"
+        if self.flags or self.total is None:
+            return "medium"
+        return "high"
+
+
+@dataclass
+class BidTable:
+    """The structured content of one bid document."""
+    bidder: Optional[str] = None
+    base_bid: Optional[Decimal] = None
+    line_items: List[LineItem] = field(default_factory=list)
+    exclusions: List[str] = field(default_factory=list)
+    notes: List[str] = field(default_factory=list)
+    other_lines: List[str] = field(default_factory=list)
+    flags: List[str] = field(default_factory=list)
+
+    @property
+    def line_items_total(self) -> Decimal:
+        return sum((item.total for item in self.line_items if item.total is not None), Decimal(0))
+
+    def to_compact_text(self) -> str:
+        """Render the bid as a compact, token-cheap summary for the agent."""
+        lines = [
+            f"Bidder: {self.bidder or 'unknown'}",
+            f"Base bid: {format_amount(self.base_bid)}",
+            f"Exclusions: {'; '.join(self.exclusions) if self.exclusions else 'none listed'}",
+        ]
+        if self.notes:
+            lines.append(f"Notes: {' '.join(self.notes)}")
+        lines.append("Line items:")
+        for item in self.line_items:
+            line = f"- {item.description}: {format_amount(item.total)}"
+            if item.quantity is not None:
+                line += f" ({item.quantity} {item.unit or 'ea'} @ {format_amount(item.unit_price)})"
+            if item.confidence != "high":
+                line += f" [{item.confidence} confidence: {', '.join(item.flags) or 'no amount'}]"
+            lines.append(line)
+        check = "matches" if FLAG_SUM_MISMATCH not in self.flags else "does NOT match"
+        if self.base_bid is not None and self.line_items:
+            lines.append(f"Check: line items sum to {format_amount(self.line_items_total)}, which {check} the base bid")
+        if self.flags:
+            lines.append(f"Flags: {', '.join(self.flags)}")
+        if self.other_lines:
+            lines.append("Other text:")
+            lines.extend(self.other_lines[:MAX_OTHER_LINES])
+            if len(self.other_lines) > MAX_OTHER_LINES:
+                lines.append(f"[{len(self.other_lines) - MAX_OTHER_LINES} more lines omitted]")
+        return "\n".join(lines)
+
+
+def _split_list(value: str) -> List[str]:
+    return [part.strip(" .") for part in re.split(r"[;,]", value) if part.strip(" .")]
+
+
+def _parse_line_item(line: str) -> Optional[LineItem]:
+    row = _TABLE_ROW.match(line)
+    if row:
+        item = LineItem(
+            description=row.group("description").strip(" :-"),
+            quantity=parse_amount(row.group("quantity")),
+            unit=(row.group("unit") or "").rstrip(".") or None,
+            unit_price=parse_amount(row.group("unit_price")),
+            total=parse_amount(row.group("total")),
+        )
+        if None not in (item.quantity, item.unit_price, item.total) and abs(item.quantity * item.unit_price - item.total) > Decimal("0.01") * max(1, abs(item.total)):
+            item.flags.append(FLAG_ARITHMETIC_MISMATCH)
+        return item
+
+    amount_line = _AMOUNT_LINE.match(line)
+    if amount_line:
+        description = amount_line.group("description").strip(" :-")
+        amount_text = amount_line.group("total")
+        item = LineItem(description=description, total=parse_amount(amount_text))
+        if item.total is None:
+            lowered = amount_text.lower()
+            item.flags.append(FLAG_INCLUDED_NO_PRICE if lowered.startswith("incl") else FLAG_EXCLUDED)
+        return item
+    return None
+
+
+def extract_bid_table(text: str) -> BidTable:
+    """
+    Extract the structured content of a bid from its text.
+
+    Args:
+        text: Text of the bid document (as extracted by pdf_processor)
+
+    Returns:
+        The BidTable, with flags marking anything that could not be confirmed
+    """
+    bid = BidTable()
+    current_list: Optional[List[str]] = None
+
+    for raw_line in text.splitlines():
+        line = raw_line.strip()
+        if not line:
+            current_list = None
+            continue
+        is_bullet = bool(_BULLET.match(line))
+        content = _BULLET.sub("", line)
+
+        field_match = _FIELD.match(content)
+        field_name = field_match.group("name").strip().lower() if field_match else None
+
+        if field_name in _BASE_BID_FIELDS and parse_amount(field_match.group("value")) is not None and bid.base_bid is None:
+            bid.base_bid = parse_amount(field_match.group("value"))
+            current_list = None
+        elif field_name in _EXCLUSION_FIELDS:
+            bid.exclusions.extend(_split_list(field_match.group("value")))
+            current_list = bid.exclusions
+        elif field_name in _NOTE_FIELDS:
+            if field_match.group("value"):
+                bid.notes.append(field_match.group("value"))
+            current_list = bid.notes
+        elif field_name in _BIDDER_FIELDS and field_match.group("value") and not bid.bidder:
+            bid.bidder = field_match.group("value")
+        elif field_name in _IGNORED_FIELDS:
+            bid.other_lines.append(line)
+        elif content.rstrip(":").lower() in _SECTION_HEADERS:
+            current_list = None
+        elif (item := _parse_line_item(content)) is not None:
+            bid.line_items.append(item)
+            current_list = None
+        elif is_bullet and current_list is not None:
+            # Bulleted continuation of an exclusions or notes list
+            current_list.append(content)
+        elif not bid.bidder and (bidder := _BIDDER.search(content)):
+            bid.bidder = bidder.group("name").strip()
+        else:
+            bid.other_lines.append(line)
+
+    exclusions = [exclusion.lower() for exclusion in bid.exclusions]
+    for item in bid.line_items:
+        if item.total == 0 and FLAG_ZERO_AMOUNT not in item.flags:
+            item.flags.append(FLAG_ZERO_AMOUNT)
+        description = item.description.lower()
+        if FLAG_EXCLUDED not in item.flags and any(exclusion and (exclusion in description or description in exclusion) for exclusion in exclusions):
+            item.flags.append(FLAG_EXCLUDED)
+
+    if not bid.line_items:
+        bid.flags.append(FLAG_NO_LINE_ITEMS)
+    if bid.base_bid is None:
+        bid.flags.append(FLAG_NO_BASE_BID)
+    elif bid.line_items and abs(bid.line_items_total - bid.base_bid) > Decimal("0.01"):
+        bid.flags.append(FLAG_SUM_MISMATCH)
+    return bid
@@ -0,0 +1,708 @@
+"""
+Checkpointers for the agent's conversation threads.
+
+`DatabaseCheckpointSaver` keeps LangGraph checkpoints in the project database
+(DATABASE_URL: Postgres in production, SQLite for tests) through the Django
+ORM, so a follow-up message can land on any worker or node and conversations
+survive restarts. Channel values are stored once per version and old
+checkpoints are pruned, so storage grows with the conversation rather than
+with every step of it. Connections come from Django's connection handling
+(persistent connections, or the psycopg pool when DATABASE_POOL is enabled),
+held by the saver's own query threads.
+
+`BoundedCheckpointSaver` is the in-process alternative: an in-memory saver
+with a memory budget, LRU/TTL eviction of whole threads and optional spill
+of evicted threads to local disk.
+"""
+
+import os
+import time
+import pickle
+import random
+import asyncio
+import operator
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import reduce
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+    writes_sort_key,
+)
+from langgraph.checkpoint.memory import InMemorySaver
+
+logger = logging.getLogger(__name__)
+
+# Checkpoints loaded per query when listing
+LIST_PAGE_SIZE = 100
+
+_DB_THREAD_PREFIX = "checkpoint-db"
+
+
+def _with_connection(fn, *args):
+    """Run a call on a saver thread, releasing or recycling its connection around it as a request would."""
+    close_old_connections()
+    try:
+        return fn(*args)
+    finally:
+        close_old_connections()
+
+
+def _version_number(version: str) -> int:
+    """Leading counter of a channel version."""
+    return int(version.split(".")[0])
+
+
+class DatabaseCheckpointSaver(BaseCheckpointSaver):
+    """
+    LangGraph checkpoint saver backed by the AgentCheckpoint, AgentCheckpointBlob
+    and AgentCheckpointWrite models.
+
+    As in LangGraph's Postgres saver, channel values are stored once per
+    (channel, version) as blobs, and a checkpoint row only records the version
+    of each channel, so channels that did not change are not written again.
+    Only the latest `history` checkpoints of a conversation are kept, with the
+    blobs they reference; older ones are pruned every `prune_every` saves.
+
+    Queries run on `db_threads` long-lived threads owned by the saver, which
+    release or recycle their connections around each call like a request
+    would. Calls from LangGraph's short-lived worker threads and from async
+    code therefore never leave connections behind (0 runs queries in the
+    calling thread, whose connections the caller manages).
+    """
+
+    def __init__(self, history: int = 20, prune_every: int = 10, db_threads: int = 4):
+        super().__init__()
+        self.history = history
+        self.prune_every = max(1, prune_every)
+        self._executor = ThreadPoolExecutor(max_workers=db_threads, thread_name_prefix=_DB_THREAD_PREFIX) if db_threads > 0 else None
+
+    # Database access
+
+    def _run(self, fn, *args):
+        """Run a database call on the saver's threads (inline on one of them, or without threads)."""
+        if self._executor is None or threading.current_thread().name.startswith(_DB_THREAD_PREFIX):
+            return fn(*args)
+        return self._executor.submit(_with_connection, fn, *args).result()
+
+    async def _arun(self, fn, *args):
+        if self._executor is None:
+            return await sync_to_async(fn, thread_sensitive=True)(*args)
+        return await asyncio.wrap_future(self._executor.submit(_with_connection, fn, *args))
+
+    # Loading
+
+    def _to_tuples(self, rows: Sequence[Any]) -> List[CheckpointTuple]:
+        """Build the tuples of checkpoint rows, loading their writes and blobs in one query each."""
+        from leveling.models import AgentCheckpointBlob, AgentCheckpointWrite
+
+        if not rows:
+            return []
+        by_thread: Dict[Tuple[str, str], List[Any]] = defaultdict(list)
+        for row in rows:
+            by_thread[(row.thread_id, row.checkpoint_ns)].append(row)
+
+        writes: Dict[Tuple[str, str, str], List[Any]] = defaultdict(list)
+        writes_query = reduce(operator.or_, (
+            Q(thread_id=thread_id, checkpoint_ns=checkpoint_ns, checkpoint_id__in=[row.checkpoint_id for row in thread_rows])
+            for (thread_id, checkpoint_ns), thread_rows in by_thread.items()
+        ))
+        for write in AgentCheckpointWrite.objects.filter(writes_query):
+            writes[(write.thread_id, write.checkpoint_ns, write.checkpoint_id)].append(write)
+
+        checkpoints = [self.serde.loads_typed((row.checkpoint_type, bytes(row.checkpoint))) for row in rows]
+        wanted: Dict[Tuple[str, str], set] = defaultdict(set)
+        for row, checkpoint in zip(rows, checkpoints):
+            wanted[(row.thread_id, row.checkpoint_ns)].update(checkpoint["channel_versions"].values())
+        blobs: Dict[Tuple[str, str, str, str], Tuple[str, bytes]] = {}
+        blobs_query = reduce(operator.or_, (
+            Q(thread_id=thread_id, checkpoint_ns=checkpoint_ns, version__in=versions)
+            for (thread_id, checkpoint_ns), versions in wanted.items()
+        ))
+        for blob in AgentCheckpointBlob.objects.filter(blobs_query):
+            blobs[(blob.thread_id, blob.checkpoint_ns, blob.channel, blob.version)] = (blob.value_type, bytes(blob.value))
+
+        tuples = []
+        for row, checkpoint in zip(rows, checkpoints):
+            checkpoint["channel_values"] = {}
+            for channel, version in checkpoint["channel_versions"].items():
+                blob = blobs.get((row.thread_id, row.checkpoint_ns, channel, version))
+                if blob is not None and blob[0] != "empty":
+                    checkpoint["channel_values"][channel] = self.serde.loads_typed(blob)
+            row_writes = sorted(
+                writes[(row.thread_id, row.checkpoint_ns, row.checkpoint_id)],
+                key=lambda write: writes_sort_key(write.task_path, write.task_id, write.idx),
+            )
+            tuples.append(CheckpointTuple(
+                config={
+                    "configurable": {
+                        "thread_id": row.thread_id,
+                        "checkpoint_ns": row.checkpoint_ns,
+                        "checkpoint_id": row.checkpoint_id,
+                    }
+                },
+                checkpoint=checkpoint,
+                metadata=self.serde.loads_typed((row.metadata_type, bytes(row.metadata))),
+                parent_config=(
+                    {
+                        "configurable": {
+                            "thread_id": row.thread_id,
+                            "checkpoint_ns": row.checkpoint_ns,
+                            "checkpoint_id": row.parent_checkpoint_id,
+                        }
+                    }
+                    if row.parent_checkpoint_id
+                    else None
+                ),
+                pending_writes=[
+                    (write.task_id, write.channel, self.serde.loads_typed((write.value_type, bytes(write.value))))
+                    for write in row_writes
+                ],
+            ))
+        return tuples
+
+    def _get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        from leveling.models import AgentCheckpoint
+
+        rows = AgentCheckpoint.objects.filter(
+            thread_id=config["configurable"]["thread_id"],
+            checkpoint_ns=config["configurable"].get("checkpoint_ns", ""),
+        )
+        if checkpoint_id := get_checkpoint_id(config):
+            row = rows.filter(checkpoint_id=checkpoint_id).first()
+        else:
+            # Checkpoint IDs are time-ordered, so the greatest one is the latest
+            row = rows.order_by("-checkpoint_id").first()
+        return self._to_tuples([row])[0] if row else None
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        """Get the checkpoint named by the config, or the thread's latest one."""
+        return self._run(self._get_tuple, config)
+
+    def _list_page(
+        self,
+        config: Optional[RunnableConfig],
+        before: Optional[RunnableConfig],
+        offset: int,
+        page_size: int,
+    ) -> List[CheckpointTuple]:
+        from leveling.models import AgentCheckpoint
+
+        rows = AgentCheckpoint.objects.all()
+        if config:
+            rows = rows.filter(thread_id=config["configurable"]["thread_id"])
+            if (checkpoint_ns := config["configurable"].get("checkpoint_ns")) is not None:
+                rows = rows.filter(checkpoint_ns=checkpoint_ns)
+            if checkpoint_id := get_checkpoint_id(config):
+                rows = rows.filter(checkpoint_id=checkpoint_id)
+        if before and (before_checkpoint_id := get_checkpoint_id(before)):
+            rows = rows.filter(checkpoint_id__lt=before_checkpoint_id)
+        return self._to_tuples(list(rows.order_by("-checkpoint_id", "-id")[offset:offset + page_size]))
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        """List checkpoints, newest first, matching the config, metadata filter and `before` bound."""
+        offset = 0
+        while limit is None or limit > 0:
+            # Without a metadata filter every row counts, so no more than `limit` are fetched
+            page_size = LIST_PAGE_SIZE if filter or limit is None else min(limit, LIST_PAGE_SIZE)
+            page = self._run(self._list_page, config, before, offset, page_size)
+            for checkpoint_tuple in page:
+                if filter and not all(checkpoint_tuple.metadata.get(key) == value for key, value in filter.items()):
+                    continue
+                if limit is not None:
+                    if limit <= 0:
+                        return
+                    limit -= 1
+                yield checkpoint_tuple
+            if len(page) < page_size:
+                return
+            offset += page_size
+
+    # Saving
+
+    def _put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        from leveling.models import AgentCheckpoint, AgentCheckpointBlob
+
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        stored = checkpoint.copy()
+        values = stored.pop("channel_values")
+        blobs = []
+        for channel, version in new_versions.items():
+            value_type, value = self.serde.dumps_typed(values[channel]) if channel in values else ("empty", b"")
+            blobs.append(AgentCheckpointBlob(
+                thread_id=thread_id,
+                checkpoint_ns=checkpoint_ns,
+                channel=channel,
+                version=str(version),
+                value_type=value_type,
+                value=value,
+            ))
+        checkpoint_type, serialized_checkpoint = self.serde.dumps_typed(stored)
+        metadata_type, serialized_metadata = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+        with transaction.atomic():
+            # A (channel, version) always holds the same value, so existing blobs are kept
+            AgentCheckpointBlob.objects.bulk_create(blobs, ignore_conflicts=True)
+            AgentCheckpoint.objects.update_or_create(
+                thread_id=thread_id,
+                checkpoint_ns=checkpoint_ns,
+                checkpoint_id=checkpoint["id"],
+                defaults={
+                    "parent_checkpoint_id": config["configurable"].get("checkpoint_id"),
+                    "checkpoint_type": checkpoint_type,
+                    "checkpoint": serialized_checkpoint,
+                    "metadata_type": metadata_type,
+                    "metadata": serialized_metadata,
+                },
+            )
+        if self.history > 0:
+            self._prune(thread_id, checkpoint_ns)
+        return {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"],
+            }
+        }
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        """Save a checkpoint and return the config pointing at it."""
+        return self._run(self._put, config, checkpoint, metadata, new_versions)
+
+    def _prune(self, thread_id: str, checkpoint_ns: str) -> None:
+        """Delete checkpoints past the latest `history` (once `prune_every` have accumulated), with their writes and blobs."""
+        from leveling.models import AgentCheckpoint, AgentCheckpointBlob, AgentCheckpointWrite
+
+        rows = AgentCheckpoint.objects.filter(thread_id=thread_id, checkpoint_ns=checkpoint_ns)
+        newest_first = rows.order_by("-checkpoint_id").values_list("checkpoint_id", flat=True)
+        if not newest_first[self.history + self.prune_every - 1:self.history + self.prune_every].exists():
+            return
+        oldest_kept = rows.get(checkpoint_id=newest_first[self.history - 1])
+        # Versions only grow along a thread, so the oldest kept checkpoint holds the
+        # lowest version of each channel still referenced; older blobs are unused
+        kept_versions = self.serde.loads_typed((oldest_kept.checkpoint_type, bytes(oldest_kept.checkpoint)))["channel_versions"]
+        with transaction.atomic():
+            AgentCheckpointWrite.objects.filter(
+                thread_id=thread_id, checkpoint_ns=checkpoint_ns, checkpoint_id__lt=oldest_kept.checkpoint_id
+            ).delete()
+            rows.filter(checkpoint_id__lt=oldest_kept.checkpoint_id).delete()
+            unused_blobs = [
+                blob_id
+                for blob_id, channel, version in AgentCheckpointBlob.objects.filter(
+                    thread_id=thread_id, checkpoint_ns=checkpoint_ns
+                ).values_list("id", "channel", "version")
+                if channel in kept_versions and _version_number(version) < _version_number(kept_versions[channel])
+            ]
+            if unused_blobs:
+                AgentCheckpointBlob.objects.filter(id__in=unused_blobs).delete()
+
+    def _put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        from leveling.models import AgentCheckpointWrite
+
+        lookup = {
+            "thread_id": config["configurable"]["thread_id"],
+            "checkpoint_ns": config["configurable"].get("checkpoint_ns", ""),
+            "checkpoint_id": config["configurable"]["checkpoint_id"],
+            "task_id": task_id,
+        }
+        with transaction.atomic():
+            for idx, (channel, value) in enumerate(writes):
+                write_idx = WRITES_IDX_MAP.get(channel, idx)
+                value_type, serialized_value = self.serde.dumps_typed(value)
+                defaults = {
+                    "task_path": task_path,
+                    "channel": channel,
+                    "value_type": value_type,
+                    "value": serialized_value,
+                }
+                # Special writes (errors, interrupts...) replace earlier ones; regular writes are kept once
+                if write_idx < 0:
+                    AgentCheckpointWrite.objects.update_or_create(**lookup, idx=write_idx, defaults=defaults)
+                else:
+                    AgentCheckpointWrite.objects.get_or_create(**lookup, idx=write_idx, defaults=defaults)
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        """Save a task's pending writes against the checkpoint in the config."""
+        self._run(self._put_writes, config, writes, task_id, task_path)
+
+    def _delete_thread(self, thread_id: str) -> None:
+        from leveling.models import AgentCheckpoint, AgentCheckpointBlob, AgentCheckpointWrite
+
+        with transaction.atomic():
+            AgentCheckpointWrite.objects.filter(thread_id=thread_id).delete()
+            AgentCheckpointBlob.objects.filter(thread_id=thread_id).delete()
+            AgentCheckpoint.objects.filter(thread_id=thread_id).delete()
+
+    def delete_thread(self, thread_id: str) -> None:
+        """Delete all checkpoints, blobs and writes of a thread."""
+        self._run(self._delete_thread, thread_id)
+
+    def get_next_version(self, current: Optional[str], channel: None) -> str:
+        """
+        Next version of a channel: a counter with a random suffix, as in LangGraph's
+        own savers, so a forked thread never reuses a blob key with different values.
+        """
+        return f"{(_version_number(current) if current else 0) + 1:032}.{random.random():016}"
+
+    # The ORM is synchronous: async variants run on the saver's threads
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await self._arun(self._get_tuple, config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        checkpoint_tuples = await self._arun(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for checkpoint_tuple in checkpoint_tuples:
+            yield checkpoint_tuple
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return await self._arun(self._put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        await self._arun(self._put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await self._arun(self._delete_thread, thread_id)
+
+
+def _stored_size(value: Any) -> int:
+    """Approximate resident size of InMemorySaver entries (serialized payloads dominate)."""
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        return sum(_stored_size(item) for item in value)
+    if isinstance(value, dict):
+        return sum(_stored_size(item) for item in value.values())
+    return 0
+
+
+class BoundedCheckpointSaver(BaseCheckpointSaver):
+    """
+    In-memory checkpoint saver with a memory budget.
+
+    Whole threads are evicted least recently used first once the stored
+    checkpoints exceed `max_bytes`, and threads idle for longer than
+    `ttl_seconds` are evicted on the next access. With a `spill_dir`,
+    evicted threads are written to disk and loaded back transparently when
+    the conversation continues; without one they are dropped.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 256 * 1024 * 1024,
+        ttl_seconds: Optional[float] = None,
+        spill_dir: Optional[str] = None,
+    ):
+        self._saver = InMemorySaver()
+        super().__init__(serde=self._saver.serde)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.spill_dir = spill_dir
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+        # Resident threads in LRU order, with their size and last access time
+        self._threads: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.spills = 0
+        self.restores = 0
+
+    @property
+    def resident_bytes(self) -> int:
+        with self._lock:
+            return sum(size for size, _ in self._threads.values())
+
+    def stats(self) -> Dict[str, int]:
+        """Counters for monitoring the cache."""
+        with self._lock:
+            return {
+                "threads": len(self._threads),
+                "resident_bytes": self.resident_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "spills": self.spills,
+                "restores": self.restores,
+            }
+
+    def _spill_path(self, thread_id: str) -> str:
+        return os.path.join(self.spill_dir, hashlib.sha256(thread_id.encode()).hexdigest() + ".pkl")
+
+    def _thread_entries(self, thread_id: str) -> Dict[str, Any]:
+        """The saver's entries for one thread, as plain dicts."""
+        return {
+            "storage": {ns: dict(checkpoints) for ns, checkpoints in self._saver.storage.get(thread_id, {}).items()},
+            "writes": {key: dict(value) for key, value in self._saver.writes.items() if key[0] == thread_id},
+            "blobs": {key: value for key, value in self._saver.blobs.items() if key[0] == thread_id},
+        }
+
+    def _touch(self, thread_id: str) -> None:
+        """Mark a thread as used, expiring idle threads and restoring it from disk if it was spilled."""
+        now = time.monotonic()
+        if self.ttl_seconds:
+            for idle_thread_id, (_, last_access) in list(self._threads.items()):
+                if now - last_access < self.ttl_seconds:
+                    break
+                if idle_thread_id != thread_id:
+                    self._evict(idle_thread_id)
+
+        if thread_id in self._threads:
+            size, _ = self._threads[thread_id]
+        elif self.spill_dir and os.path.exists(self._spill_path(thread_id)):
+            size = self._restore(thread_id)
+        else:
+            size = 0
+        self._threads[thread_id] = (size, now)
+        self._threads.move_to_end(thread_id)
+
+    def _restore(self, thread_id: str) -> int:
+        path = self._spill_path(thread_id)
+        with open(path, "rb") as f:
+            entries = pickle.load(f)
+        os.remove(path)
+        for ns, checkpoints in entries["storage"].items():
+            self._saver.storage[thread_id][ns].update(checkpoints)
+        for key, value in entries["writes"].items():
+            self._saver.writes[key] = value
+        self._saver.blobs.update(entries["blobs"])
+        self.restores += 1
+        logger.info(f"Restored conversation {thread_id} from disk")
+        return _stored_size(entries)
+
+    def _evict(self, thread_id: str) -> None:
+        """Remove a thread from memory, spilling it to disk first when enabled."""
+        if self.spill_dir:
+            path = self._spill_path(thread_id)
+            with open(path + ".tmp", "wb") as f:
+                pickle.dump(self._thread_entries(thread_id), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(path + ".tmp", path)
+            self.spills += 1
+        self._saver.delete_thread(thread_id)
+        self._threads.pop(thread_id, None)
+        self.evictions += 1
+        logger.info(f"Evicted conversation {thread_id} from memory (spilled: {bool(self.spill_dir)})")
+
+    def _grow(self, thread_id: str, added_bytes: int) -> None:
+        """Account for new data on a thread and evict other threads past the budget."""
+        size, last_access = self._threads[thread_id]
+        self._threads[thread_id] = (size + added_bytes, last_access)
+        total = self.resident_bytes
+        # The thread being written is most recently used and is never evicted itself
+        for lru_thread_id in list(self._threads):
+            if total <= self.max_bytes or lru_thread_id == thread_id:
+                break
+            total -= self._threads[lru_thread_id][0]
+            self._evict(lru_thread_id)
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        with self._lock:
+            self._touch(thread_id)
+            checkpoint_tuple = self._saver.get_tuple(config)
+            if checkpoint_tuple is None:
+                self.misses += 1
+                # Nothing stored: do not keep an empty entry around
+                if not self._threads[thread_id][0]:
+                    del self._threads[thread_id]
+            else:
+                self.hits += 1
+            return checkpoint_tuple
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        """List checkpoints of a thread (restoring it if spilled), or of all resident threads."""
+        with self._lock:
+            if config:
+                self._touch(config["configurable"]["thread_id"])
+            checkpoint_tuples = list(self._saver.list(config, filter=filter, before=before, limit=limit))
+        yield from checkpoint_tuples
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        with self._lock:
+            self._touch(thread_id)
+            next_config = self._saver.put(config, checkpoint, metadata, new_versions)
+            added_bytes = _stored_size(self._saver.storage[thread_id][checkpoint_ns][checkpoint["id"]]) + sum(
+                _stored_size(self._saver.blobs.get((thread_id, checkpoint_ns, channel, version)))
+                for channel, version in new_versions.items()
+            )
+            self._grow(thread_id, added_bytes)
+            return next_config
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        thread_id = config["configurable"]["thread_id"]
+        key = (thread_id, config["configurable"].get("checkpoint_ns", ""), config["configurable"]["checkpoint_id"])
+        with self._lock:
+            self._touch(thread_id)
+            before_bytes = _stored_size(self._saver.writes.get(key, {}))
+            self._saver.put_writes(config, writes, task_id, task_path)
+            self._grow(thread_id, _stored_size(self._saver.writes.get(key, {})) - before_bytes)
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            self._saver.delete_thread(thread_id)
+            self._threads.pop(thread_id, None)
+            if self.spill_dir and os.path.exists(self._spill_path(thread_id)):
+                os.remove(self._spill_path(thread_id))
+
+    def get_next_version(self, current: Optional[str], channel: None) -> str:
+        return self._saver.get_next_version(current, channel)
+
+    # Any call may spill evicted threads to disk or load one back: async variants run on threads
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        checkpoint_tuples = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for checkpoint_tuple in checkpoint_tuples:
+            yield checkpoint_tuple
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+
+_checkpointer: Optional[BaseCheckpointSaver] = None
+_checkpointer_lock = threading.Lock()
+
+
+def get_checkpointer() -> BaseCheckpointSaver:
+    """
+    Return the process-wide checkpointer selected by the AGENT_CHECKPOINTER setting.
+
+    "database" (default) shares conversations across workers through the
+    database; "memory" keeps them in this process only, within the
+    AGENT_MEMORY_* budget.
+    """
+    global _checkpointer
+    if _checkpointer is None:
+        with _checkpointer_lock:
+            if _checkpointer is None:
+                backend = getattr(settings, 'AGENT_CHECKPOINTER', 'database')
+                if backend == 'database':
+                    _checkpointer = DatabaseCheckpointSaver(
+                        history=getattr(settings, 'AGENT_CHECKPOINT_HISTORY', 20),
+                        db_threads=getattr(settings, 'AGENT_CHECKPOINT_DB_THREADS', 4),
+                    )
+                elif backend == 'memory':
+                    ttl_seconds = getattr(settings, 'AGENT_MEMORY_TTL_SECONDS', 0)
+                    _checkpointer = BoundedCheckpointSaver(
+                        max_bytes=getattr(settings, 'AGENT_MEMORY_MAX_BYTES', 256 * 1024 * 1024),
+                        ttl_seconds=ttl_seconds or None,
+                        spill_dir=getattr(settings, 'AGENT_MEMORY_SPILL_DIR', '') or None,
+                    )
+                else:
+                    raise ValueError(f"Invalid AGENT_CHECKPOINTER: {backend}")
+                logger.info(f"Using {type(_checkpointer).__name__} for agent conversations")
+    return _checkpointer
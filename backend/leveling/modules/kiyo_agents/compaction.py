@@ -0,0 +1,121 @@
+"""
+Context compaction for the agent graph.
+
+Keeps the conversation sent to the model under a token budget. The most
+recent turns are kept verbatim; in older turns, tool outputs and PDF text
+the agent has already worked through are replaced with short placeholders
+first, then any other oversized message is truncated. Compacted messages keep
+their IDs, so returning them from a node replaces the originals in the
+checkpointed state instead of appending to it.
+"""
+
+import re
+from typing import List, Sequence
+
+from langchain_core.messages import BaseMessage, HumanMessage, ToolMessage
+
+from .tokens import count_message_tokens, count_tokens, message_text
+
+ELIDED_MARKER = "[Elided"
+
+# Messages smaller than this are left alone: eliding them saves little
+MIN_ELIDE_TOKENS = 200
+
+# Characters kept from an oversized old message when it is truncated
+TRUNCATED_PREVIEW_CHARS = 800
+
+PDF_BLOCK_PATTERN = re.compile(
+    r"--- PDF Content Start: (?P<filename>.*?) ---\n(?P<content>.*?)\n--- PDF Content End: (?P=filename) ---",
+    re.DOTALL,
+)
+
+
+def _recent_start(messages: Sequence[BaseMessage], keep_recent_turns: int) -> int:
+    """Index of the first message of the last `keep_recent_turns` user turns."""
+    seen_turns = 0
+    for index in range(len(messages) - 1, -1, -1):
+        if isinstance(messages[index], HumanMessage):
+            seen_turns += 1
+            if seen_turns == keep_recent_turns:
+                return index
+    return 0
+
+
+def _elide_tool_output(message: ToolMessage, model_name: str) -> str:
+    text = message_text(message.content)
+    return (
+        f"{ELIDED_MARKER} earlier output of {message.name or 'tool'} "
+        f"({count_tokens(text, model_name)} tokens). Call the tool again if it is needed.]"
+    )
+
+
+def _elide_pdf_blocks(text: str, model_name: str) -> str:
+    def placeholder(match: re.Match) -> str:
+        tokens = count_tokens(match.group("content"), model_name)
+        return (
+            f"--- PDF Content: {match.group('filename')} "
+            f"{ELIDED_MARKER}: {tokens} tokens, already processed earlier in this conversation] ---"
+        )
+
+    return PDF_BLOCK_PATTERN.sub(placeholder, text)
+
+
+def _truncate(text: str) -> str:
+    return f"{text[:TRUNCATED_PREVIEW_CHARS]}\n{ELIDED_MARKER}: the rest of this earlier message was removed to save context.]"
+
+
+def compact_messages(
+    messages: Sequence[BaseMessage],
+    token_budget: int,
+    model_name: str = "gpt-4o",
+    keep_recent_turns: int = 2,
+    reserved_tokens: int = 0,
+) -> List[BaseMessage]:
+    """
+    Compact a conversation to fit a token budget.
+
+    Args:
+        messages: The conversation, oldest first
+        token_budget: Maximum tokens for the messages plus `reserved_tokens`
+        model_name: Model whose tokenizer is used for counting
+        keep_recent_turns: Number of most recent user turns never modified
+        reserved_tokens: Tokens already used by content sent alongside (e.g. system instructions)
+
+    Returns:
+        Replacement copies (same IDs) of the messages that were compacted; empty if the conversation fits
+    """
+    total = reserved_tokens + count_message_tokens(messages, model_name)
+    if total <= token_budget:
+        return []
+
+    old_messages = messages[:_recent_start(messages, keep_recent_turns)]
+    replacements = {}
+
+    def replace(index: int, new_text: str) -> None:
+        nonlocal total
+        message = replacements.get(index, old_messages[index])
+        total -= count_tokens(message_text(message.content), model_name) - count_tokens(new_text, model_name)
+        replacements[index] = message.model_copy(update={"content": new_text})
+
+    # Pass 1: outputs of old tool calls and PDF text of old turns, oldest first
+    for index, message in enumerate(old_messages):
+        if total <= token_budget:
+            break
+        text = message_text(message.content)
+        if count_tokens(text, model_name) < MIN_ELIDE_TOKENS:
+            continue
+        if isinstance(message, ToolMessage) and not text.startswith(ELIDED_MARKER):
+            replace(index, _elide_tool_output(message, model_name))
+        elif isinstance(message, HumanMessage) and PDF_BLOCK_PATTERN.search(text):
+            replace(index, _elide_pdf_blocks(text, model_name))
+
+    # Pass 2: truncate whatever old message is still oversized
+    for index in range(len(old_messages)):
+        if total <= token_budget:
+            break
+        message = replacements.get(index, old_messages[index])
+        text = message_text(message.content)
+        if count_tokens(text, model_name) >= MIN_ELIDE_TOKENS and ELIDED_MARKER not in text[-200:]:
+            replace(index, _truncate(text))
+
+    return [replacements[index] for index in sorted(replacements)]
@@ -1,6 +1,7 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator, Iterator, Tuple
 from typing_extensions import TypedDict, Annotated
 import logging
+import threading
 
 from langchain_openai import ChatOpenAI
 from langchain_anthropic import ChatAnthropic
@@ -8,21 +9,32 @@ from langgraph.graph import StateGraph, END, START
 from langgraph.prebuilt import ToolNode
 from langgraph.graph.message import add_messages
 from langchain_core.messages import AIMessage, HumanMessage, BaseMessage, SystemMessage
+from langchain_core.runnables import RunnableLambda
 from langchain.tools import tool
-from langgraph.checkpoint.memory import MemorySaver
 
-from .google_sheets_service import GoogleSheetsService
-from .tools import create_google_sheets_tools
+from ..config.model_configs import DEFAULT_CONTEXT_TOKEN_BUDGET
+from .checkpointer import get_checkpointer
+from .compaction import compact_messages
+from .http_cassette import MODE_REPLAY
+from .llm_cassette import get_llm_cassette
+from .tokens import count_tokens, message_text
+from .tools import create_google_sheets_tools, GOOGLE_ACCESS_TOKEN_KEY, SPREADSHEET_ID_KEY
 
 logger = logging.getLogger(__name__)
 
-# Global memory saver instance
-_memory_saver = MemorySaver()
+OPENAI_MODELS = ["gpt-4o", "gpt-4o-mini", "gpt-4.1", "o1", "o3", "o3-mini", "o4-mini"]
+
+# Process-wide caches. LLM clients are keyed by model name (prefixed while an LLM
+# cassette records or replays) and compiled graphs by (model key, system_instructions,
+# tool-set signature, context token budget); neither holds per-request data, which
+# travels in the run config instead.
+_model_cache: Dict[str, Any] = {}
+_graph_cache: Dict[Tuple[str, str, Tuple[str, ...], Optional[int]], Any] = {}
+_cache_lock = threading.RLock()
 
 class AgentState(TypedDict):
     """Type definition for the agent's state"""
     messages: Annotated[List[BaseMessage], add_messages]
-    google_access_token: Optional[str]
     spreadsheet_id: Optional[str]
 
 class ConstructionAgent:
@@ -38,20 +50,44 @@ class ConstructionAgent:
         self.spreadsheet_id = spreadsheet_id
         self.config = config or {"configurable": {"model": "gpt-4o", "system_instructions": "You are a helpful assistant"}}
         
-        # Use the global memory saver
-        self.memory = _memory_saver
-        self.graph = self._create_graph()
+        # Conversations are checkpointed in the shared store so any worker can resume them
+        self.memory = get_checkpointer()
+        self.graph = self._get_graph()
+
+    def _tool_sets(self) -> Tuple[str, ...]:
+        """Names of the tool sets available to this agent, used as the graph cache signature."""
+        return ("google_sheets",) if self.google_access_token else ()
 
     def _create_tools(self) -> List[Dict[str, Any]]:
         """Create the tools for the agent."""
         tools = []
         
-        if self.google_access_token:
-            sheets_service = GoogleSheetsService(self.google_access_token)
-            tools.extend(create_google_sheets_tools(sheets_service, self.spreadsheet_id))
+        if "google_sheets" in self._tool_sets():
+            tools.extend(create_google_sheets_tools())
         
         return tools
 
+    def _context_token_budget(self) -> Optional[int]:
+        """Token budget for the conversation sent to the model (None or 0 disables compaction)."""
+        return self.config["configurable"].get("context_token_budget", DEFAULT_CONTEXT_TOKEN_BUDGET)
+
+    def _get_graph(self) -> StateGraph:
+        """Return the compiled graph for this configuration, compiling it on first use."""
+        configurable = self.config["configurable"]
+        key = (
+            self._model_key(),
+            configurable["system_instructions"],
+            self._tool_sets(),
+            self._context_token_budget(),
+        )
+        with _cache_lock:
+            graph = _graph_cache.get(key)
+            if graph is None:
+                logger.info(f"Compiling agent graph for model {key[0]} with tool sets {key[2]}")
+                graph = self._create_graph()
+                _graph_cache[key] = graph
+        return graph
+
     def _create_graph(self) -> StateGraph:
         """Create the LangGraph workflow."""
         # Initialize the graph with our state type
@@ -65,18 +101,45 @@ class ConstructionAgent:
         
         # Bind tools to the LLM
         llm_with_tools = model.bind_tools(tools)
+
+        # The compiled graph is shared across agents, so nodes must not close over self
+        system_instructions = self.config["configurable"]["system_instructions"]
+        model_name = self.config["configurable"].get("model", "gpt-4o")
+        token_budget = self._context_token_budget()
+        instruction_tokens = count_tokens(system_instructions, model_name)
+
+        # Create the compaction node, run before every model call
+        def compact_node(state: AgentState) -> Dict:
+            """Elide old tool outputs and PDF text once the conversation exceeds the token budget."""
+            if not token_budget:
+                return {}
+            replacements = compact_messages(
+                state["messages"], token_budget, model_name, reserved_tokens=instruction_tokens
+            )
+            if replacements:
+                logger.info(f"Compacted {len(replacements)} earlier messages to fit {token_budget} tokens")
+            # Same IDs: add_messages replaces the originals in the state
+            return {"messages": replacements} if replacements else {}
         
         # Create the agent node
         def agent_node(state: AgentState) -> Dict:
             """Process messages and generate responses."""
             # Prepend the system instructions to the current messages
-            messages_with_instructions = [SystemMessage(content=self.config["configurable"]["system_instructions"])] + state["messages"]
+            messages_with_instructions = [SystemMessage(content=system_instructions)] + state["messages"]
             response = llm_with_tools.invoke(messages_with_instructions)
             return {"messages": [response]}
+
+        async def aagent_node(state: AgentState) -> Dict:
+            """Async counterpart of agent_node, used when the graph runs via astream."""
+            messages_with_instructions = [SystemMessage(content=system_instructions)] + state["messages"]
+            response = await llm_with_tools.ainvoke(messages_with_instructions)
+            return {"messages": [response]}
         
         # Add nodes to the graph
-        workflow.add_node("agent", agent_node)
-        workflow.add_edge(START, "agent")
+        workflow.add_node("compact", compact_node)
+        workflow.add_node("agent", RunnableLambda(agent_node, afunc=aagent_node, name="agent"))
+        workflow.add_edge(START, "compact")
+        workflow.add_edge("compact", "agent")
         
         if tools:
             # Create tool node with proper error handling
@@ -101,24 +164,60 @@ class ConstructionAgent:
                 should_continue,
                 ["tools", END]
             )
+            workflow.add_edge("tools", "compact")
         else:
             workflow.add_edge("agent", END)
-
-        workflow.add_edge("tools", "agent")
         
         # Compile the graph with memory support
         return workflow.compile(checkpointer=self.memory)
 
+    def _model_key(self) -> str:
+        """Cache key of the configured model: its name, prefixed while an LLM cassette records or replays."""
+        model_name = self.config["configurable"].get("model", "gpt-4o")
+        cassette = get_llm_cassette()
+        if cassette is None:
+            return model_name
+        return f"{cassette.mode}:{cassette.path}:{model_name}"
+
     def _get_model(self):
-        """Get the configured model"""
+        """Get the configured model, reusing the process-wide client for that model"""
         model_name = self.config["configurable"].get("model", "gpt-4o")
-        # Initialize the appropriate model based on config
-        if model_name in ["gpt-4o", "gpt-4o-mini", "gpt-4.1", "o1", "o3", "o3-mini", "o4-mini"]:
-            return ChatOpenAI(model=model_name)
-        elif "claude" in model_name:
-            return ChatAnthropic(model=model_name)
-        else:
-            raise ValueError(f"Invalid model: {model_name}")
+        key = self._model_key()
+        with _cache_lock:
+            model = _model_cache.get(key)
+            if model is None:
+                cassette = get_llm_cassette()
+                # Initialize the appropriate model based on config
+                if cassette is not None and cassette.mode == MODE_REPLAY:
+                    model = cassette.replay_model(model_name)
+                elif model_name in OPENAI_MODELS:
+                    model = ChatOpenAI(model=model_name)
+                elif "claude" in model_name:
+                    model = ChatAnthropic(model=model_name)
+                else:
+                    raise ValueError(f"Invalid model: {model_name}")
+                if cassette is not None and cassette.mode != MODE_REPLAY:
+                    model.callbacks = [cassette.recorder(model_name)]
+                _model_cache[key] = model
+        return model
+
+    def _run_config(self, conversation_id: Optional[str], spreadsheet_id: Optional[str]) -> Dict[str, Any]:
+        """Build the per-run config carrying the thread ID and the request's Google context."""
+        config = {
+            "configurable": {
+                GOOGLE_ACCESS_TOKEN_KEY: self.google_access_token,
+                SPREADSHEET_ID_KEY: spreadsheet_id or self.spreadsheet_id,
+            },
+            # Visible to callbacks and traces (the LLM cassette keys conversations without it)
+            "metadata": {SPREADSHEET_ID_KEY: spreadsheet_id or self.spreadsheet_id},
+        }
+        if conversation_id:
+            config["configurable"]["thread_id"] = conversation_id
+        if "recursion_limit" in self.config:
+            config["recursion_limit"] = self.config["recursion_limit"]
+        if "callbacks" in self.config:
+            config["callbacks"] = self.config["callbacks"]
+        return config
         
     def process_message(
         self, 
@@ -129,29 +228,7 @@ class ConstructionAgent:
         """Process a message and return a complete response."""
         #logger.info(f"Processing message for conversation {conversation_id}")
         
-        # Get existing messages from memory if conversation_id exists
-        existing_messages = []
-        if conversation_id:
-            try:
-                # Try to get existing state from memory
-                existing_state = self.memory.get_state(conversation_id)
-                if existing_state and "messages" in existing_state:
-                    existing_messages = existing_state["messages"]
-                    #logger.info(f"Found existing messages for conversation {conversation_id}")
-            except Exception as e:
-                logger.warning(f"Could not retrieve messages for conversation {conversation_id}: {e}")
-        
-        # Create initial state with existing messages + new message
-        state = AgentState(
-            messages=existing_messages + [HumanMessage(content=message)],
-            google_access_token=self.google_access_token,
-            spreadsheet_id=spreadsheet_id
-        )
-        
-        # Add configuration for thread memory
-        config = self.config
-        if conversation_id:
-            config["configurable"]["thread_id"] = conversation_id
+        state, config = self._prepare_input(message, conversation_id, spreadsheet_id)
         
         # Run the graph with thread configuration
         result = self.graph.invoke(state, config=config)
@@ -163,65 +240,77 @@ class ConstructionAgent:
             "tool_calls": getattr(final_message, "tool_calls", None)
         }
 
-    def process_message_stream(
-        self, 
+    def _prepare_input(
+        self,
         message: str,
         conversation_id: Optional[str] = None,
         spreadsheet_id: Optional[str] = None
-    ) -> Dict[str, Any]:
-        """Process a message and stream the response."""
-        logger.info(f"Starting message stream processing for conversation {conversation_id}")
-        
-        # Get existing messages from memory if conversation_id exists
-        existing_messages = []
-        if conversation_id:
-            try:
-                # Try to get existing state from memory
-                existing_state = self.memory.get_state(conversation_id)
-                if existing_state and "messages" in existing_state:
-                    existing_messages = existing_state["messages"]
-                    logger.info(f"Found existing messages for conversation {conversation_id}")
-            except Exception as e:
-                logger.warning(f"Could not retrieve messages for conversation {conversation_id}: {e}")
-        
-        # Create initial state with existing messages + new message
+    ) -> Tuple[AgentState, Dict[str, Any]]:
+        """
+        Build the graph input state and run config for a turn.
+
+        Only the new message goes in: the checkpointer restores the thread's
+        history, and add_messages appends this turn to it.
+        """
         state = AgentState(
-            messages=existing_messages + [HumanMessage(content=message)],
-            google_access_token=self.google_access_token,
-            spreadsheet_id=spreadsheet_id   
+            messages=[HumanMessage(content=message)],
+            spreadsheet_id=spreadsheet_id
         )
         
-        # Add configuration for thread memory
-        config = {"configurable": {"thread_id": conversation_id}} if conversation_id else {}
+        # Add configuration for thread memory and the request's Google context
+        config = self._run_config(conversation_id, spreadsheet_id)
+        return state, config
+
+    def _stream_chunk(self, stream_type: str, event: Any) -> Optional[Dict[str, Any]]:
+        """
+        Translate one (stream_type, event) pair from the graph into a client chunk.
+
+        Message chunks carry only the new text (the delta); consumers that need
+        the full answer so far accumulate it themselves.
+        """
+        if stream_type == "messages":
+            message, metadata = event
+            # Only the model's own tokens are part of the answer, not tool results
+            if metadata.get("langgraph_node") == "agent":
+                delta = message_text(message.content)
+                if delta:
+                    return {"delta": delta, "type": "message"}
+        elif stream_type == "custom" and isinstance(event, dict) and event.get("type") in ("tool_start", "tool_end"):
+            # Tool progress events written by the tools through the stream writer
+            return event
+        return None
+
+    def process_message_stream(
+        self, 
+        message: str,
+        conversation_id: Optional[str] = None,
+        spreadsheet_id: Optional[str] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """Process a message and stream the response as chunks of new text (deltas)."""
+        logger.info(f"Starting message stream processing for conversation {conversation_id}")
+        state, config = self._prepare_input(message, conversation_id, spreadsheet_id)
         
-        #logger.info("Starting graph streaming")
         # Stream the response with thread configuration
-        accumulated_text = ""
-        for stream_type, event in self.graph.stream(state, config=config, stream_mode=["messages", "updates"]):
-            import pprint
-            #logger.info(f"Received event: {pprint.pformat(event)}")
-            if stream_type == "messages":
-                message, metadata = event
-                if hasattr(message, 'content'):
-                    # Only update accumulated text if there's actual content
-                    if message.content:
-                        accumulated_text += message.content
-                        chunk = {
-                            "text": accumulated_text,
-                            "tool_calls": getattr(message, "tool_calls", None),
-                            "type": "message"
-                        }
-                        #logger.info(f"Yielding message chunk: {chunk}...")
-                        yield chunk
-            elif stream_type == "updates" and "tool_calls" in event:
-                # Only yield tool calls if they have valid names
-                tool_calls = event.get("tool_calls", [])
-                if tool_calls and any(call.get("name") for call in tool_calls):
-                    chunk = {
-                        "tool_calls": tool_calls,
-                        "type": "tool_call"
-                    }
-                    #logger.info(f"Yielding tool call chunk: {json.dumps(chunk['tool_calls'])}")
-                    yield chunk
-                
-        #logger.info("Message stream processing completed") 
\ No newline at end of file
+        for stream_type, event in self.graph.stream(state, config=config, stream_mode=["messages", "custom"]):
+            chunk = self._stream_chunk(stream_type, event)
+            if chunk:
+                yield chunk
+
+    async def aprocess_message_stream(
+        self,
+        message: str,
+        conversation_id: Optional[str] = None,
+        spreadsheet_id: Optional[str] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Async variant of process_message_stream driven by the graph's astream.
+
+        Yields the same chunk dictionaries, without holding a thread for the
+        duration of the run.
+        """
+        logger.info(f"Starting async message stream processing for conversation {conversation_id}")
+        state, config = self._prepare_input(message, conversation_id, spreadsheet_id)
+
+        async for stream_type, event in self.graph.astream(state, config=config, stream_mode=["messages", "custom"]):
+            chunk = self._stream_chunk(stream_type, event)
+            if chunk:
+                yield chunk
@@ -1,28 +1,62 @@
 import os
 import json
-import requests
-from typing import List, Dict, Any
+import httpx
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
 import logging
 
+from .http_client import get_http_client
+from .sheet_cache import SpreadsheetValuesCache, SingleFlightTTLCache
+
 logger = logging.getLogger(__name__)
 
+# Read-through cache of range values, shared by all service instances in the process
+SHEETS_CACHE_ENABLED = os.getenv('SHEETS_CACHE_ENABLED', 'True') == 'True'
+_values_cache = SpreadsheetValuesCache(
+    max_entries=int(os.getenv('SHEETS_CACHE_MAX_ENTRIES', '512')),
+    revalidate_seconds=float(os.getenv('SHEETS_CACHE_REVALIDATE_SECONDS', '2')),
+    unverifiable_seconds=float(os.getenv('SHEETS_CACHE_UNVERIFIABLE_SECONDS', '600')),
+)
+# Drive answers these when the token cannot see the file's metadata (e.g. drive.file scope)
+_UNVERIFIABLE_STATUS_CODES = (403, 404)
+
+# Only the parts of the spreadsheet resource the agent uses; without a mask
+# the API returns every sheet's properties, named ranges, formats, etc.
+SPREADSHEET_METADATA_FIELDS = "spreadsheetId,properties.title,sheets.properties(sheetId,title,index,gridProperties(rowCount,columnCount))"
+_metadata_cache = SingleFlightTTLCache(
+    ttl_seconds=float(os.getenv('SHEETS_METADATA_TTL_SECONDS', '60')),
+)
+# Threads fetching the extra render options of batch reads, shared by all service instances
+_read_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('SHEETS_READ_THREADS', '8')),
+    thread_name_prefix="sheets-read",
+)
+
 class GoogleSheetsService:
     """
     Service for interacting with Google Sheets API.
     
     This service provides methods to read and write data to Google Sheets,
-    which will be used by the agent's tools.
+    which will be used by the agent's tools. Requests go through the shared,
+    pooled HTTP client so connections are reused across service instances.
+    
+    Reads are served from a process-wide cache when the spreadsheet's Drive
+    version is unchanged; writes made through the service invalidate the
+    cached computed values and the cached formulas they overlap.
     """
     
-    def __init__(self, access_token: str):
+    def __init__(self, access_token: str, client: Optional[httpx.Client] = None):
         """
         Initialize the Google Sheets service with an access token.
         
         Args:
             access_token: Google OAuth access token with Sheets scope
+            client: HTTP client to use (defaults to the shared pooled client)
         """
         self.access_token = access_token
+        self.client = client or get_http_client()
         self.base_url = "https://sheets.googleapis.com/v4/spreadsheets"
+        self.drive_url = "https://www.googleapis.com/drive/v3/files"
         self.headers = {
             "Authorization": f"Bearer {access_token}",
             "Content-Type": "application/json"
@@ -49,17 +83,79 @@ class GoogleSheetsService:
             List of rows, where each row is a list of values
         """
         try:
+            cached = self._get_cached_values(spreadsheet_id, range_name, value_render_option)
+            if cached is not None:
+                return cached
+            generation = _values_cache.generation()
+            
             url = f"{self.base_url}/{spreadsheet_id}/values/{range_name}"
             params = {
                 "valueRenderOption": value_render_option
             }
-            response = requests.get(url, headers=self.headers, params=params)
+            response = self.client.get(url, headers=self.headers, params=params)
             response.raise_for_status()
             
             data = response.json()
-            return data.get("values", [])
+            values = data.get("values", [])
+            self._cache_values(spreadsheet_id, range_name, value_render_option, values, generation)
+            return values
         except Exception as e:
             raise Exception(f"Error reading Google Sheet: {str(e)}")
+
+    def batch_read(
+        self,
+        spreadsheet_id: str,
+        ranges: List[str],
+        value_render_options: Optional[List[str]] = None
+    ) -> Dict[str, List[List[List[Any]]]]:
+        """
+        Read several ranges, in one or more render modes, using values:batchGet.
+        
+        The API accepts a single valueRenderOption per batchGet, so one request is
+        made per render option; when several are requested they are sent
+        concurrently over the shared connection pool.
+        
+        Args:
+            spreadsheet_id: The ID of the spreadsheet
+            ranges: A1 notation ranges to read (e.g., ['Sheet1!A1:D10', 'Sheet2!A1:B5'])
+            value_render_options: Render options to read each range with
+                (defaults to ["FORMATTED_VALUE"]), see read_sheet_data
+            
+        Returns:
+            Dictionary mapping each render option to a list of value grids,
+            in the same order as `ranges`
+        """
+        value_render_options = list(dict.fromkeys(value_render_options or ["FORMATTED_VALUE"]))
+        
+        def fetch(value_render_option: str) -> List[List[List[Any]]]:
+            # Serve what the cache has and only request the missing ranges
+            grids = [self._get_cached_values(spreadsheet_id, range_name, value_render_option) for range_name in ranges]
+            missing = [range_name for range_name, grid in zip(ranges, grids) if grid is None]
+            if not missing:
+                return grids
+            generation = _values_cache.generation()
+            
+            url = f"{self.base_url}/{spreadsheet_id}/values:batchGet"
+            params = {
+                "ranges": missing,
+                "valueRenderOption": value_render_option
+            }
+            response = self.client.get(url, headers=self.headers, params=params)
+            response.raise_for_status()
+            value_ranges = iter(response.json().get("valueRanges", []))
+            for index, range_name in enumerate(ranges):
+                if grids[index] is None:
+                    grids[index] = next(value_ranges, {}).get("values", [])
+                    self._cache_values(spreadsheet_id, range_name, value_render_option, grids[index], generation)
+            return grids
+        
+        try:
+            # The first option is fetched on this thread, the others alongside it
+            others = [_read_executor.submit(fetch, option) for option in value_render_options[1:]]
+            results = [fetch(value_render_options[0])] + [future.result() for future in others]
+            return dict(zip(value_render_options, results))
+        except Exception as e:
+            raise Exception(f"Error batch reading Google Sheet: {str(e)}")
     
     def write_sheet_data(
         self,
@@ -108,15 +204,16 @@ class GoogleSheetsService:
             }
             
             logger.info("Sending request to Google Sheets API...")
-            response = requests.put(
+            response = self.client.put(
                 url, 
                 headers=self.headers, 
                 params=params,
                 json=body
             )
+            self._invalidate_cached_values(spreadsheet_id, range_name)
             
             logger.info(f"Response status: {response.status_code}")
-            if not response.ok:
+            if not response.is_success:
                 response_text = response.text
                 logger.error(f"Error response from Google Sheets API: {response_text}")
                 
@@ -183,15 +280,17 @@ class GoogleSheetsService:
             }
             
             logger.info("Sending append request to Google Sheets API...")
-            response = requests.post(
+            response = self.client.post(
                 url, 
                 headers=self.headers, 
                 params=params,
                 json=body
             )
+            # Appended rows land after the table, so anything on that sheet may change
+            self._invalidate_cached_values(spreadsheet_id, range_name.rsplit('!', 1)[0] if '!' in range_name else None)
             
             logger.info(f"Response status: {response.status_code}")
-            if not response.ok:
+            if not response.is_success:
                 response_text = response.text
                 logger.error(f"Error response from Google Sheets API: {response_text}")
                 
@@ -212,14 +311,188 @@ class GoogleSheetsService:
             logger.error(f"Error appending to Google Sheet: {str(e)}", exc_info=True)
             raise Exception(f"Error appending to Google Sheet: {str(e)}")
     
-    def get_spreadsheet_metadata(self, spreadsheet_id: str) -> Dict[str, Any]:
-        """Retrieve metadata for a given spreadsheet."""
+    def batch_write(
+        self,
+        spreadsheet_id: str,
+        data: List[Dict[str, Any]],
+        value_input_option: str = "USER_ENTERED"
+    ) -> List[Dict[str, Any]]:
+        """
+        Write several ranges in a single values:batchUpdate request.
+        
+        The API applies a batch all-or-nothing, so when it rejects the batch as
+        invalid (HTTP 400) each range is retried on its own to find out which
+        ones are at fault and still write the valid ones.
+        
+        Args:
+            spreadsheet_id: The ID of the spreadsheet
+            data: List of {"range": A1 range, "values": list of rows} to write
+            value_input_option: How to interpret input data, see write_sheet_data
+                
+        Returns:
+            One outcome per entry of `data`, in order, with keys "range",
+            "status" ("success" or "error"), "updated_range", "updated_cells"
+            and "error"
+        """
+        logger.info(f"Attempting batch write of {len(data)} ranges to spreadsheet ID: {spreadsheet_id}")
+        url = f"{self.base_url}/{spreadsheet_id}/values:batchUpdate"
+        body = {
+            "valueInputOption": value_input_option,
+            "data": [
+                {
+                    "range": entry["range"],
+                    "majorDimension": "ROWS",
+                    "values": entry["values"]
+                }
+                for entry in data
+            ]
+        }
+        
+        try:
+            response = self.client.post(url, headers=self.headers, json=body)
+        except Exception as e:
+            logger.error(f"Error batch writing to Google Sheet: {str(e)}", exc_info=True)
+            raise Exception(f"Error batch writing to Google Sheet: {str(e)}")
+        finally:
+            for entry in data:
+                self._invalidate_cached_values(spreadsheet_id, entry["range"])
+        
+        logger.info(f"Response status: {response.status_code}")
+        if response.status_code == 400 and len(data) > 1:
+            logger.warning(f"Batch write rejected ({self._api_error_message(response)}), retrying ranges one by one")
+            return [self._write_outcome(spreadsheet_id, entry, value_input_option) for entry in data]
+        if not response.is_success:
+            error_message = self._api_error_message(response)
+            logger.error(f"Error response from Google Sheets API: {error_message}")
+            raise Exception(f"Error batch writing to Google Sheet: {error_message}")
+        
+        result = response.json()
+        logger.info(f"Batch write successful. Updated cells: {result.get('totalUpdatedCells', 0)}")
+        return [
+            {
+                "range": entry["range"],
+                "status": "success",
+                "updated_range": update.get("updatedRange"),
+                "updated_cells": update.get("updatedCells", 0),
+                "error": None
+            }
+            for entry, update in zip(data, result.get("responses", []))
+        ]
+    
+    def _write_outcome(self, spreadsheet_id: str, entry: Dict[str, Any], value_input_option: str) -> Dict[str, Any]:
+        """Write a single range and report its outcome instead of raising."""
+        try:
+            result = self.write_sheet_data(spreadsheet_id, entry["range"], entry["values"], value_input_option)
+            return {
+                "range": entry["range"],
+                "status": "success",
+                "updated_range": result.get("updatedRange"),
+                "updated_cells": result.get("updatedCells", 0),
+                "error": None
+            }
+        except Exception as e:
+            return {
+                "range": entry["range"],
+                "status": "error",
+                "updated_range": None,
+                "updated_cells": 0,
+                "error": str(e)
+            }
+    
+    def _cache_key(self, spreadsheet_id: str):
+        # Scoped by token so one user's reads are never served to another
+        return (spreadsheet_id, self.access_token)
+    
+    def _get_cached_values(self, spreadsheet_id: str, range_name: str, value_render_option: str) -> Optional[List[List[Any]]]:
+        """Return cached values for a range, revalidating the spreadsheet's Drive version when due."""
+        if not SHEETS_CACHE_ENABLED:
+            return None
+        key = self._cache_key(spreadsheet_id)
+        if _values_cache.needs_revalidation(key):
+            self._revalidate(key, spreadsheet_id)
+        values = _values_cache.get(key, range_name, value_render_option)
+        if values is not None:
+            logger.info(f"Serving {range_name} ({value_render_option}) from cache")
+        return values
+    
+    def _cache_values(self, spreadsheet_id: str, range_name: str, value_render_option: str, values: List[List[Any]], generation: int) -> None:
+        if SHEETS_CACHE_ENABLED:
+            _values_cache.put(self._cache_key(spreadsheet_id), range_name, value_render_option, values, generation)
+    
+    def _invalidate_cached_values(self, spreadsheet_id: str, range_name: Optional[str]) -> None:
+        """Drop cached values invalidated by a write, for every token that cached this spreadsheet."""
+        if not SHEETS_CACHE_ENABLED:
+            return
+        for key in _values_cache.keys_for(lambda key: key[0] == spreadsheet_id):
+            _values_cache.invalidate(key, range_name)
+    
+    def _revalidate(self, key, spreadsheet_id: str) -> None:
+        """Check the spreadsheet's Drive version, bypassing the cache for it if the version cannot be read."""
+        try:
+            _values_cache.set_version(key, self._get_drive_version(spreadsheet_id))
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code in _UNVERIFIABLE_STATUS_CODES:
+                logger.warning(
+                    f"Drive version of spreadsheet {spreadsheet_id} is not readable ({e.response.status_code}), "
+                    f"not caching it for {_values_cache.unverifiable_seconds:.0f}s"
+                )
+                _values_cache.mark_unverifiable(key)
+            else:
+                logger.warning(f"Could not check Drive version of spreadsheet {spreadsheet_id}, bypassing cache: {e}")
+                _values_cache.set_version(key, None)
+        except Exception as e:
+            logger.warning(f"Could not check Drive version of spreadsheet {spreadsheet_id}, bypassing cache: {e}")
+            _values_cache.set_version(key, None)
+    
+    def _get_drive_version(self, spreadsheet_id: str) -> str:
+        """Current Drive version of the spreadsheet."""
+        response = self.client.get(
+            f"{self.drive_url}/{spreadsheet_id}",
+            headers=self.headers,
+            params={"fields": "version,modifiedTime", "supportsAllDrives": "true"}
+        )
+        response.raise_for_status()
+        data = response.json()
+        return f"{data.get('version')}:{data.get('modifiedTime')}"
+    
+    @staticmethod
+    def _api_error_message(response: httpx.Response) -> str:
+        """Extract the error message from a Google API error response."""
         try:
+            return response.json()["error"]["message"]
+        except (json.JSONDecodeError, KeyError, TypeError):
+            return f"HTTP {response.status_code}: {response.text}"
+    
+    def get_spreadsheet_metadata(self, spreadsheet_id: str, fields: str = SPREADSHEET_METADATA_FIELDS) -> Dict[str, Any]:
+        """
+        Retrieve metadata for a given spreadsheet.
+        
+        Results are cached per spreadsheet for SHEETS_METADATA_TTL_SECONDS, and
+        concurrent requests for the same metadata share one API call.
+        
+        Args:
+            spreadsheet_id: The ID of the spreadsheet
+            fields: Field mask limiting the returned resource (None for the whole resource)
+            
+        Returns:
+            The spreadsheet resource, restricted to `fields`
+        """
+        def load() -> Dict[str, Any]:
             # Use the Google Sheets API to get the spreadsheet metadata
             url = f"{self.base_url}/{spreadsheet_id}"
-            response = requests.get(url, headers=self.headers)
+            params = {"fields": fields} if fields else None
+            response = self.client.get(url, headers=self.headers, params=params)
             response.raise_for_status()
             return response.json()
+        
+        try:
+            return _metadata_cache.get_or_load((spreadsheet_id, self.access_token, fields), load)
         except Exception as e:
             logger.error(f"Failed to retrieve spreadsheet metadata: {e}")
-            raise 
\ No newline at end of file
+            raise
+    
+    def get_sheet_names(self, spreadsheet_id: str) -> List[str]:
+        """Retrieve the titles of the sheets of a spreadsheet, in order."""
+        metadata = self.get_spreadsheet_metadata(spreadsheet_id)
+        sheets = sorted(metadata.get("sheets", []), key=lambda sheet: sheet.get("properties", {}).get("index", 0))
+        return [sheet.get("properties", {}).get("title", "Sheet1") for sheet in sheets]
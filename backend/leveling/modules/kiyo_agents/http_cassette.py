@@ -0,0 +1,208 @@
+"""
+Record/replay transport for the Google API client.
+
+In record mode, requests go to the network and each request/response pair
+is appended to a cassette file (JSON Lines: a header line with the format
+version, then one interaction per line). In replay mode, responses are served
+from the cassette without any network access, optionally after the latency
+that was recorded (scaled) or a fixed one, so benchmark and evaluation
+runs can be repeated offline and compared.
+
+Requests are matched on method, URL (without credentials) and a hash of the
+body. Identical requests are answered in the order they were recorded, and
+the last recording is repeated once they are used up. Access tokens are
+never written to the cassette.
+"""
+
+import os
+import json
+import time
+import base64
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+MODE_RECORD = "record"
+MODE_REPLAY = "replay"
+CASSETTE_MODES = (MODE_RECORD, MODE_REPLAY)
+
+CASSETTE_VERSION = 2
+
+# Query parameters that carry credentials, left out of the cassette
+_SECRET_PARAMS = {"key", "access_token"}
+# Response headers describing the wire encoding; replayed bodies are already decoded
+_ENCODING_HEADERS = {"content-encoding", "content-length", "transfer-encoding"}
+
+
+class CassetteMissError(httpx.TransportError):
+    """A request in replay mode that the cassette has no recording for."""
+
+
+def _request_url(url: httpx.URL) -> str:
+    params = sorted((name, value) for name, value in url.params.multi_items() if name not in _SECRET_PARAMS)
+    base = str(url.copy_with(query=None))
+    return f"{base}?{httpx.QueryParams(params)}" if params else base
+
+
+def _body_digest(request: httpx.Request) -> Optional[str]:
+    """Hash of a request body, stable across runs (multipart boundaries and JSON key order are normalized)."""
+    body = request.read()
+    if not body:
+        return None
+    content_type = request.headers.get("content-type", "")
+    if "boundary=" in content_type:
+        boundary = content_type.split("boundary=", 1)[1].split(";")[0].strip('"')
+        body = body.replace(boundary.encode(), b"BOUNDARY")
+    elif content_type.startswith("application/json"):
+        try:
+            body = json.dumps(json.loads(body), sort_keys=True).encode()
+        except ValueError:
+            pass
+    return hashlib.sha256(body).hexdigest()
+
+
+def _request_key(request: httpx.Request) -> Tuple[str, str, Optional[str]]:
+    return request.method, _request_url(request.url), _body_digest(request)
+
+
+def _encode_body(content: bytes) -> Dict[str, str]:
+    try:
+        return {"body": content.decode("utf-8")}
+    except UnicodeDecodeError:
+        return {"body_base64": base64.b64encode(content).decode("ascii")}
+
+
+def _decode_body(response: Dict[str, Any]) -> bytes:
+    if "body_base64" in response:
+        return base64.b64decode(response["body_base64"])
+    return response.get("body", "").encode("utf-8")
+
+
+class CassetteTransport(httpx.BaseTransport):
+    """
+    httpx transport that records to, or replays from, a cassette file.
+
+    Args:
+        path: Cassette file (JSON Lines)
+        mode: MODE_RECORD or MODE_REPLAY
+        transport: Network transport used when recording
+        latency: In replay, 'recorded' to wait as long as the recorded response
+            took, a number of milliseconds to wait for every response, or 0
+        latency_scale: Factor applied to recorded latencies
+    """
+
+    def __init__(
+        self,
+        path: str,
+        mode: str = MODE_REPLAY,
+        transport: Optional[httpx.BaseTransport] = None,
+        latency: Any = 0,
+        latency_scale: float = 1.0,
+    ):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"Unsupported cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.latency_scale = latency_scale
+        self._transport = transport
+        self._lock = threading.Lock()
+        self._file = None
+        self._interactions: List[Dict[str, Any]] = []
+        self._replay_index: Dict[Tuple[str, str, Optional[str]], List[Dict[str, Any]]] = {}
+        self._replay_position: Dict[Tuple[str, str, Optional[str]], int] = {}
+
+        if mode == MODE_RECORD:
+            if transport is None:
+                raise ValueError("Recording needs a network transport")
+            if os.path.exists(path):
+                # Keep recording into an existing cassette, after checking its format
+                self._load()
+        else:
+            self._interactions = self._load()
+            for interaction in self._interactions:
+                request = interaction["request"]
+                key = (request["method"], request["url"], request.get("body_sha256"))
+                self._replay_index.setdefault(key, []).append(interaction)
+            logger.info(f"Replaying {len(self._interactions)} recorded Google API calls from {path}")
+
+    def _load(self) -> List[Dict[str, Any]]:
+        with open(self.path, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        header = json.loads(lines[0]) if lines else {}
+        if header.get("version") != CASSETTE_VERSION:
+            raise ValueError(f"Unsupported cassette version in {self.path}: {header.get('version')}")
+        interactions = []
+        for number, line in enumerate(lines[1:], start=2):
+            try:
+                interactions.append(json.loads(line))
+            except ValueError:
+                # A recording interrupted mid-write leaves a partial last line
+                if number != len(lines):
+                    raise
+                logger.warning(f"Ignoring the truncated last interaction in {self.path}")
+        return interactions
+
+    def _append(self, interaction: Dict[str, Any]) -> None:
+        # Called with the lock held: one line per interaction, so recording stays
+        # cheap however long the cassette gets, and survives an interrupted run
+        if self._file is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+            if self._file.tell() == 0:
+                self._file.write(json.dumps({"version": CASSETTE_VERSION}) + "\n")
+        self._file.write(json.dumps(interaction) + "\n")
+        self._file.flush()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        if self.mode == MODE_RECORD:
+            return self._record(request)
+        return self._replay(request)
+
+    def _record(self, request: httpx.Request) -> httpx.Response:
+        method, url, body_sha256 = _request_key(request)
+        started = time.monotonic()
+        response = self._transport.handle_request(request)
+        # Read (and decode) the body here so it can be stored and still be returned
+        content = response.read()
+        duration_ms = round((time.monotonic() - started) * 1000, 1)
+        headers = [(name, value) for name, value in response.headers.multi_items() if name.lower() not in _ENCODING_HEADERS]
+        interaction = {
+            "request": {"method": method, "url": url, "body_sha256": body_sha256},
+            "response": {"status": response.status_code, "headers": headers, **_encode_body(content)},
+            "duration_ms": duration_ms,
+        }
+        with self._lock:
+            self._append(interaction)
+        return httpx.Response(response.status_code, headers=headers, content=content, request=request)
+
+    def _replay(self, request: httpx.Request) -> httpx.Response:
+        key = _request_key(request)
+        with self._lock:
+            recordings = self._replay_index.get(key)
+            if not recordings:
+                raise CassetteMissError(f"No recording in {self.path} for {key[0]} {key[1]}", request=request)
+            position = self._replay_position.get(key, 0)
+            interaction = recordings[min(position, len(recordings) - 1)]
+            self._replay_position[key] = position + 1
+
+        delay_ms = interaction.get("duration_ms", 0) * self.latency_scale if self.latency == "recorded" else float(self.latency or 0)
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000)
+        response = interaction["response"]
+        return httpx.Response(response["status"], headers=response["headers"], content=_decode_body(response), request=request)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        if self._transport is not None:
+            self._transport.close()
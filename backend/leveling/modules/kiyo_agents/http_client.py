@@ -0,0 +1,180 @@
+"""
+Shared HTTP client for the Google Sheets and Drive APIs.
+
+All Google traffic goes through one process-wide httpx client so TCP/TLS
+connections to googleapis.com are kept alive and reused across service
+instances and conversations, instead of being opened for every call.
+
+Setting GOOGLE_HTTP_CASSETTE routes that traffic through a record/replay
+cassette instead (see http_cassette), for offline, reproducible runs.
+
+A request gate (see use_request_gate) can wrap every request of the shared
+client, e.g. so that an evaluation holds one of its Google call slots for
+exactly as long as each call takes.
+"""
+
+import os
+import logging
+import threading
+from typing import Any, Callable, ContextManager, Optional
+
+import httpx
+
+from .http_cassette import MODE_REPLAY, CassetteTransport
+
+logger = logging.getLogger(__name__)
+
+# Pool and timeout settings, overridable through the environment
+GOOGLE_HTTP_MAX_CONNECTIONS = int(os.getenv('GOOGLE_HTTP_MAX_CONNECTIONS', '20'))
+GOOGLE_HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('GOOGLE_HTTP_MAX_KEEPALIVE_CONNECTIONS', '10'))
+GOOGLE_HTTP_KEEPALIVE_EXPIRY = float(os.getenv('GOOGLE_HTTP_KEEPALIVE_EXPIRY', '60'))
+GOOGLE_HTTP_TIMEOUT = float(os.getenv('GOOGLE_HTTP_TIMEOUT', '30'))
+GOOGLE_HTTP_CONNECT_TIMEOUT = float(os.getenv('GOOGLE_HTTP_CONNECT_TIMEOUT', '10'))
+GOOGLE_HTTP_POOL_TIMEOUT = float(os.getenv('GOOGLE_HTTP_POOL_TIMEOUT', '10'))
+GOOGLE_HTTP2 = os.getenv('GOOGLE_HTTP2', 'True') == 'True'
+
+# Record/replay cassette: file, mode ('record' or 'replay') and replay latency
+# ('recorded', or milliseconds per response), scaled by the latency scale
+GOOGLE_HTTP_CASSETTE = os.getenv('GOOGLE_HTTP_CASSETTE', '')
+GOOGLE_HTTP_CASSETTE_MODE = os.getenv('GOOGLE_HTTP_CASSETTE_MODE', MODE_REPLAY)
+GOOGLE_HTTP_REPLAY_LATENCY = os.getenv('GOOGLE_HTTP_REPLAY_LATENCY', '0')
+GOOGLE_HTTP_REPLAY_LATENCY_SCALE = float(os.getenv('GOOGLE_HTTP_REPLAY_LATENCY_SCALE', '1'))
+
+# Google APIs only gzip responses when the User-Agent also mentions gzip
+DEFAULT_HEADERS = {
+    "Accept-Encoding": "gzip",
+    "User-Agent": "kiyo-construction (gzip)",
+}
+
+_client: Optional[httpx.Client] = None
+_client_lock = threading.Lock()
+# Context manager entered around each request of the shared client (None: no gate)
+_request_gate: Optional[Callable[[], ContextManager[Any]]] = None
+
+
+def _http2_available() -> bool:
+    """HTTP/2 needs the optional `h2` package (installed by httpx[http2])."""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _use_http2() -> bool:
+    if GOOGLE_HTTP2 and not _http2_available():
+        logger.warning("GOOGLE_HTTP2 is enabled but the 'h2' package is missing; falling back to HTTP/1.1")
+        return False
+    return GOOGLE_HTTP2
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=GOOGLE_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=GOOGLE_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=GOOGLE_HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+def create_cassette_transport(path: str, mode: str = MODE_REPLAY, latency: Any = 0, latency_scale: float = 1.0) -> CassetteTransport:
+    """
+    Create a record/replay transport; recording goes through a pooled network transport.
+
+    Args:
+        path: Cassette file
+        mode: 'record' or 'replay'
+        latency: Replay latency: 'recorded', or milliseconds per response
+        latency_scale: Factor applied to recorded latencies
+
+    Returns:
+        The transport, to pass to create_http_client
+    """
+    network = httpx.HTTPTransport(http2=_use_http2(), limits=_limits()) if mode != MODE_REPLAY else None
+    return CassetteTransport(path, mode, transport=network, latency=latency, latency_scale=latency_scale)
+
+
+class GatedTransport(httpx.BaseTransport):
+    """Transport running each request inside the process-wide request gate, when one is set."""
+
+    def __init__(self, transport: httpx.BaseTransport):
+        self._transport = transport
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        gate = _request_gate
+        if gate is None:
+            return self._transport.handle_request(request)
+        with gate():
+            response = self._transport.handle_request(request)
+            # The call is complete once its body is read
+            response.read()
+            return response
+
+    def close(self) -> None:
+        self._transport.close()
+
+
+def use_request_gate(gate: Optional[Callable[[], ContextManager[Any]]]) -> None:
+    """Enter `gate()` around every request of the shared client from now on (None removes the gate)."""
+    global _request_gate
+    _request_gate = gate
+
+
+def create_http_client(transport: Optional[httpx.BaseTransport] = None) -> httpx.Client:
+    """
+    Create a pooled HTTP client configured from the GOOGLE_HTTP_* settings,
+    whose requests go through the request gate.
+
+    Args:
+        transport: Optional transport to use instead of the default network transport
+
+    Returns:
+        A new httpx client
+    """
+    if transport is None:
+        transport = httpx.HTTPTransport(http2=_use_http2(), limits=_limits())
+    return httpx.Client(
+        limits=_limits(),
+        timeout=httpx.Timeout(
+            GOOGLE_HTTP_TIMEOUT,
+            connect=GOOGLE_HTTP_CONNECT_TIMEOUT,
+            pool=GOOGLE_HTTP_POOL_TIMEOUT,
+        ),
+        headers=DEFAULT_HEADERS,
+        transport=GatedTransport(transport),
+    )
+
+
+def get_http_client() -> httpx.Client:
+    """Return the process-wide Google API client, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                transport = None
+                if GOOGLE_HTTP_CASSETTE:
+                    transport = create_cassette_transport(
+                        GOOGLE_HTTP_CASSETTE, GOOGLE_HTTP_CASSETTE_MODE, GOOGLE_HTTP_REPLAY_LATENCY, GOOGLE_HTTP_REPLAY_LATENCY_SCALE
+                    )
+                _client = create_http_client(transport)
+                logger.info(f"Created shared Google HTTP client (max connections: {GOOGLE_HTTP_MAX_CONNECTIONS})")
+    return _client
+
+
+def close_http_client() -> None:
+    """Close the process-wide client and its pooled connections."""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+def use_http_cassette(path: str, mode: str = MODE_REPLAY, latency: Any = 0, latency_scale: float = 1.0) -> None:
+    """Route the process-wide client through a record/replay cassette (e.g. from a command's flags)."""
+    global _client
+    transport = create_cassette_transport(path, mode, latency, latency_scale)
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = create_http_client(transport)
+    logger.info(f"Google HTTP traffic {'recorded to' if mode != MODE_REPLAY else 'replayed from'} {path}")
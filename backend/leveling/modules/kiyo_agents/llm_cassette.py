@@ -0,0 +1,440 @@
+"""
+Record/replay of the agent's LLM calls.
+
+In record mode, the agent's model runs as usual and every response (its
+text and tool calls) is appended to a cassette (JSON Lines: a header line
+with the format version, then one response per line). In replay mode, a
+ReplayChatModel stands in for the provider's model and serves the recorded
+responses, streamed token by token at a configurable pace, so the agent's
+own overhead (graph, tools, streaming) can be measured without network
+access or provider latency.
+
+Responses are keyed by conversation step: the model, a hash of the system
+instructions and the conversation's first user message (with the
+spreadsheet's ID left out, since each run creates its own sheet), the
+conversation's ordinal among recorded conversations with that hash, and the
+number of model responses already in the conversation. Since replayed runs
+send the model the same messages, compaction included, they look up the
+same keys.
+
+Each conversation (LangGraph thread) is paired with one recorded
+conversation on its first model call, preferably the one recorded on the
+same spreadsheet, so that repeated runs of the same input each follow their
+own recorded trajectory, even when they are replayed concurrently.
+Identical keys are answered in the order they were recorded, and the last
+recording is repeated once they are used up.
+"""
+
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, SystemMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult, LLMResult
+from langchain_core.runnables.config import var_child_runnable_config
+from pydantic import Field
+
+from .http_cassette import CASSETTE_MODES, MODE_RECORD, MODE_REPLAY
+from .tokens import message_text
+from .tools import SPREADSHEET_ID_KEY
+
+logger = logging.getLogger(__name__)
+
+CASSETTE_VERSION = 2
+
+# Cassette file, mode ('record' or 'replay'), and replay pacing: the wait before
+# the first token ('recorded' or milliseconds) and tokens per second (0: no pacing)
+AGENT_LLM_CASSETTE = os.getenv('AGENT_LLM_CASSETTE', '')
+AGENT_LLM_CASSETTE_MODE = os.getenv('AGENT_LLM_CASSETTE_MODE', MODE_REPLAY)
+AGENT_LLM_REPLAY_LATENCY = os.getenv('AGENT_LLM_REPLAY_LATENCY', '0')
+AGENT_LLM_TOKENS_PER_SECOND = float(os.getenv('AGENT_LLM_TOKENS_PER_SECOND', '0'))
+
+# Replayed text is streamed in word-sized tokens, whitespace kept with the word that follows
+_TOKEN = re.compile(r"\s*\S+|\s+")
+
+# (model, conversation hash, conversation ordinal, step)
+StepKey = Tuple[str, str, int, int]
+
+
+class LlmCassetteMissError(LookupError):
+    """A model call in replay mode that the cassette has no recording for."""
+
+
+def conversation_step(model_name: str, messages: Sequence[BaseMessage], spreadsheet_id: Optional[str] = None) -> Tuple[str, str, int]:
+    """Model, conversation hash and number of earlier responses of a model call."""
+    system = next((message for message in messages if isinstance(message, SystemMessage)), None)
+    first_user = next((message for message in messages if isinstance(message, HumanMessage)), None)
+    digest = hashlib.sha256()
+    for message in (system, first_user):
+        text = message_text(message.content) if message is not None else ""
+        if spreadsheet_id:
+            text = text.replace(spreadsheet_id, "{spreadsheet_id}")
+        digest.update(text.encode("utf-8"))
+        digest.update(b"\0")
+    step = sum(1 for message in messages if isinstance(message, AIMessage))
+    return model_name, digest.hexdigest()[:16], step
+
+
+def _context_metadata() -> Optional[Dict[str, Any]]:
+    """Metadata of the run being executed (LangChain streams from generate() without passing the run manager)."""
+    config = var_child_runnable_config.get()
+    return config.get("metadata") if config else None
+
+
+def _serialize_message(message: BaseMessage) -> Dict[str, Any]:
+    return {
+        "content": message.content,
+        "tool_calls": [
+            {"name": tool_call["name"], "args": tool_call["args"], "id": tool_call.get("id")}
+            for tool_call in getattr(message, "tool_calls", None) or []
+        ],
+        "usage_metadata": getattr(message, "usage_metadata", None),
+    }
+
+
+class LlmCassette:
+    """
+    A cassette file of recorded model responses.
+
+    Args:
+        path: Cassette file (JSON Lines)
+        mode: MODE_RECORD or MODE_REPLAY
+        latency: In replay, 'recorded' to wait as long as the recorded first token
+            took, a number of milliseconds to wait before every response, or 0
+        tokens_per_second: In replay, pace of the streamed tokens (0 streams them at once)
+    """
+
+    def __init__(self, path: str, mode: str = MODE_REPLAY, latency: Any = 0, tokens_per_second: float = 0.0):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"Unsupported cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self._lock = threading.Lock()
+        self._file = None
+        self._replay_index: Dict[StepKey, List[Dict[str, Any]]] = {}
+        self._replay_position: Dict[StepKey, int] = {}
+        # Recorded conversations by (model, hash): the spreadsheet of each ordinal
+        self._recorded: Dict[Tuple[str, str], Dict[int, Optional[str]]] = {}
+        # Ordinals taken by this run's conversations, by (model, hash, thread ID)
+        self._ordinals: Dict[Tuple[str, str, str], int] = {}
+        self._claimed: Dict[Tuple[str, str], set] = {}
+
+        if mode == MODE_RECORD:
+            if os.path.exists(path):
+                # Keep recording into an existing cassette, after the conversations it holds
+                for response in self._load():
+                    self._recorded.setdefault((response["model"], response["conversation"]), {})[response["ordinal"]] = response.get("spreadsheet")
+        else:
+            responses = self._load()
+            for response in responses:
+                key = (response["model"], response["conversation"], response["ordinal"], response["step"])
+                self._replay_index.setdefault(key, []).append(response)
+                self._recorded.setdefault((response["model"], response["conversation"]), {})[response["ordinal"]] = response.get("spreadsheet")
+            logger.info(f"Replaying {len(responses)} recorded model responses from {path}")
+
+    def _load(self) -> List[Dict[str, Any]]:
+        with open(self.path, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        header = json.loads(lines[0]) if lines else {}
+        if header.get("version") != CASSETTE_VERSION:
+            raise ValueError(f"Unsupported cassette version in {self.path}: {header.get('version')}")
+        responses = []
+        for number, line in enumerate(lines[1:], start=2):
+            try:
+                responses.append(json.loads(line))
+            except ValueError:
+                # A recording interrupted mid-write leaves a partial last line
+                if number != len(lines):
+                    raise
+                logger.warning(f"Ignoring the truncated last response in {self.path}")
+        return responses
+
+    def _append(self, response: Dict[str, Any]) -> None:
+        # Called with the lock held: one line per response, flushed as it is recorded
+        if self._file is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+            if self._file.tell() == 0:
+                self._file.write(json.dumps({"version": CASSETTE_VERSION}) + "\n")
+        self._file.write(json.dumps(response) + "\n")
+        self._file.flush()
+
+    def step_key(self, model_name: str, messages: Sequence[BaseMessage], metadata: Optional[Dict[str, Any]]) -> StepKey:
+        """
+        Cassette key of a model call, from its messages and run metadata (thread and spreadsheet IDs).
+
+        A thread's first call pairs it with a conversation ordinal: the next one when
+        recording; when replaying, an unclaimed recorded conversation, preferably one
+        recorded on the same spreadsheet. Calls outside a thread use ordinal 0.
+        """
+        metadata = metadata or {}
+        spreadsheet_id = metadata.get(SPREADSHEET_ID_KEY)
+        model_name, conversation, step = conversation_step(model_name, messages, spreadsheet_id)
+        thread_id = metadata.get("thread_id")
+        if thread_id is None:
+            return model_name, conversation, 0, step
+        with self._lock:
+            ordinal = self._ordinals.get((model_name, conversation, thread_id))
+            if ordinal is None:
+                recorded = self._recorded.setdefault((model_name, conversation), {})
+                claimed = self._claimed.setdefault((model_name, conversation), set())
+                if self.mode == MODE_RECORD:
+                    ordinal = max(set(recorded) | claimed, default=-1) + 1
+                else:
+                    unclaimed = [o for o in sorted(recorded) if o not in claimed]
+                    same_sheet = [o for o in unclaimed if spreadsheet_id and recorded[o] == spreadsheet_id]
+                    # With every recording claimed, the ordinal has no responses and lookups miss
+                    ordinal = (same_sheet or unclaimed or [max(set(recorded) | claimed, default=-1) + 1])[0]
+                self._ordinals[(model_name, conversation, thread_id)] = ordinal
+                claimed.add(ordinal)
+        return model_name, conversation, ordinal, step
+
+    def record(
+        self,
+        key: StepKey,
+        spreadsheet_id: Optional[str],
+        message: BaseMessage,
+        first_token_ms: Optional[float],
+        duration_ms: float,
+    ) -> None:
+        model_name, conversation, ordinal, step = key
+        response = {
+            "model": model_name,
+            "conversation": conversation,
+            "ordinal": ordinal,
+            "spreadsheet": spreadsheet_id,
+            "step": step,
+            "message": _serialize_message(message),
+            "first_token_ms": first_token_ms,
+            "duration_ms": duration_ms,
+        }
+        with self._lock:
+            self._recorded.setdefault((model_name, conversation), {})[ordinal] = spreadsheet_id
+            self._append(response)
+
+    def close(self) -> None:
+        """Close the cassette file, if recording opened it."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def lookup(self, key: StepKey) -> Dict[str, Any]:
+        with self._lock:
+            recordings = self._replay_index.get(key)
+            if not recordings:
+                raise LlmCassetteMissError(
+                    f"No recording in {self.path} for {key[0]}, conversation {key[1]} #{key[2]}, step {key[3]}"
+                )
+            position = self._replay_position.get(key, 0)
+            self._replay_position[key] = position + 1
+            return recordings[min(position, len(recordings) - 1)]
+
+    def delay_seconds(self, response: Dict[str, Any]) -> float:
+        """Wait before the first token of a replayed response."""
+        if self.latency == "recorded":
+            delay_ms = response.get("first_token_ms") or response.get("duration_ms") or 0
+        else:
+            delay_ms = float(self.latency or 0)
+        return delay_ms / 1000
+
+    def replay_model(self, model_name: str) -> "ReplayChatModel":
+        """A model answering as `model_name` did when the cassette was recorded."""
+        return ReplayChatModel(model_name=model_name, cassette=self)
+
+    def recorder(self, model_name: str) -> "CassetteRecorder":
+        """Callback handler recording the responses of a live `model_name` model."""
+        return CassetteRecorder(self, model_name)
+
+
+class ReplayChatModel(BaseChatModel):
+    """Chat model serving the responses recorded in an LlmCassette."""
+
+    model_name: str
+    cassette: LlmCassette = Field(exclude=True)
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model_name": self.model_name, "cassette": self.cassette.path}
+
+    def bind_tools(self, tools: Sequence[Any], **kwargs: Any) -> "ReplayChatModel":
+        # Tool calls come from the recording, so there is nothing to bind
+        return self
+
+    def _recorded(self, messages: List[BaseMessage], run_manager: Any) -> Tuple[Dict[str, Any], float]:
+        metadata = run_manager.metadata if run_manager is not None else _context_metadata()
+        response = self.cassette.lookup(self.cassette.step_key(self.model_name, messages, metadata))
+        return response, self.cassette.delay_seconds(response)
+
+    def _token_interval(self) -> float:
+        return 1 / self.cassette.tokens_per_second if self.cassette.tokens_per_second > 0 else 0.0
+
+    @staticmethod
+    def _message(response: Dict[str, Any]) -> AIMessage:
+        recorded = response["message"]
+        return AIMessage(
+            content=recorded["content"],
+            tool_calls=[{**tool_call, "type": "tool_call"} for tool_call in recorded["tool_calls"]],
+            usage_metadata=recorded.get("usage_metadata"),
+        )
+
+    @staticmethod
+    def _chunks(response: Dict[str, Any]) -> List[AIMessageChunk]:
+        """The recorded response as the chunks a provider would stream: text tokens, then tool calls."""
+        recorded = response["message"]
+        content = recorded["content"]
+        if isinstance(content, str):
+            chunks = [AIMessageChunk(content=token) for token in _TOKEN.findall(content)]
+        else:
+            # Content blocks are replayed as recorded, in one chunk
+            chunks = [AIMessageChunk(content=content)]
+        tool_call_chunks = [
+            {"name": tool_call["name"], "args": json.dumps(tool_call["args"]), "id": tool_call["id"], "index": index}
+            for index, tool_call in enumerate(recorded["tool_calls"])
+        ]
+        if tool_call_chunks or recorded.get("usage_metadata"):
+            chunks.append(AIMessageChunk(content="", tool_call_chunks=tool_call_chunks, usage_metadata=recorded.get("usage_metadata")))
+        return chunks or [AIMessageChunk(content="")]
+
+    def _total_seconds(self, response: Dict[str, Any], delay: float) -> float:
+        return delay + self._token_interval() * max(len(self._chunks(response)) - 1, 0)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        response, delay = self._recorded(messages, run_manager)
+        total = self._total_seconds(response, delay)
+        if total > 0:
+            time.sleep(total)
+        return ChatResult(generations=[ChatGeneration(message=self._message(response))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        response, delay = self._recorded(messages, run_manager)
+        total = self._total_seconds(response, delay)
+        if total > 0:
+            await asyncio.sleep(total)
+        return ChatResult(generations=[ChatGeneration(message=self._message(response))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        response, delay = self._recorded(messages, run_manager)
+        interval = self._token_interval()
+        for index, message_chunk in enumerate(self._chunks(response)):
+            wait = delay if index == 0 else interval
+            if wait > 0:
+                time.sleep(wait)
+            chunk = ChatGenerationChunk(message=message_chunk)
+            if run_manager and isinstance(message_chunk.content, str):
+                run_manager.on_llm_new_token(message_chunk.content, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        response, delay = self._recorded(messages, run_manager)
+        interval = self._token_interval()
+        for index, message_chunk in enumerate(self._chunks(response)):
+            wait = delay if index == 0 else interval
+            if wait > 0:
+                await asyncio.sleep(wait)
+            chunk = ChatGenerationChunk(message=message_chunk)
+            if run_manager and isinstance(message_chunk.content, str):
+                await run_manager.on_llm_new_token(message_chunk.content, chunk=chunk)
+            yield chunk
+
+
+class CassetteRecorder(BaseCallbackHandler):
+    """Records the responses of a live model into an LlmCassette, keyed by conversation step."""
+
+    def __init__(self, cassette: LlmCassette, model_name: str):
+        self.cassette = cassette
+        self.model_name = model_name
+        self._lock = threading.Lock()
+        # run_id -> (key, spreadsheet ID, start time, first token time)
+        self._runs: Dict[UUID, List[Any]] = {}
+
+    def on_chat_model_start(
+        self,
+        serialized: Dict[str, Any],
+        messages: List[List[BaseMessage]],
+        *,
+        run_id: UUID,
+        metadata: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> None:
+        key = self.cassette.step_key(self.model_name, messages[0], metadata)
+        with self._lock:
+            self._runs[run_id] = [key, (metadata or {}).get(SPREADSHEET_ID_KEY), time.monotonic(), None]
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            run = self._runs.get(run_id)
+            if run is not None and run[3] is None:
+                run[3] = time.monotonic()
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is None or not response.generations or not response.generations[0]:
+            return
+        key, spreadsheet_id, started, first_token = run
+        self.cassette.record(
+            key,
+            spreadsheet_id,
+            response.generations[0][0].message,
+            round((first_token - started) * 1000, 1) if first_token is not None else None,
+            round((time.monotonic() - started) * 1000, 1),
+        )
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            self._runs.pop(run_id, None)
+
+
+_cassette: Optional[LlmCassette] = None
+_cassette_loaded = False
+_cassette_lock = threading.Lock()
+
+
+def get_llm_cassette() -> Optional[LlmCassette]:
+    """Return the process-wide LLM cassette, if one is configured (AGENT_LLM_CASSETTE or use_llm_cassette)."""
+    global _cassette, _cassette_loaded
+    if not _cassette_loaded:
+        with _cassette_lock:
+            if not _cassette_loaded:
+                if AGENT_LLM_CASSETTE:
+                    _cassette = LlmCassette(
+                        AGENT_LLM_CASSETTE, AGENT_LLM_CASSETTE_MODE, AGENT_LLM_REPLAY_LATENCY, AGENT_LLM_TOKENS_PER_SECOND
+                    )
+                _cassette_loaded = True
+    return _cassette
+
+
+def use_llm_cassette(path: str, mode: str = MODE_REPLAY, latency: Any = 0, tokens_per_second: float = 0.0) -> None:
+    """Record the agent's model responses to, or replay them from, a cassette (e.g. from a command's flags)."""
+    global _cassette, _cassette_loaded
+    cassette = LlmCassette(path, mode, latency, tokens_per_second)
+    with _cassette_lock:
+        if _cassette is not None:
+            _cassette.close()
+        _cassette = cassette
+        _cassette_loaded = True
+    logger.info(f"Model responses {'recorded to' if mode != MODE_REPLAY else 'replayed from'} {path}")
+
+
+def llm_replay_active() -> bool:
+    """Whether model calls are served from a cassette, so no provider credentials are needed."""
+    cassette = get_llm_cassette()
+    return cassette is not None and cassette.mode == MODE_REPLAY
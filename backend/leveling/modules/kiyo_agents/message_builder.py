@@ -1,17 +1,235 @@
-from typing import List, Dict, Any, Optional
+"""
+Builds the input message sent to the agent for one request.
+
+Shared by the chat views and the evaluation runner. Attached PDFs are
+cleaned before they are sent: lines repeated across pages (headers, footers,
+legal boilerplate) are kept once, whitespace is normalized, and the PDFs of a
+request are fit to a token budget counted with the target model's
+tokenizer, with a marker where text was cut.
+"""
+
+import os
+import re
+from collections import Counter
+from typing import List, Dict, Any, Optional, Sequence
+
+from .bid_tables import FLAG_NO_LINE_ITEMS, extract_bid_table
+from .tokens import count_tokens
+
+PDF_FORMAT_TEXT = "text"
+PDF_FORMAT_LINE_ITEMS = "line_items"
+PDF_FORMATS = (PDF_FORMAT_TEXT, PDF_FORMAT_LINE_ITEMS)
+
+# How attached PDFs are sent to the agent: their full text, or the extracted line items
+AGENT_PDF_FORMAT = os.getenv('AGENT_PDF_FORMAT', PDF_FORMAT_TEXT)
+
+# Token budget shared by all PDFs of one request (0 disables the limit)
+AGENT_PDF_TOKEN_BUDGET = int(os.getenv('AGENT_PDF_TOKEN_BUDGET', '30000'))
+
+# A line on at least this many pages (or on every page of a two-page document) is boilerplate
+MIN_REPEATED_PAGES = 3
+
+_HORIZONTAL_SPACE = re.compile(r"[ \t\xa0\f\v]+")
+_BLANK_LINES = re.compile(r"\n{3,}")
+_DIGITS = re.compile(r"\d+")
+# Page furniture whose numbers change from page to page, e.g. "Page 3" or "3 of 12"
+_PAGE_NUMBER = re.compile(r"\bpage\s*\d+|\b\d+\s*(?:of|/)\s*\d+\s*$", re.IGNORECASE)
+# A bare number, e.g. "- 3 -": page furniture only as the first or last line of a
+# page, and only when it counts up with the pages
+_BARE_NUMBER = re.compile(r"^\W{0,3}\d{1,4}\W{0,3}$")
+# Currency and decimal amounts: bid figures, never removed even when they repeat
+_AMOUNT = re.compile(r"[$€£]\s*\d|\d\.\d|\d{1,3}(?:,\d{3})+")
+
+
+def _page_texts(text: str, page_offsets: Sequence[int]) -> List[str]:
+    bounds = list(page_offsets) + [len(text)]
+    return [text[bounds[i]:bounds[i + 1]] for i in range(len(page_offsets))]
+
+
+def _line_keys(page: str, page_index: int) -> List[Optional[str]]:
+    """Repetition key of each line of a page; None for lines that are never removed."""
+    lines = page.splitlines()
+    filled = [index for index, line in enumerate(lines) if line.strip()]
+    edges = {filled[0], filled[-1]} if filled else set()
+    keys = []
+    for index, line in enumerate(lines):
+        key = _HORIZONTAL_SPACE.sub(" ", line.strip()).lower()
+        if not key or _AMOUNT.search(key):
+            keys.append(None)
+        elif _BARE_NUMBER.match(key):
+            # Numbered pages share the offset between the number and the page index
+            offset = int(_DIGITS.search(key).group()) - page_index
+            keys.append(f"{_DIGITS.sub('#', key)} @{offset}" if index in edges else None)
+        elif _PAGE_NUMBER.search(key):
+            keys.append(_DIGITS.sub("#", key))
+        else:
+            keys.append(key)
+    return keys
+
+
+def strip_repeated_lines(text: str, page_offsets: Optional[Sequence[int]] = None) -> str:
+    """
+    Remove lines repeated across the pages of a document, keeping their first occurrence.
+
+    Page numbers match whatever their number. Lines with amounts, and bare
+    numbers inside a page, are kept even when they repeat.
+
+    Args:
+        text: Text of the document
+        page_offsets: Offset of each page in `text`; without at least two pages nothing is removed
+
+    Returns:
+        The text without the repeated lines
+    """
+    if not page_offsets or len(page_offsets) < 2:
+        return text
+    pages = _page_texts(text, page_offsets)
+    page_keys = [_line_keys(page, index) for index, page in enumerate(pages)]
+    pages_per_line = Counter()
+    for keys in page_keys:
+        pages_per_line.update({key for key in keys if key is not None})
+    threshold = min(MIN_REPEATED_PAGES, len(pages))
+    repeated = {key for key, count in pages_per_line.items() if count >= threshold}
+    if not repeated:
+        return text
+
+    seen = set()
+    kept_pages = []
+    for page, keys in zip(pages, page_keys):
+        kept_lines = []
+        for line, key in zip(page.splitlines(), keys):
+            if key in repeated:
+                if key in seen:
+                    continue
+                seen.add(key)
+            kept_lines.append(line)
+        kept_pages.append("\n".join(kept_lines))
+    return "\n\n".join(kept_pages)
+
+
+def normalize_whitespace(text: str) -> str:
+    """Collapse runs of spaces and tabs, trim lines and keep at most one blank line in a row."""
+    lines = [_HORIZONTAL_SPACE.sub(" ", line).strip() for line in text.splitlines()]
+    return _BLANK_LINES.sub("\n\n", "\n".join(lines)).strip()
+
+
+def format_pdf_content(content: str, pdf_format: str = AGENT_PDF_FORMAT) -> str:
+    """Return the content to send for one PDF: its text, or its compact line-item summary.
+
+    Documents in which no line items are found are sent as text either way.
+    """
+    if pdf_format != PDF_FORMAT_LINE_ITEMS:
+        return content
+    bid = extract_bid_table(content)
+    if FLAG_NO_LINE_ITEMS in bid.flags:
+        return content
+    return bid.to_compact_text()
+
+
+def _allocate_budget(token_counts: List[int], token_budget: int) -> List[int]:
+    """Split a budget over documents: small ones are kept whole, the rest share what is left equally."""
+    allocations = [0] * len(token_counts)
+    remaining_budget = token_budget
+    remaining = sorted(range(len(token_counts)), key=lambda index: token_counts[index])
+    while remaining:
+        share = remaining_budget // len(remaining)
+        index = remaining[0]
+        if token_counts[index] > share:
+            for index in remaining:
+                allocations[index] = share
+            break
+        allocations[index] = token_counts[index]
+        remaining_budget -= token_counts[index]
+        remaining.pop(0)
+    return allocations
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model_name: str = "gpt-4o") -> str:
+    """
+    Cut a text at a line boundary to fit a token budget, with a marker saying what was cut.
+
+    Args:
+        text: The text to fit
+        max_tokens: Tokens allowed for the text, marker included
+        model_name: Model whose tokenizer is used for counting
+
+    Returns:
+        The text unchanged if it fits, otherwise its longest fitting prefix of whole lines and the marker
+    """
+    total = count_tokens(text, model_name)
+    if total <= max_tokens:
+        return text
+
+    def marker(kept_tokens: int) -> str:
+        return f"[Truncated: {total - kept_tokens} of {total} tokens of this PDF were omitted to fit the request's token budget]"
+
+    lines = text.splitlines()
+    marker_tokens = count_tokens(marker(0), model_name) + 1
+    # Binary search for the number of leading lines that fits
+    low, high = 0, len(lines)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens("\n".join(lines[:middle]), model_name) + marker_tokens <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    kept = "\n".join(lines[:low])
+    return f"{kept}\n{marker(count_tokens(kept, model_name))}" if kept else marker(0)
+
+
+def build_pdf_blocks(
+    processed_pdfs: List[Dict[str, Any]],
+    pdf_format: str = AGENT_PDF_FORMAT,
+    model_name: str = "gpt-4o",
+    token_budget: Optional[int] = AGENT_PDF_TOKEN_BUDGET,
+) -> str:
+    """
+    Clean the PDFs of a request and render them as delimited blocks within a token budget.
+
+    Args:
+        processed_pdfs: Dicts with 'filename', 'content' and optionally 'page_offsets'
+        pdf_format: PDF_FORMAT_TEXT or PDF_FORMAT_LINE_ITEMS
+        model_name: Model whose tokenizer is used for the budget
+        token_budget: Tokens allowed for the content of all PDFs together (None or 0 for no limit)
+
+    Returns:
+        The PDF blocks, ready to be placed before the user's message
+    """
+    contents = []
+    for pdf_data in processed_pdfs:
+        content = strip_repeated_lines(pdf_data['content'], pdf_data.get('page_offsets'))
+        contents.append(normalize_whitespace(format_pdf_content(content, pdf_format)))
+
+    if token_budget:
+        token_counts = [count_tokens(content, model_name) for content in contents]
+        if sum(token_counts) > token_budget:
+            allocations = _allocate_budget(token_counts, token_budget)
+            contents = [truncate_to_tokens(content, allocation, model_name) for content, allocation in zip(contents, allocations)]
+
+    return "".join(
+        f"--- PDF Content Start: {pdf_data['filename']} ---\n{content}\n--- PDF Content End: {pdf_data['filename']} ---\n\n"
+        for pdf_data, content in zip(processed_pdfs, contents)
+    )
+
 
 def build_agent_input_message(
     message: Optional[str],
-    processed_pdfs: List[Dict[str, str]],
-    spreadsheet_id: Optional[str]
+    processed_pdfs: List[Dict[str, Any]],
+    spreadsheet_id: Optional[str],
+    pdf_format: str = AGENT_PDF_FORMAT,
+    model_name: str = "gpt-4o",
+    token_budget: Optional[int] = AGENT_PDF_TOKEN_BUDGET,
 ) -> str:
     """Build the final input message for the agent.
-    
+
     Args:
         message: The user's message
-        processed_pdfs: List of processed PDF contents
+        processed_pdfs: List of processed PDF contents ('filename', 'content', optional 'page_offsets')
         spreadsheet_id: ID of the Google Sheet to use
-        
+        pdf_format: PDF_FORMAT_TEXT or PDF_FORMAT_LINE_ITEMS
+        model_name: Model the message is for, whose tokenizer enforces the budget
+        token_budget: Tokens allowed for the PDF content of the request (None or 0 for no limit)
+
     Returns:
         The combined input message
     """
@@ -19,9 +237,7 @@ def build_agent_input_message(
     pdf_combined_content = ""
 
     if processed_pdfs:
-        for pdf_data in processed_pdfs:
-            pdf_combined_content += f"--- PDF Content Start: {pdf_data['filename']} ---\n{pdf_data['content']}\n--- PDF Content End: {pdf_data['filename']} ---\n\n"
-        
+        pdf_combined_content = build_pdf_blocks(processed_pdfs, pdf_format, model_name, token_budget)
         final_input_message += pdf_combined_content
 
     if message:
@@ -30,11 +246,11 @@ def build_agent_input_message(
         raise ValueError('Message or PDF attachment is required')
 
     if spreadsheet_id:
-        if message and not message.lower().startswith("use spreadsheet"): 
+        if message and not message.lower().startswith("use spreadsheet"):
             enhanced_message = f"Use spreadsheet with ID {spreadsheet_id} for this task. {final_input_message}"
         else:
             enhanced_message = final_input_message
     else:
         enhanced_message = final_input_message
-    
-    return enhanced_message 
\ No newline at end of file
+
+    return enhanced_message
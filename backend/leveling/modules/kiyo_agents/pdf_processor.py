@@ -1,51 +1,526 @@
+"""
+PDF text extraction.
+
+Extraction runs on a bounded, process-wide process pool so several PDFs of a
+request are parsed in parallel instead of back to back on one core. Large
+documents are split into page ranges extracted in parallel, and each file has
+a timeout. Workers receive file paths or shared memory blocks, never pickled
+file contents, and keep the last few documents they parsed open, so the page
+ranges of a document do not each parse it again. A file that times out gets
+the pool recycled: its workers are killed, so runaway parses cannot hold on to them, and files of
+other calls caught in the recycle are retried on the new pool.
+
+Files on disk (including Django's temporary uploads) are memory-mapped.
+Small uploads Django keeps in memory are copied into a shared memory block
+the workers attach to, so they get the pool's parallelism and timeout too
+without touching the disk; they are parsed straight from their buffer when
+the pool is disabled.
+
+Extracted text is cached by the SHA-256 of the file bytes (see
+pdf_text_cache), and duplicate files within one call are extracted once.
+
+Callers can follow the extraction of each file through an `on_progress`
+callback, called as page ranges complete.
+"""
+
+import io
 import os
-import tempfile
+import mmap
+import time
+import hashlib
 import logging
-from typing import IO
-from django.core.files import File
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import IO, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from pypdf import PdfReader
 
-# Langchain PDF Loader
-from langchain_community.document_loaders import PyPDFLoader
+from .pdf_text_cache import get_pdf_text_cache
 
 logger = logging.getLogger(__name__)
 
+# Pool settings, overridable through the environment (0 workers extracts in-process)
+PDF_POOL_WORKERS = int(os.getenv('PDF_POOL_WORKERS', str(min(4, os.cpu_count() or 1))))
+PDF_PAGES_PER_TASK = int(os.getenv('PDF_PAGES_PER_TASK', '20'))
+PDF_EXTRACT_TIMEOUT = float(os.getenv('PDF_EXTRACT_TIMEOUT', '120'))
+# Parsed documents each worker keeps open for the next page range
+PDF_READERS_PER_WORKER = 2
+
+PDF_ERROR_TEXT = "[Error processing attached PDF]"
+
+
+@dataclass
+class ExtractedPdf:
+    """Text extracted from one PDF."""
+    text: str
+    # Offset of each page's text within `text`
+    page_offsets: List[int] = field(default_factory=list)
+    sha256: Optional[str] = None
+    error: Optional[str] = None
+
+
+@dataclass
+class PdfProgress:
+    """Extraction progress of one of the files passed to extract_pdfs."""
+    index: int
+    pages_done: int
+    page_count: Optional[int]
+    chars: int
+    elapsed_ms: int
+    done: bool = False
+    cached: bool = False
+    error: Optional[str] = None
+
+
+ProgressCallback = Callable[[PdfProgress], None]
+
+# Called with (file index, pages done, page count, chars extracted) as pages complete
+_PagesCallback = Callable[[int, int, int, int], None]
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+class SharedPdf(NamedTuple):
+    """A PDF the calling process holds in a shared memory block (an in-memory upload)."""
+    name: str
+    size: int
+
+
+# What pool workers are given to parse: a path on disk, or a shared memory block
+PdfSource = Union[str, SharedPdf]
+
+
+@contextmanager
+def _open_pdf(pdf_path: str) -> Iterator[PdfReader]:
+    """Open a PDF on disk through a read-only memory map (PdfReader would read a path into a copy)."""
+    with open(pdf_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        yield PdfReader(mapped)
+
+
+def _page_texts(reader: PdfReader, start: int, end: int) -> List[str]:
+    return [reader.pages[index].extract_text().strip() for index in range(start, end)]
+
+
+# Documents parsed in this (worker) process: (path, size, mtime) or (block name, size, 0)
+# -> (file or buffer, memory map of a file, reader)
+_readers: "OrderedDict[Tuple[str, int, int], Tuple[IO, Optional[mmap.mmap], PdfReader]]" = OrderedDict()
+
+
+def _close_reader(entry: Tuple[IO, Optional[mmap.mmap], PdfReader]) -> None:
+    f, mapped, _ = entry
+    if mapped is not None:
+        try:
+            mapped.close()
+        except BufferError:
+            # Still referenced by the reader's objects; released with them
+            pass
+    f.close()
+
+
+def _open_source(source: PdfSource) -> Tuple[IO, Optional[mmap.mmap], PdfReader]:
+    if isinstance(source, SharedPdf):
+        # Copied out of the block, which the calling process unlinks once its call is done
+        block = shared_memory.SharedMemory(name=source.name)
+        try:
+            buffer = io.BytesIO(block.buf[:source.size])
+        finally:
+            block.close()
+        return buffer, None, PdfReader(buffer)
+    f = open(source, "rb")
+    try:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except Exception:
+        f.close()
+        raise
+    return f, mapped, PdfReader(mapped)
+
+
+def _cached_reader(source: PdfSource) -> PdfReader:
+    """Reader of a PDF on disk or in shared memory, kept open in this process for the following page ranges."""
+    if isinstance(source, SharedPdf):
+        key = (source.name, source.size, 0)
+    else:
+        stat = os.stat(source)
+        key = (source, stat.st_size, stat.st_mtime_ns)
+    entry = _readers.get(key)
+    if entry is None:
+        entry = _readers[key] = _open_source(source)
+        while len(_readers) > PDF_READERS_PER_WORKER:
+            _close_reader(_readers.popitem(last=False)[1])
+    else:
+        _readers.move_to_end(key)
+    return entry[2]
+
+
+def _extract_pages(source: PdfSource, start: int, end: int) -> List[str]:
+    """Extract the text of pages [start, end) of a PDF (runs in a pool worker)."""
+    return _page_texts(_cached_reader(source), start, end)
+
+
+def _page_count(source: PdfSource) -> int:
+    """Number of pages of a PDF (runs in a pool worker, which keeps the document parsed for its pages)."""
+    # Only the document structure is parsed, not the page content
+    return len(_cached_reader(source).pages)
+
+
+def _page_ranges(page_count: int) -> List[Tuple[int, int]]:
+    """Split a document into page ranges of at most PDF_PAGES_PER_TASK pages."""
+    step = max(1, PDF_PAGES_PER_TASK)
+    return [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+
+
+def get_pdf_pool() -> Optional[ProcessPoolExecutor]:
+    """Return the process-wide extraction pool, creating it on first use (None if disabled)."""
+    global _pool
+    if PDF_POOL_WORKERS <= 0:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # Spawned workers do not inherit the server's threads and locks
+                _pool = ProcessPoolExecutor(
+                    max_workers=PDF_POOL_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+                logger.info(f"Created PDF extraction pool with {PDF_POOL_WORKERS} workers")
+    return _pool
+
+
+def _recycle_pdf_pool(pool: ProcessPoolExecutor) -> None:
+    """
+    Replace the pool and kill its workers.
+
+    Used when a task overran its timeout (the only way to stop a runaway
+    parse) or the pool broke. Calls still waiting on the old pool see it
+    break and retry on the new one.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    processes = list((getattr(pool, "_processes", None) or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.kill()
+
+
+def _join_pages(pages: List[str]) -> Tuple[str, List[int]]:
+    """Join page texts with blank lines, returning the text and the offset of each page in it."""
+    offsets, position = [], 0
+    for page in pages:
+        offsets.append(position)
+        position += len(page) + 2
+    return "\n\n".join(pages), offsets
+
+
+def _remaining(deadline: float) -> float:
+    return max(0.0, deadline - time.monotonic())
+
+
+def _run_on_pool(
+    pool: ProcessPoolExecutor,
+    pdf_paths: List[PdfSource],
+    deadlines: List[float],
+    timeout: float,
+    on_pages: _PagesCallback,
+) -> Tuple[List[Union[List[str], Exception]], bool]:
+    """Extract PDFs on the pool; returns the page texts or exception of each file, and whether one timed out."""
+    timed_out = False
+
+    def submit(fn, *args):
+        try:
+            return pool.submit(fn, *args)
+        except Exception as submit_err:
+            return submit_err
+
+    # Count pages on the workers, which then already have the documents parsed
+    counts = [submit(_page_count, pdf_path) for pdf_path in pdf_paths]
+
+    # Submit every file's page ranges up front so all files share the pool
+    submitted = []
+    for pdf_path, count, deadline in zip(pdf_paths, counts, deadlines):
+        try:
+            if isinstance(count, Exception):
+                raise count
+            page_count = count.result(timeout=_remaining(deadline))
+            futures = []
+            for start, end in _page_ranges(page_count):
+                future = submit(_extract_pages, pdf_path, start, end)
+                if isinstance(future, Exception):
+                    raise future
+                futures.append(future)
+            submitted.append((futures, page_count, deadline))
+        except FutureTimeoutError:
+            timed_out = True
+            submitted.append((TimeoutError(f"timed out after {timeout}s"), None, None))
+        except Exception as pdf_err:
+            submitted.append((pdf_err, None, None))
+
+    results = []
+    for file_index, (futures, page_count, deadline) in enumerate(submitted):
+        if isinstance(futures, Exception):
+            results.append(futures)
+            continue
+        try:
+            pages = []
+            for future in futures:
+                pages.extend(future.result(timeout=_remaining(deadline)))
+                on_pages(file_index, len(pages), page_count, sum(map(len, pages)))
+            results.append(pages)
+        except FutureTimeoutError:
+            timed_out = True
+            for future in futures:
+                future.cancel()
+            results.append(TimeoutError(f"timed out after {timeout}s"))
+        except Exception as pdf_err:
+            results.append(pdf_err)
+    return results, timed_out
+
+
+def _extract_paths(pdf_paths: List[PdfSource], timeout: float, on_pages: Optional[_PagesCallback] = None) -> List[Union[List[str], Exception]]:
+    """
+    Extract the page texts of PDFs on disk (or, with the pool, in shared memory)
+    on the pool; failed files get their exception.
+    """
+    on_pages = on_pages or (lambda *args: None)
+    pool = get_pdf_pool()
+    if pool is None:
+        results = []
+        for file_index, pdf_path in enumerate(pdf_paths):
+            try:
+                with _open_pdf(pdf_path) as reader:
+                    page_count = len(reader.pages)
+                    pages = []
+                    for start, end in _page_ranges(page_count):
+                        pages.extend(_page_texts(reader, start, end))
+                        on_pages(file_index, end, page_count, sum(map(len, pages)))
+                results.append(pages)
+            except Exception as pdf_err:
+                results.append(pdf_err)
+        return results
+
+    deadlines = [time.monotonic() + timeout] * len(pdf_paths)
+    results, timed_out = _run_on_pool(pool, pdf_paths, deadlines, timeout, on_pages)
+    if timed_out:
+        # Tasks past their deadline would keep their workers: kill them
+        _recycle_pdf_pool(pool)
+
+    # Files whose pool broke or was recycled under them (by this call or another) get one more try
+    retry = [
+        index for index, result in enumerate(results)
+        if isinstance(result, RuntimeError) and (isinstance(result, BrokenProcessPool) or _pool is not pool)
+        and _remaining(deadlines[index]) > 0
+    ]
+    if retry:
+        if not timed_out:
+            _recycle_pdf_pool(pool)
+        logger.warning(f"PDF extraction pool was recycled, retrying {len(retry)} file(s)")
+        retry_pool = get_pdf_pool()
+        retried, retry_timed_out = _run_on_pool(
+            retry_pool,
+            [pdf_paths[index] for index in retry],
+            [deadlines[index] for index in retry],
+            timeout,
+            lambda file_index, *progress: on_pages(retry[file_index], *progress),
+        )
+        if retry_timed_out:
+            _recycle_pdf_pool(retry_pool)
+        for index, result in zip(retry, retried):
+            results[index] = result
+    return results
+
+
+def _extract_from_buffer(stream: IO, on_pages: Optional[Callable[[int, int, int], None]] = None) -> List[str]:
+    """Extract the page texts of a PDF held in memory, parsing its buffer in place."""
+    stream.seek(0)
+    reader = PdfReader(stream)
+    page_count = len(reader.pages)
+    pages = []
+    for start, end in _page_ranges(page_count):
+        pages.extend(_page_texts(reader, start, end))
+        if on_pages:
+            on_pages(end, page_count, sum(map(len, pages)))
+    return pages
+
+
+def _locate(pdf_source: Union[str, IO]) -> Tuple[Optional[str], Optional[IO]]:
+    """Where a PDF's bytes are: a path on disk, or an in-memory buffer."""
+    if isinstance(pdf_source, str):
+        return pdf_source, None
+    if hasattr(pdf_source, "temporary_file_path"):
+        # Large uploads, which Django streams to a temporary file
+        return pdf_source.temporary_file_path(), None
+    # Uploaded files wrap the underlying buffer (a BytesIO for in-memory uploads)
+    return None, getattr(pdf_source, "file", pdf_source)
+
+
+def _share(stream: IO) -> Tuple[shared_memory.SharedMemory, SharedPdf]:
+    """Copy an in-memory PDF into a shared memory block the pool workers can attach to."""
+    if hasattr(stream, "getbuffer"):
+        content = stream.getbuffer()
+    else:
+        stream.seek(0)
+        content = memoryview(stream.read())
+    with content:
+        block = shared_memory.SharedMemory(create=True, size=max(1, content.nbytes))
+        block.buf[:content.nbytes] = content
+        return block, SharedPdf(block.name, content.nbytes)
+
+
+def _sha256(pdf_path: Optional[str], stream: Optional[IO]) -> str:
+    """SHA-256 of a PDF's bytes, hashed from a memory map or the buffer itself."""
+    if pdf_path is not None:
+        with open(pdf_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return hashlib.sha256(mapped).hexdigest()
+    if hasattr(stream, "getbuffer"):
+        with stream.getbuffer() as view:
+            return hashlib.sha256(view).hexdigest()
+    stream.seek(0)
+    digest = hashlib.sha256()
+    for block in iter(lambda: stream.read(1024 * 1024), b""):
+        digest.update(block)
+    return digest.hexdigest()
+
+
+def extract_pdfs(
+    pdf_sources: List[Union[str, IO]],
+    timeout: float = PDF_EXTRACT_TIMEOUT,
+    on_progress: Optional[ProgressCallback] = None,
+) -> List[ExtractedPdf]:
+    """
+    Extract the text of several PDFs, in order.
+
+    Each distinct file (by SHA-256 of its bytes) is extracted once: files seen
+    before come from the text cache, and duplicates within the call share one
+    extraction. Files are extracted in parallel on the pool: paths and large
+    uploads from disk, small in-memory uploads from a shared memory copy of
+    their buffer (or from the buffer in this process when the pool is disabled).
+
+    Args:
+        pdf_sources: Paths of PDF files and/or uploaded files
+        timeout: Seconds allowed per file on the pool, counted from when its work is submitted
+        on_progress: Called with a PdfProgress for a file as its pages are extracted, and once
+            with `done` set when it is finished (from the calling thread)
+
+    Returns:
+        One ExtractedPdf per source; files that fail or time out carry the
+        error placeholder as text and the reason in `error`
+    """
+    started = time.monotonic()
+    cache = get_pdf_text_cache()
+    results: List[Optional[ExtractedPdf]] = [None] * len(pdf_sources)
+    indexes_by_digest: Dict[str, List[int]] = {}
+    locations: Dict[str, Tuple[Optional[str], Optional[IO]]] = {}
+
+    def report(indexes: List[int], pages_done: int, page_count: Optional[int], chars: int, **status) -> None:
+        if on_progress is None:
+            return
+        elapsed_ms = int((time.monotonic() - started) * 1000)
+        for index in indexes:
+            try:
+                on_progress(PdfProgress(index, pages_done, page_count, chars, elapsed_ms, **status))
+            except Exception as callback_err:
+                logger.warning(f"PDF progress callback failed: {callback_err}")
+
+    for index, pdf_source in enumerate(pdf_sources):
+        try:
+            pdf_path, stream = _locate(pdf_source)
+            digest = _sha256(pdf_path, stream)
+        except Exception as pdf_err:
+            logger.error(f"Error reading PDF {getattr(pdf_source, 'name', pdf_source)}: {pdf_err}")
+            results[index] = ExtractedPdf(text=PDF_ERROR_TEXT, error=str(pdf_err))
+            report([index], 0, None, 0, done=True, error=str(pdf_err))
+            continue
+        if digest in indexes_by_digest:
+            logger.info(f"PDF {getattr(pdf_source, 'name', pdf_source)} duplicates an earlier file ({digest[:12]})")
+        else:
+            locations[digest] = (pdf_path, stream)
+        indexes_by_digest.setdefault(digest, []).append(index)
+
+    extracted: Dict[str, Union[List[str], Tuple[str, List[int]], Exception]] = {}
+    on_pool: Dict[str, PdfSource] = {}
+    shared: List[shared_memory.SharedMemory] = []
+    use_pool = get_pdf_pool() is not None
+    try:
+        for digest, (pdf_path, stream) in locations.items():
+            cached = cache.get(digest) if cache else None
+            if cached is not None:
+                extracted[digest] = cached
+            elif pdf_path is not None:
+                on_pool[digest] = pdf_path
+            elif use_pool:
+                try:
+                    block, on_pool[digest] = _share(stream)
+                    shared.append(block)
+                except Exception as pdf_err:
+                    extracted[digest] = pdf_err
+            else:
+                try:
+                    extracted[digest] = _extract_from_buffer(
+                        stream, lambda pages_done, page_count, chars, digest=digest: report(indexes_by_digest[digest], pages_done, page_count, chars)
+                    )
+                except Exception as pdf_err:
+                    extracted[digest] = pdf_err
+        if on_pool:
+            digests = list(on_pool)
+            extracted.update(zip(digests, _extract_paths(
+                list(on_pool.values()),
+                timeout,
+                lambda file_index, pages_done, page_count, chars: report(indexes_by_digest[digests[file_index]], pages_done, page_count, chars),
+            )))
+    finally:
+        for block in shared:
+            block.close()
+            block.unlink()
+
+    for digest, outcome in extracted.items():
+        if isinstance(outcome, Exception):
+            logger.error(f"Error processing PDF {digest[:12]}: {outcome}")
+            result = ExtractedPdf(text=PDF_ERROR_TEXT, sha256=digest, error=str(outcome))
+            report(indexes_by_digest[digest], 0, None, 0, done=True, error=str(outcome))
+        else:
+            cached = not isinstance(outcome, list)
+            if not cached:
+                outcome = _join_pages(outcome)
+                if cache:
+                    cache.put(digest, *outcome)
+            text, page_offsets = outcome
+            result = ExtractedPdf(text=text, page_offsets=page_offsets, sha256=digest)
+            report(indexes_by_digest[digest], len(page_offsets), len(page_offsets), len(text), done=True, cached=cached)
+        for index in indexes_by_digest[digest]:
+            results[index] = result
+    return results
+
+
+def extract_pdf_texts(pdf_paths: List[str], timeout: float = PDF_EXTRACT_TIMEOUT) -> List[str]:
+    """Extract the text of several PDFs on disk, in order (error placeholder for failed files)."""
+    return [extracted.text for extracted in extract_pdfs(pdf_paths, timeout)]
+
+
+def process_pdf_uploads(pdf_files: List[IO]) -> List[str]:
+    """Extract the text of uploaded PDF files, in order."""
+    return [extracted.text for extracted in extract_pdfs(pdf_files)]
+
+
 def process_pdf_upload(pdf_file: IO) -> str:
     """Processes uploaded PDF file and extracts text content."""
     if not pdf_file:
         return ""
+    return process_pdf_uploads([pdf_file])[0]
+
+
+def process_pdf_files(pdf_paths: List[str]) -> List[str]:
+    """Extract the text of PDF files on disk in parallel, in order."""
+    return extract_pdf_texts(pdf_paths)
 
-    #logger.info(f"Processing uploaded PDF: {pdf_file.name}")
-    temp_pdf_path = None
-    pdf_text_content = ""
-    try:
-        # Save PDF to a temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_pdf:
-            temp_pdf_path = temp_pdf.name
-            for chunk in pdf_file.chunks():
-                temp_pdf.write(chunk)
-        
-        # Use PyPDFLoader to extract text
-        loader = PyPDFLoader(temp_pdf_path)
-        pages = loader.load() # or load_and_split()
-        pdf_text_content = "\n\n".join([page.page_content for page in pages])
-        #logger.info(f"Extracted {len(pdf_text_content)} characters from PDF.")
-
-    except Exception as pdf_err:
-        logger.error(f"Error processing PDF {pdf_file.name}: {pdf_err}", exc_info=True)
-        pdf_text_content = "[Error processing attached PDF]"
-    finally:
-        # Ensure temporary file is deleted
-        if temp_pdf_path and os.path.exists(temp_pdf_path):
-            try:
-                os.remove(temp_pdf_path)
-                #logger.info(f"Deleted temporary PDF file: {temp_pdf_path}")
-            except OSError as del_err:
-                #logger.error(f"Error deleting temporary PDF file {temp_pdf_path}: {del_err}")
-                pass
-    
-    return pdf_text_content
 
 def process_pdf_file(pdf_path: str) -> str:
-    with open(pdf_path, "rb") as f:
-        django_file = File(f)
-        return process_pdf_upload(django_file)
\ No newline at end of file
+    """Extract the text of a PDF file on disk."""
+    return extract_pdf_texts([pdf_path])[0]
@@ -0,0 +1,104 @@
+"""
+Content-addressed disk cache of extracted PDF text.
+
+Entries are keyed by the SHA-256 of the PDF bytes, so the same bid package
+is only parsed once no matter how often it is attached or evaluated, under
+whatever file name. Each entry is a small JSON file holding the text and the
+offset of each page in it. Reads refresh an entry's mtime, and the oldest
+entries are evicted once the directory exceeds its size limit.
+"""
+
+import os
+import json
+import logging
+import tempfile
+import threading
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Cache settings, overridable through the environment (an empty directory disables the cache)
+PDF_TEXT_CACHE_DIR = os.getenv('PDF_TEXT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'kiyo-pdf-text-cache'))
+PDF_TEXT_CACHE_MAX_BYTES = int(os.getenv('PDF_TEXT_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+
+
+class PdfTextCache:
+    """Disk cache of (text, page offsets) by PDF SHA-256, evicting least recently used entries by size."""
+
+    def __init__(self, directory: str, max_bytes: int = PDF_TEXT_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, sha256: str) -> str:
+        return os.path.join(self.directory, f"{sha256}.json")
+
+    def get(self, sha256: str) -> Optional[Tuple[str, List[int]]]:
+        """Return the cached (text, page_offsets) for a PDF digest, or None."""
+        path = self._path(sha256)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+            # Reads refresh the entry for eviction
+            os.utime(path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry["text"], entry["page_offsets"]
+
+    def put(self, sha256: str, text: str, page_offsets: List[int]) -> None:
+        """Store the text of a PDF digest, then evict old entries past the size limit."""
+        path = self._path(sha256)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"text": text, "page_offsets": page_offsets}, f)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not cache extracted PDF text {sha256}: {e}")
+            return
+        self._evict()
+
+    def _evict(self) -> None:
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".json"):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+
+_cache: Optional[PdfTextCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_pdf_text_cache() -> Optional[PdfTextCache]:
+    """Return the process-wide cache, or None when PDF_TEXT_CACHE_DIR is empty or unusable."""
+    global _cache
+    if not PDF_TEXT_CACHE_DIR:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                try:
+                    _cache = PdfTextCache(PDF_TEXT_CACHE_DIR, PDF_TEXT_CACHE_MAX_BYTES)
+                except OSError as e:
+                    logger.warning(f"PDF text cache disabled, cannot use {PDF_TEXT_CACHE_DIR}: {e}")
+                    return None
+    return _cache
@@ -0,0 +1,312 @@
+"""
+Caches used by GoogleSheetsService.
+
+Range values are keyed by spreadsheet, A1 range and value render option.
+A write made through the service drops every computed value of the
+spreadsheet (formulas elsewhere may depend on the written cells) and the
+cached formulas it intersects. The whole spreadsheet is dropped when its
+Drive version changes, so edits made by the user in the embedded sheet are
+still picked up. Spreadsheet metadata is cached with a TTL, and concurrent loads of the
+same metadata share a single upstream call.
+"""
+
+import copy
+import re
+import time
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+# Render option whose values do not depend on other cells
+FORMULA_RENDER_OPTION = "FORMULA"
+
+# Columns go up to three letters (ZZZ), which tells 'AB12' apart from a sheet named 'Sheet1'
+_CELL_PATTERN = re.compile(r"^\$?([A-Za-z]{0,3})\$?(\d*)$")
+
+
+@dataclass(frozen=True)
+class GridRange:
+    """A rectangular range; None bounds are unbounded (1-based, inclusive)."""
+    sheet: Optional[str]
+    start_row: Optional[int] = None
+    end_row: Optional[int] = None
+    start_col: Optional[int] = None
+    end_col: Optional[int] = None
+
+
+def _column_index(letters: str) -> int:
+    """Convert column letters to a 1-based index (A -> 1, AA -> 27)."""
+    index = 0
+    for letter in letters.upper():
+        index = index * 26 + (ord(letter) - ord('A') + 1)
+    return index
+
+
+def _parse_cell(cell: str) -> Optional[Tuple[Optional[int], Optional[int]]]:
+    """Parse 'B3', 'B' or '3' into (row, col); None if it is not a cell reference."""
+    match = _CELL_PATTERN.match(cell.strip())
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+    letters, digits = match.groups()
+    return (int(digits) if digits else None, _column_index(letters) if letters else None)
+
+
+def _parse_cells(cells: str) -> Optional[Tuple[Tuple, Tuple]]:
+    """Parse the cell part of an A1 range into its start and end cells."""
+    parts = cells.split(':')
+    if len(parts) > 2:
+        return None
+    start = _parse_cell(parts[0])
+    end = _parse_cell(parts[-1])
+    if start is None or end is None:
+        return None
+    return start, end
+
+
+def parse_a1_range(range_name: str) -> GridRange:
+    """
+    Parse an A1 notation range into a GridRange.
+
+    Handles 'Sheet1!A1:D10', quoted sheet names, open ranges ('A:C', '2:5',
+    'A2:C') and bare sheet names. A range without a sheet name has sheet None,
+    which is treated as possibly overlapping any sheet.
+    """
+    if '!' in range_name:
+        sheet, cells = range_name.rsplit('!', 1)
+    elif _parse_cells(range_name) and any(c.isdigit() or c == ':' for c in range_name):
+        # Cells on the default sheet, e.g. 'A1:D10'
+        sheet, cells = None, range_name
+    else:
+        # A bare sheet name, e.g. 'Bid Comparison'
+        sheet, cells = range_name, ''
+
+    if sheet is not None:
+        sheet = sheet.strip()
+        if len(sheet) >= 2 and sheet[0] == sheet[-1] == "'":
+            sheet = sheet[1:-1].replace("''", "'")
+        sheet = sheet.casefold()
+
+    parsed = _parse_cells(cells) if cells else None
+    if parsed is None:
+        return GridRange(sheet=sheet)
+
+    (start_row, start_col), (end_row, end_col) = parsed
+    # A single cell or column/row reference spans only itself
+    if ':' not in cells:
+        end_row, end_col = start_row, start_col
+    return GridRange(sheet=sheet, start_row=start_row, end_row=end_row, start_col=start_col, end_col=end_col)
+
+
+def _spans_overlap(start_a: Optional[int], end_a: Optional[int], start_b: Optional[int], end_b: Optional[int]) -> bool:
+    low_a, high_a = start_a or 1, end_a if end_a is not None else float('inf')
+    low_b, high_b = start_b or 1, end_b if end_b is not None else float('inf')
+    return low_a <= high_b and low_b <= high_a
+
+
+def ranges_intersect(a: GridRange, b: GridRange) -> bool:
+    """Whether two ranges may share at least one cell."""
+    if a.sheet is not None and b.sheet is not None and a.sheet != b.sheet:
+        return False
+    return (
+        _spans_overlap(a.start_row, a.end_row, b.start_row, b.end_row)
+        and _spans_overlap(a.start_col, a.end_col, b.start_col, b.end_col)
+    )
+
+
+class SpreadsheetValuesCache:
+    """
+    Thread-safe LRU cache of range values, grouped by spreadsheet.
+
+    Each spreadsheet carries the Drive version its entries were read at and
+    the time that version was last confirmed; callers revalidate once
+    `revalidate_seconds` have passed since the last confirmation.
+
+    Reads that miss take a `generation()` before calling the API and pass it
+    to `put`, which ignores the values if the spreadsheet was invalidated in
+    the meantime. Spreadsheets whose version cannot be read (e.g. Drive
+    returns 404 under the drive.file scope) are marked unverifiable and
+    bypass the cache, without a new version check, for `unverifiable_seconds`.
+    """
+
+    def __init__(self, max_entries: int = 512, revalidate_seconds: float = 2.0, unverifiable_seconds: float = 600.0):
+        self.max_entries = max_entries
+        self.revalidate_seconds = revalidate_seconds
+        self.unverifiable_seconds = unverifiable_seconds
+        self._entries: "OrderedDict[Tuple[Hashable, str, str], Tuple[GridRange, List[List[Any]]]]" = OrderedDict()
+        self._versions: Dict[Hashable, Tuple[Optional[str], float]] = {}
+        self._unverifiable: Dict[Hashable, float] = {}
+        # Generation at which each spreadsheet was last invalidated
+        self._generation = 0
+        self._invalidated_at: Dict[Hashable, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def generation(self) -> int:
+        """Current generation, taken before a read whose result will be `put`."""
+        with self._lock:
+            return self._generation
+
+    def get(self, key: Hashable, range_name: str, value_render_option: str) -> Optional[List[List[Any]]]:
+        """Return a copy of the cached values, or None on a miss."""
+        entry_key = (key, range_name, value_render_option)
+        with self._lock:
+            entry = self._entries.get(entry_key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(entry_key)
+            self.hits += 1
+            return [list(row) for row in entry[1]]
+
+    def put(self, key: Hashable, range_name: str, value_render_option: str, values: List[List[Any]], generation: int) -> None:
+        """Store values read at `generation`, evicting the least recently used entries past the limit."""
+        entry_key = (key, range_name, value_render_option)
+        with self._lock:
+            if key not in self._versions:
+                # Nothing to revalidate against: the values cannot be trusted later
+                return
+            if self._invalidated_at.get(key, 0) > generation:
+                # Invalidated while the values were being read: they may predate the change
+                return
+            self._entries[entry_key] = (parse_a1_range(range_name), [list(row) for row in values])
+            self._entries.move_to_end(entry_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _invalidate(self, key: Hashable, written: Optional[GridRange]) -> None:
+        # Called with the lock held
+        self._generation += 1
+        self._invalidated_at[key] = self._generation
+        for entry_key, (grid_range, _) in list(self._entries.items()):
+            if entry_key[0] != key:
+                continue
+            if written is None or entry_key[2] != FORMULA_RENDER_OPTION or ranges_intersect(grid_range, written):
+                del self._entries[entry_key]
+
+    def invalidate(self, key: Hashable, range_name: Optional[str] = None) -> None:
+        """
+        Drop the entries of a spreadsheet after a write to `range_name` (all of them if None).
+
+        Computed values are all dropped, since any formula may depend on the
+        written cells; formulas are dropped only where they intersect the write.
+        """
+        written = parse_a1_range(range_name) if range_name else None
+        with self._lock:
+            self._invalidate(key, written)
+
+    def keys_for(self, predicate) -> List[Hashable]:
+        """Spreadsheet keys known to the cache that match `predicate`."""
+        with self._lock:
+            return [key for key in self._versions if predicate(key)]
+
+    def needs_revalidation(self, key: Hashable) -> bool:
+        """Whether the spreadsheet's version should be checked before serving entries."""
+        now = time.monotonic()
+        with self._lock:
+            marked = self._unverifiable.get(key)
+            if marked is not None:
+                if now - marked < self.unverifiable_seconds:
+                    return False
+                del self._unverifiable[key]
+            version = self._versions.get(key)
+        return version is None or now - version[1] >= self.revalidate_seconds
+
+    def mark_unverifiable(self, key: Hashable) -> None:
+        """Bypass the cache for a spreadsheet whose version cannot be read, without checking it again for a while."""
+        now = time.monotonic()
+        with self._lock:
+            for expired in [k for k, marked in self._unverifiable.items() if now - marked >= self.unverifiable_seconds]:
+                del self._unverifiable[expired]
+            self._versions.pop(key, None)
+            self._unverifiable[key] = now
+            self._invalidate(key, None)
+
+    def set_version(self, key: Hashable, version: Optional[str]) -> None:
+        """
+        Record the spreadsheet's current Drive version, dropping its entries if it changed.
+
+        A None version (the check failed) drops the entries and stops caching
+        for that spreadsheet until a version can be confirmed again.
+        """
+        with self._lock:
+            previous = self._versions.get(key)
+            if version is None:
+                self._versions.pop(key, None)
+            else:
+                self._versions[key] = (version, time.monotonic())
+                if len(self._versions) > self.max_entries:
+                    # Forget spreadsheets that no longer have cached entries
+                    live_keys = {entry_key[0] for entry_key in self._entries}
+                    for stale_key in [k for k in self._versions if k not in live_keys and k != key]:
+                        del self._versions[stale_key]
+                        self._invalidated_at.pop(stale_key, None)
+            if version is None or previous is None or previous[0] != version:
+                # Also fences reads that started before the spreadsheet was (re)registered
+                self._invalidate(key, None)
+
+
+class _InFlightCall:
+    """An upstream call that concurrent callers for the same key wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlightTTLCache:
+    """
+    TTL cache whose loads are collapsed per key (single-flight).
+
+    While a value is being loaded, other callers asking for the same key wait
+    for that load instead of issuing their own upstream call.
+    """
+
+    def __init__(self, ttl_seconds: float = 60.0, max_entries: int = 256):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._in_flight: Dict[Hashable, _InFlightCall] = {}
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key: Hashable, loader) -> Any:
+        """Return the cached value for `key`, calling `loader()` at most once across concurrent callers."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl_seconds:
+                self._entries.move_to_end(key)
+                return copy.deepcopy(entry[1])
+            call = self._in_flight.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._in_flight[key] = _InFlightCall()
+
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = loader()
+            with self._lock:
+                self._entries[key] = (time.monotonic(), call.result)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            return copy.deepcopy(call.result)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            call.done.set()
+
+    def invalidate(self, predicate) -> None:
+        """Drop the cached values whose key matches `predicate`."""
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
@@ -0,0 +1,80 @@
+"""
+Token counting for context budgets.
+
+Uses the model's tiktoken encoding when tiktoken is installed and the
+encoding can be loaded, and falls back to an estimate of one token per four
+characters otherwise (e.g. Claude models, or no access to the encoding files).
+"""
+
+import logging
+from functools import lru_cache
+from typing import Any, Iterable, Optional
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken is optional
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Encoding used for models tiktoken does not know about
+FALLBACK_ENCODING = "o200k_base"
+
+# Rough per-message overhead (role, separators) added by chat formats
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model_name: str) -> Optional[Any]:
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            return tiktoken.get_encoding(FALLBACK_ENCODING)
+    except Exception as e:
+        logger.warning(f"Could not load a tiktoken encoding for {model_name}, estimating token counts: {e}")
+        return None
+
+
+def count_tokens(text: str, model_name: str = "gpt-4o") -> int:
+    """
+    Count the tokens of a text for a model.
+
+    Args:
+        text: The text to count
+        model_name: Model whose tokenizer to use
+
+    Returns:
+        The exact token count, or an estimate if no tokenizer is available
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding(model_name)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def message_text(content: Any) -> str:
+    """The text of a message's content, which is either a string or a list of content blocks."""
+    if isinstance(content, str):
+        return content
+    parts = []
+    for block in content or []:
+        if isinstance(block, str):
+            parts.append(block)
+        elif isinstance(block, dict) and isinstance(block.get("text"), str):
+            parts.append(block["text"])
+    return "".join(parts)
+
+
+def count_message_tokens(messages: Iterable[Any], model_name: str = "gpt-4o") -> int:
+    """Count the tokens of a list of chat messages, including tool call arguments."""
+    total = 0
+    for message in messages:
+        total += MESSAGE_OVERHEAD_TOKENS + count_tokens(message_text(message.content), model_name)
+        for tool_call in getattr(message, "tool_calls", None) or []:
+            total += count_tokens(str(tool_call.get("args", "")), model_name)
+    return total
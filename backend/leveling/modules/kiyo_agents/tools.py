@@ -1,36 +1,114 @@
+import json
+import time
 import logging
 
 logger = logging.getLogger(__name__)
 
-from typing import List, Dict, Any, Optional, Annotated
+from typing import List, Dict, Any, Optional, Annotated, Tuple
+from typing_extensions import TypedDict
 from langchain.tools import tool
 from langchain_core.tools import InjectedToolCallId
 from langchain_core.messages import ToolMessage
+from langchain_core.runnables import RunnableConfig
+from langgraph.config import get_stream_writer
 from langgraph.types import Command
 from .google_sheets_service import GoogleSheetsService
 
-def create_google_sheets_tools(sheets_service: GoogleSheetsService, spreadsheet_id: str) -> List[Dict[str, Any]]:
-    """Create Google Sheets related tools with proper error handling and state updates."""
+# Run-config keys carrying the per-request Google context. The token key starts
+# with a double underscore so LangGraph never copies it into checkpoint metadata.
+GOOGLE_ACCESS_TOKEN_KEY = "__google_access_token"
+SPREADSHEET_ID_KEY = "spreadsheet_id"
+
+
+class SheetRangeUpdate(TypedDict):
+    """One range to write in a batch write."""
+    range_name: str
+    values: List[List[Any]]
+
+
+def _get_sheets_context(config: RunnableConfig) -> Tuple[GoogleSheetsService, Optional[str]]:
+    """Build the Sheets service and target spreadsheet for the current run."""
+    configurable = (config or {}).get("configurable", {})
+    access_token = configurable.get(GOOGLE_ACCESS_TOKEN_KEY)
+    if not access_token:
+        raise ValueError("No Google access token provided for this conversation")
+    return GoogleSheetsService(access_token), configurable.get(SPREADSHEET_ID_KEY)
+
+
+def _emit_stream_event(event: Dict[str, Any]) -> None:
+    """Send an event to the graph's "custom" stream; a no-op when the tool runs outside a graph."""
+    try:
+        writer = get_stream_writer()
+    except RuntimeError:
+        return
+    writer(event)
+
+
+class _ToolRun:
+    """One tool execution, reported as tool_start/tool_end stream events and logged with its timing."""
+
+    def __init__(self, tool: str, tool_call_id: str, range_name: Optional[str] = None):
+        self.tool = tool
+        self.tool_call_id = tool_call_id
+        self.range_name = range_name
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self._started = time.monotonic()
+        _emit_stream_event({"type": "tool_start", "tool": tool, "tool_call_id": tool_call_id, "range": range_name})
+
+    def end(self, tool_message: ToolMessage) -> None:
+        """Report the outcome, taking the status from the tool's message."""
+        event = {
+            "type": "tool_end",
+            "tool": self.tool,
+            "tool_call_id": self.tool_call_id,
+            "range": self.range_name,
+            "status": tool_message.status,
+            "duration_ms": round((time.monotonic() - self._started) * 1000),
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+        }
+        _emit_stream_event(event)
+        logger.info(
+            f"Tool {self.tool} ({self.range_name or '-'}) finished with status {event['status']} "
+            f"in {event['duration_ms']} ms, read {self.bytes_read} B, wrote {self.bytes_written} B"
+        )
+
+
+def _payload_size(values: Any) -> int:
+    """Size in bytes of values as they are sent to the Sheets API."""
+    return len(json.dumps(values, default=str).encode())
+
+
+def create_google_sheets_tools() -> List[Dict[str, Any]]:
+    """Create Google Sheets related tools with proper error handling and state updates.
+
+    The tools hold no per-request state: the access token and spreadsheet ID are
+    read from the run config on each call, so the same tool objects (and the
+    graph they are bound into) can be shared across conversations.
+    """
 
-    #logger.info(f"Creating Google Sheets tools for spreadsheet: {spreadsheet_id}")
-    
     @tool
     def read_google_sheet(
         range_name: str,
-        tool_call_id: Annotated[str, InjectedToolCallId]
+        tool_call_id: Annotated[str, InjectedToolCallId],
+        config: RunnableConfig
     ) -> Command:
         """Tool for reading from Google Sheets.
         
         Args:
             range_name: The A1 notation of the range to read (e.g., 'Sheet1!A1:D10')
             tool_call_id: Automatically injected tool call ID
+            config: Automatically injected run config
             
         Returns:
             Command object with state update including the tool message
         """
-        logger.info(f"Reading from Google Sheets: {spreadsheet_id} - {range_name}")
-
+        run = _ToolRun("read_google_sheet", tool_call_id, range_name=range_name)
         try:
+            sheets_service, spreadsheet_id = _get_sheets_context(config)
+            logger.info(f"Reading from Google Sheets: {spreadsheet_id} - {range_name}")
+
             data = sheets_service.read_sheet_data(
                 spreadsheet_id, 
                 range_name,
@@ -38,6 +116,7 @@ def create_google_sheets_tools(sheets_service: GoogleSheetsService, spreadsheet_
             )
             # Format data for better readability
             formatted_data = str(data) if isinstance(data, (str, int, float)) else str(data)
+            run.bytes_read = _payload_size(data)
             
             # Create a ToolMessage for the response
             tool_message = ToolMessage(
@@ -47,6 +126,7 @@ def create_google_sheets_tools(sheets_service: GoogleSheetsService, spreadsheet_
             )
             
             # Return a Command to update state with message
+            run.end(tool_message)
             return Command(
                 update={
                     "messages": [tool_message]
@@ -63,6 +143,7 @@ def create_google_sheets_tools(sheets_service: GoogleSheetsService, spreadsheet_
                 status="error"
             )
             
+            run.end(tool_message)
             return Command(
                 update={
                     "messages": [tool_message]
@@ -72,20 +153,24 @@ def create_google_sheets_tools(sheets_service: GoogleSheetsService, spreadsheet_
     @tool
     def read_google_sheet_formulas(
         range_name: str,
-        tool_call_id: Annotated[str, InjectedToolCallId]
+        tool_call_id: Annotated[str, InjectedToolCallId],
+        config: RunnableConfig
     ) -> Command:
         """Tool for reading formulas from Google Sheets.
         
         Args:
             range_name: The A1 notation of the range to read (e.g., 'Sheet1!A1:D10')
             tool_call_id: Automatically injected tool call ID
+            config: Automatically injected run config
             
         Returns:
             Command object with state update including the tool message
         """
-        logger.info(f"Reading formulas from Google Sheets: {spreadsheet_id} - {range_name}")
-
+        run = _ToolRun("read_google_sheet_formulas", tool_call_id, range_name=range_name)
         try:
+            sheets_service, spreadsheet_id = _get_sheets_context(config)
+            logger.info(f"Reading formulas from Google Sheets: {spreadsheet_id} - {range_name}")
+
             data = sheets_service.read_sheet_data(
                 spreadsheet_id, 
                 range_name,
@@ -93,6 +178,7 @@ def create_google_sheets_tools(sheets_service: GoogleSheetsService, spreadsheet_
             )
             # Format data for better readability
             formatted_data = str(data) if isinstance(data, (str, int, float)) else str(data)
+            run.bytes_read = _payload_size(data)
             
             # Create a ToolMessage for the response
             tool_message = ToolMessage(
@@ -102,6 +188,7 @@ def create_google_sheets_tools(sheets_service: GoogleSheetsService, spreadsheet_
             )
             
             # Return a Command to update state with message
+            run.end(tool_message)
             return Command(
                 update={
                     "messages": [tool_message]
@@ -118,6 +205,73 @@ def create_google_sheets_tools(sheets_service: GoogleSheetsService, spreadsheet_
                 status="error"
             )
             
+            run.end(tool_message)
+            return Command(
+                update={
+                    "messages": [tool_message]
+                }
+            )
+
+    @tool
+    def batch_read_google_sheet(
+        ranges: List[str],
+        tool_call_id: Annotated[str, InjectedToolCallId],
+        config: RunnableConfig,
+        value_render_options: Optional[List[str]] = None
+    ) -> Command:
+        """Tool for reading several ranges from Google Sheets in a single call, as values and/or formulas.
+        
+        Args:
+            ranges: A1 notation ranges to read (e.g., ['Sheet1!A1:D10', 'Sheet1!F1:H10'])
+            tool_call_id: Automatically injected tool call ID
+            config: Automatically injected run config
+            value_render_options: How to render the cells, any of "FORMATTED_VALUE" (calculated values)
+                and "FORMULA" (the formulas themselves). Defaults to ["FORMATTED_VALUE"].
+            
+        Returns:
+            Command object with state update including the tool message
+        """
+        run = _ToolRun("batch_read_google_sheet", tool_call_id, range_name=", ".join(ranges))
+        try:
+            sheets_service, spreadsheet_id = _get_sheets_context(config)
+            logger.info(f"Batch reading from Google Sheets: {spreadsheet_id} - {ranges} ({value_render_options})")
+
+            results = sheets_service.batch_read(
+                spreadsheet_id,
+                ranges,
+                value_render_options=value_render_options
+            )
+            # One labelled block per (render option, range)
+            formatted_data = "\n\n".join(
+                f"[{render_option}] {range_name}:\n{str(values)}"
+                for render_option, grids in results.items()
+                for range_name, values in zip(ranges, grids)
+            )
+            run.bytes_read = _payload_size(results)
+            
+            tool_message = ToolMessage(
+                content=formatted_data,
+                tool_call_id=tool_call_id,
+                status="success"
+            )
+            
+            run.end(tool_message)
+            return Command(
+                update={
+                    "messages": [tool_message]
+                }
+            )
+        except Exception as e:
+            error_msg = f"Error batch reading from Google Sheets: {str(e)}"
+            logger.error(error_msg)
+            
+            tool_message = ToolMessage(
+                content=error_msg,
+                tool_call_id=tool_call_id,
+                status="error"
+            )
+            
+            run.end(tool_message)
             return Command(
                 update={
                     "messages": [tool_message]
@@ -129,6 +283,7 @@ def create_google_sheets_tools(sheets_service: GoogleSheetsService, spreadsheet_
         range_name: str, 
         values: List[List[Any]], 
         tool_call_id: Annotated[str, InjectedToolCallId],
+        config: RunnableConfig,
         is_append: bool = False
     ) -> Command:
         """Tool for writing to Google Sheets.
@@ -137,15 +292,19 @@ def create_google_sheets_tools(sheets_service: GoogleSheetsService, spreadsheet_
             range_name: The A1 notation of the range to write to (e.g., 'Sheet1!A1')
             values: 2D array of values to write
             tool_call_id: Automatically injected tool call ID
+            config: Automatically injected run config
             is_append: If True, appends data. If False, overwrites data.
             
         Returns:
             Command object with state update including the tool message
         """
         
-        logger.info(f"Writing to Google Sheets: {spreadsheet_id} - {range_name}")
-        
+        run = _ToolRun("write_google_sheet", tool_call_id, range_name=range_name)
         try:
+            sheets_service, spreadsheet_id = _get_sheets_context(config)
+            logger.info(f"Writing to Google Sheets: {spreadsheet_id} - {range_name}")
+            run.bytes_written = _payload_size(values)
+
             if is_append:
                 result = sheets_service.append_sheet_data(
                     spreadsheet_id,
@@ -168,6 +327,7 @@ def create_google_sheets_tools(sheets_service: GoogleSheetsService, spreadsheet_
                 status="success"
             )
             
+            run.end(tool_message)
             return Command(
                 update={
                     "messages": [tool_message]
@@ -184,6 +344,72 @@ def create_google_sheets_tools(sheets_service: GoogleSheetsService, spreadsheet_
                 status="error"
             )
             
+            run.end(tool_message)
+            return Command(
+                update={
+                    "messages": [tool_message]
+                }
+            )
+
+    @tool
+    def batch_write_google_sheet(
+        updates: List[SheetRangeUpdate],
+        tool_call_id: Annotated[str, InjectedToolCallId],
+        config: RunnableConfig
+    ) -> Command:
+        """Tool for writing many ranges to Google Sheets in a single call (overwrites data).
+        
+        Args:
+            updates: List of writes, each with a range_name in A1 notation (e.g., 'Sheet1!D4:F4')
+                and the 2D array of values to write there
+            tool_call_id: Automatically injected tool call ID
+            config: Automatically injected run config
+            
+        Returns:
+            Command object with state update including the tool message, reporting the outcome of each range
+        """
+        run = _ToolRun("batch_write_google_sheet", tool_call_id, range_name=", ".join(update["range_name"] for update in updates))
+        try:
+            sheets_service, spreadsheet_id = _get_sheets_context(config)
+            logger.info(f"Batch writing {len(updates)} ranges to Google Sheets: {spreadsheet_id}")
+            run.bytes_written = _payload_size([update["values"] for update in updates])
+
+            outcomes = sheets_service.batch_write(
+                spreadsheet_id,
+                [{"range": update["range_name"], "values": update["values"]} for update in updates]
+            )
+            failed = [outcome for outcome in outcomes if outcome["status"] != "success"]
+            lines = [
+                f"- {outcome['range']}: wrote {outcome['updated_cells']} cells"
+                if outcome["status"] == "success"
+                else f"- {outcome['range']}: error: {outcome['error']}"
+                for outcome in outcomes
+            ]
+            summary = f"Wrote {len(outcomes) - len(failed)} of {len(outcomes)} ranges:\n" + "\n".join(lines)
+            
+            tool_message = ToolMessage(
+                content=summary,
+                tool_call_id=tool_call_id,
+                status="error" if failed else "success"
+            )
+            
+            run.end(tool_message)
+            return Command(
+                update={
+                    "messages": [tool_message]
+                }
+            )
+        except Exception as e:
+            error_msg = f"Error batch writing to Google Sheets: {str(e)}"
+            logger.error(error_msg)
+            
+            tool_message = ToolMessage(
+                content=error_msg,
+                tool_call_id=tool_call_id,
+                status="error"
+            )
+            
+            run.end(tool_message)
             return Command(
                 update={
                     "messages": [tool_message]
@@ -192,26 +418,27 @@ def create_google_sheets_tools(sheets_service: GoogleSheetsService, spreadsheet_
 
     @tool
     def get_sheet_names(
-        tool_call_id: Annotated[str, InjectedToolCallId]
+        tool_call_id: Annotated[str, InjectedToolCallId],
+        config: RunnableConfig
     ) -> Command:
         """Tool for retrieving sheet names from Google Sheets.
         
         Args:
             tool_call_id: Automatically injected tool call ID
+            config: Automatically injected run config
             
         Returns:
             Command object with state update including the tool message
         """
         
-        logger.info(f"Retrieving sheet names for spreadsheet: {spreadsheet_id}")
-
+        run = _ToolRun("get_sheet_names", tool_call_id)
         try:
-            # Retrieve the spreadsheet metadata
-            sheet_metadata = sheets_service.get_spreadsheet_metadata(spreadsheet_id)
-            
-            # Extract sheet names
-            sheets = sheet_metadata.get('sheets', [])
-            sheet_names = [sheet.get("properties", {}).get("title", "Sheet1") for sheet in sheets]
+            sheets_service, spreadsheet_id = _get_sheets_context(config)
+            logger.info(f"Retrieving sheet names for spreadsheet: {spreadsheet_id}")
+
+            # Retrieve the sheet names from the (cached) spreadsheet metadata
+            sheet_names = sheets_service.get_sheet_names(spreadsheet_id)
+            run.bytes_read = _payload_size(sheet_names)
             
             # Create a ToolMessage for the response
             tool_message = ToolMessage(
@@ -221,6 +448,7 @@ def create_google_sheets_tools(sheets_service: GoogleSheetsService, spreadsheet_
             )
             
             # Return a Command to update state with message
+            run.end(tool_message)
             return Command(
                 update={
                     "messages": [tool_message],
@@ -238,11 +466,12 @@ def create_google_sheets_tools(sheets_service: GoogleSheetsService, spreadsheet_
                 status="error"
             )
             
+            run.end(tool_message)
             return Command(
                 update={
                     "messages": [tool_message]
                 }
             )
 
-    tools = [read_google_sheet, read_google_sheet_formulas, write_google_sheet, get_sheet_names]
+    tools = [read_google_sheet, read_google_sheet_formulas, batch_read_google_sheet, write_google_sheet, batch_write_google_sheet, get_sheet_names]
     return tools 
\ No newline at end of file
@@ -4,7 +4,8 @@ from .models import Project, Document, Spreadsheet
 class DocumentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Document
-        fields = ['id', 'name', 'file', 'uploaded_at', 'project']
+        fields = ['id', 'name', 'file', 'uploaded_at', 'project', 'status', 'sha256', 'error', 'processed_at']
+        read_only_fields = ['status', 'sha256', 'error', 'processed_at']
 
 class SpreadsheetSerializer(serializers.ModelSerializer):
     class Meta:
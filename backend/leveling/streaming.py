@@ -0,0 +1,257 @@
+"""
+Server-Sent Events encoding of agent stream chunks.
+
+Two protocol versions are supported, selected per request with the
+`stream_protocol` field:
+
+1 (legacy, default): every `chunk` event carries the whole answer so far.
+   Kept for the current frontend.
+2 (delta): `delta` events carry only the new text, numbered with `seq`; the
+   stream ends with one `message` event holding the full answer, then `done`.
+   Tool events carry a `seq` too, so clients can order everything they receive.
+
+Both versions report tool executions as `tool_start` and `tool_end` events
+(tool name, range, and on completion status, duration_ms, bytes_read and
+bytes_written), and the extraction of attached PDFs, before the agent
+starts, as `pdf_progress` events (filename, pages_done, page_count, chars,
+elapsed_ms, status).
+
+Before encoding, consecutive text chunks are coalesced into one frame per
+time window or byte size (SSE_COALESCE_WINDOW_MS / SSE_COALESCE_MAX_BYTES),
+so a response is a few dozen writes rather than one per token. Tool events
+and the end of the stream flush pending text immediately.
+"""
+
+import os
+import json
+import time
+import queue
+import asyncio
+import threading
+import contextvars
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+# Coalescing settings; a window of 0 sends every chunk as it arrives
+SSE_COALESCE_WINDOW_MS = float(os.getenv('SSE_COALESCE_WINDOW_MS', '30'))
+SSE_COALESCE_MAX_BYTES = int(os.getenv('SSE_COALESCE_MAX_BYTES', '512'))
+
+STREAM_PROTOCOL_LEGACY = 1
+STREAM_PROTOCOL_DELTA = 2
+STREAM_PROTOCOLS = (STREAM_PROTOCOL_LEGACY, STREAM_PROTOCOL_DELTA)
+
+TOOL_EVENTS = ("tool_start", "tool_end")
+PDF_PROGRESS_EVENT = "pdf_progress"
+# Events forwarded to the client as they are
+STATUS_EVENTS = TOOL_EVENTS + (PDF_PROGRESS_EVENT,)
+
+
+def sse_event(event: str, payload: Any) -> str:
+    """Formats a single Server-Sent Events frame."""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+def _event_payload(chunk: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: value for key, value in chunk.items() if key != "type"}
+
+
+def parse_stream_protocol(value: Any) -> int:
+    """Validate the requested protocol version; missing or empty means legacy."""
+    if value in (None, ''):
+        return STREAM_PROTOCOL_LEGACY
+    try:
+        version = int(value)
+    except (TypeError, ValueError):
+        version = None
+    if version not in STREAM_PROTOCOLS:
+        raise ValueError(f'Unsupported stream_protocol: {value}')
+    return version
+
+
+class ChunkCoalescer:
+    """
+    Merges consecutive text chunks of an agent stream.
+
+    Text is held until `window_seconds` have passed since the first pending
+    chunk or `max_bytes` are pending; any other chunk (e.g. a tool event)
+    first flushes the pending text, so ordering is preserved.
+    """
+
+    def __init__(self, window_seconds: float = SSE_COALESCE_WINDOW_MS / 1000, max_bytes: int = SSE_COALESCE_MAX_BYTES):
+        self.window_seconds = window_seconds
+        self.max_bytes = max_bytes
+        self._pending: List[str] = []
+        self._pending_bytes = 0
+        self._pending_since: Optional[float] = None
+
+    def time_until_flush(self) -> Optional[float]:
+        """Seconds until the pending text is due, or None if nothing is pending."""
+        if self._pending_since is None:
+            return None
+        return max(0.0, self._pending_since + self.window_seconds - time.monotonic())
+
+    def add(self, chunk: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Add a chunk and return the chunks ready to send."""
+        if chunk["type"] != "message":
+            return self.flush() + [chunk]
+        if self._pending_since is None:
+            self._pending_since = time.monotonic()
+        self._pending.append(chunk["delta"])
+        self._pending_bytes += len(chunk["delta"].encode())
+        if self._pending_bytes >= self.max_bytes or self.time_until_flush() == 0:
+            return self.flush()
+        return []
+
+    def flush(self) -> List[Dict[str, Any]]:
+        """Return the pending text as one chunk (an empty list if nothing is pending)."""
+        if not self._pending:
+            return []
+        chunk = {"delta": ''.join(self._pending), "type": "message"}
+        self._pending, self._pending_bytes, self._pending_since = [], 0, None
+        return [chunk]
+
+
+def coalesce_chunks(chunks: Iterator[Dict[str, Any]], coalescer: ChunkCoalescer) -> Iterator[Dict[str, Any]]:
+    """
+    Coalesce a chunk stream, flushing pending text when its window expires.
+
+    Sync counterpart of acoalesce_chunks: the source is consumed by a thread
+    feeding a queue, so pending text goes out while the agent is between
+    chunks instead of waiting for the next one.
+    """
+    chunk_queue: queue.Queue = queue.Queue(maxsize=256)
+    stopped = threading.Event()
+    end = object()
+
+    def put(item) -> bool:
+        # Gives up once the consumer is gone, so the thread does not block on a full queue
+        while not stopped.is_set():
+            try:
+                chunk_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def pump():
+        try:
+            for chunk in chunks:
+                if not put(chunk):
+                    break
+            else:
+                put(end)
+        except Exception as e:
+            put(e)
+        finally:
+            if stopped.is_set() and hasattr(chunks, "close"):
+                chunks.close()
+
+    # The source runs in the caller's context, as it would when iterated directly
+    context = contextvars.copy_context()
+    threading.Thread(target=context.run, args=(pump,), name="sse-coalesce", daemon=True).start()
+    try:
+        while True:
+            try:
+                item = chunk_queue.get(timeout=coalescer.time_until_flush())
+            except queue.Empty:
+                yield from coalescer.flush()
+                continue
+            if item is end:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield from coalescer.add(item)
+        yield from coalescer.flush()
+    finally:
+        stopped.set()
+
+
+async def acoalesce_chunks(chunks: AsyncIterator[Dict[str, Any]], coalescer: ChunkCoalescer) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Coalesce an async chunk stream, flushing pending text when its window expires.
+
+    The source is consumed by its own task feeding a queue, so waiting for the
+    window never cancels a pending read from the agent stream.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=256)
+    end = object()
+
+    async def pump():
+        try:
+            async for chunk in chunks:
+                await queue.put(chunk)
+            await queue.put(end)
+        except Exception as e:
+            await queue.put(e)
+
+    pump_task = asyncio.ensure_future(pump())
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout=coalescer.time_until_flush())
+            except asyncio.TimeoutError:
+                for ready in coalescer.flush():
+                    yield ready
+                continue
+            if item is end:
+                break
+            if isinstance(item, Exception):
+                raise item
+            for ready in coalescer.add(item):
+                yield ready
+        for ready in coalescer.flush():
+            yield ready
+    finally:
+        if not pump_task.done():
+            pump_task.cancel()
+
+
+class LegacySSEEncoder:
+    """Protocol 1: resend the accumulated answer in each `chunk` event."""
+
+    def __init__(self):
+        self._text_parts: List[str] = []
+
+    def encode(self, chunk: Dict[str, Any]) -> Optional[str]:
+        if chunk["type"] == "message":
+            self._text_parts.append(chunk["delta"])
+            return sse_event("chunk", {'text': ''.join(self._text_parts), 'finished': False})
+        elif chunk["type"] in STATUS_EVENTS:
+            return sse_event(chunk["type"], _event_payload(chunk))
+        return None
+
+    def close(self) -> str:
+        return sse_event("done", {'finished': True})
+
+
+class DeltaSSEEncoder:
+    """Protocol 2: numbered text deltas, then the consolidated message."""
+
+    def __init__(self):
+        self._text_parts: List[str] = []
+        self._seq = 0
+
+    def _next_seq(self) -> int:
+        self._seq += 1
+        return self._seq
+
+    def encode(self, chunk: Dict[str, Any]) -> Optional[str]:
+        if chunk["type"] == "message":
+            self._text_parts.append(chunk["delta"])
+            return sse_event("delta", {'seq': self._next_seq(), 'text': chunk["delta"]})
+        elif chunk["type"] in STATUS_EVENTS:
+            return sse_event(chunk["type"], {'seq': self._next_seq(), **_event_payload(chunk)})
+        return None
+
+    def close(self) -> str:
+        text = ''.join(self._text_parts)
+        return (
+            sse_event("message", {'seq': self._next_seq(), 'text': text})
+            + sse_event("done", {'finished': True})
+        )
+
+
+def create_sse_encoder(protocol: int = STREAM_PROTOCOL_LEGACY):
+    """Return a fresh encoder for one stream in the given protocol version."""
+    if protocol == STREAM_PROTOCOL_DELTA:
+        return DeltaSSEEncoder()
+    return LegacySSEEncoder()
@@ -1,3 +1,663 @@
-from django.test import TestCase
+import os
+import json
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+import httpx
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langgraph.checkpoint.memory import InMemorySaver
+
+from leveling.documents import DocumentNotReadyError, load_documents
+from leveling.models import AgentCheckpoint, AgentCheckpointBlob, Document
+from leveling.modules.kiyo_agents import construction_agent, pdf_processor
+from leveling.modules.kiyo_agents.checkpointer import DatabaseCheckpointSaver
+from leveling.modules.kiyo_agents.construction_agent import ConstructionAgent
+from leveling.modules.config.model_configs import get_config_names
+from leveling.modules.evaluation import file_processing
+from leveling.modules.evaluation.runner import (
+    DEFAULT_MAX_CONCURRENCY, PROVIDER_GOOGLE, PROVIDER_OPENAI, ConcurrencyLimiter, ProviderSlotCallback, run_evaluations
+)
+from leveling.modules.evaluation.sheet_pool import TemplateSheetPool
+from leveling.modules.kiyo_agents.http_cassette import MODE_RECORD, MODE_REPLAY, CassetteMissError, CassetteTransport
+from leveling.modules.kiyo_agents.http_client import create_http_client, use_request_gate
+from leveling.modules.kiyo_agents.llm_cassette import LlmCassette, LlmCassetteMissError
+from leveling.modules.kiyo_agents.message_builder import strip_repeated_lines
+from leveling.modules.kiyo_agents import google_sheets_service
+from leveling.modules.kiyo_agents.google_sheets_service import GoogleSheetsService
+from leveling.modules.kiyo_agents.sheet_cache import GridRange, SpreadsheetValuesCache, parse_a1_range, ranges_intersect
+from leveling.streaming import ChunkCoalescer, coalesce_chunks
+
+# Number of messages the fake model received on each call (chat models are
+# pydantic models, so this lives outside the class)
+MODEL_CALLS = []
+
+
+class FixedReplyChatModel(BaseChatModel):
+    """Chat model that always answers 'ok' and records how many messages it was sent."""
+
+    @property
+    def _llm_type(self) -> str:
+        return "fixed-reply"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        MODEL_CALLS.append(len(messages))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="ok"))])
+
+
+class NumberedReplyChatModel(BaseChatModel):
+    """Chat model answering 'reply N', numbering its answers across all conversations."""
+
+    @property
+    def _llm_type(self) -> str:
+        return "numbered-reply"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        MODEL_CALLS.append(len(messages))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=f"reply {len(MODEL_CALLS)}"))])
+
+
+class AgentPatchMixin:
+    """Runs ConstructionAgent against a test checkpointer (and chat model), with fresh graph and model caches."""
+
+    def patch_agent(self, saver, model=None):
+        """Give agents `saver` as their checkpointer and, if given, chat models made by `model`."""
+        patchers = [
+            mock.patch.object(construction_agent, 'get_checkpointer', lambda: saver),
+            mock.patch.dict(construction_agent._graph_cache, clear=True),
+            mock.patch.dict(construction_agent._model_cache, clear=True),
+        ]
+        if model is not None:
+            patchers.append(mock.patch.object(ConstructionAgent, '_get_model', lambda agent: model()))
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class IncrementalTurnInputTests(AgentPatchMixin, SimpleTestCase):
+    """Each turn sends only the new message into the graph; history comes from the checkpointer."""
+
+    turns = 30
+
+    def setUp(self):
+        MODEL_CALLS.clear()
+        self.patch_agent(InMemorySaver(), FixedReplyChatModel)
+        self.agent = ConstructionAgent('', 'spreadsheet-id', {
+            "configurable": {"model": "gpt-4o", "system_instructions": "Test instructions"}
+        })
+
+    def _history(self, conversation_id):
+        return self.agent.graph.get_state({"configurable": {"thread_id": conversation_id}}).values["messages"]
+
+    def test_process_message_input_size_is_constant(self):
+        with mock.patch.object(self.agent.graph, 'invoke', wraps=self.agent.graph.invoke) as invoke:
+            for _ in range(self.turns):
+                self.agent.process_message("How do the bids compare?", "conversation-1")
+
+        input_sizes = [len(call.args[0]["messages"]) for call in invoke.call_args_list]
+        self.assertEqual(input_sizes, [1] * self.turns)
+        # The history holds each turn once: one question and one answer per turn
+        self.assertEqual(len(self._history("conversation-1")), 2 * self.turns)
+        # The model sees the system message plus the history, without duplicates
+        self.assertEqual(MODEL_CALLS, [2 * turn + 2 for turn in range(self.turns)])
+
+    def test_stream_input_size_is_constant(self):
+        with mock.patch.object(self.agent.graph, 'stream', wraps=self.agent.graph.stream) as stream:
+            for _ in range(self.turns):
+                list(self.agent.process_message_stream("How do the bids compare?", "conversation-2"))
+
+        input_sizes = [len(call.args[0]["messages"]) for call in stream.call_args_list]
+        self.assertEqual(input_sizes, [1] * self.turns)
+        self.assertEqual(len(self._history("conversation-2")), 2 * self.turns)
+
+
+class EvaluationLimitTests(AgentPatchMixin, SimpleTestCase):
+    """Provider slots are held for the duration of each model and Google call, and only then."""
+
+    def setUp(self):
+        self.limiter = ConcurrencyLimiter(provider_limits={PROVIDER_OPENAI: 1, PROVIDER_GOOGLE: 1})
+        self.addCleanup(use_request_gate, None)
+
+    def _free_slots(self, provider):
+        return self.limiter._providers[provider]._value
+
+    def test_model_calls_hold_a_provider_slot(self):
+        free_during_calls = []
+
+        class SlotCheckingChatModel(FixedReplyChatModel):
+            def _generate(model, messages, stop=None, run_manager=None, **kwargs):
+                free_during_calls.append(self._free_slots(PROVIDER_OPENAI))
+                return super()._generate(messages, stop, run_manager, **kwargs)
+
+        self.patch_agent(InMemorySaver(), SlotCheckingChatModel)
+        agent = ConstructionAgent('', 'spreadsheet-id', {
+            "configurable": {"model": "gpt-4o", "system_instructions": "Test instructions"},
+            "callbacks": [ProviderSlotCallback(self.limiter, PROVIDER_OPENAI)],
+        })
+        for _ in range(2):
+            agent.process_message("How do the bids compare?", "conversation-1")
+
+        self.assertEqual(free_during_calls, [0, 0])
+        self.assertEqual(self._free_slots(PROVIDER_OPENAI), 1)
+
+    def test_google_calls_hold_a_google_slot(self):
+        free_during_calls = []
+
+        def drive(request):
+            free_during_calls.append(self._free_slots(PROVIDER_GOOGLE))
+            return httpx.Response(200, json={'files': []})
+
+        use_request_gate(lambda: self.limiter.provider(PROVIDER_GOOGLE))
+        with create_http_client(httpx.MockTransport(drive)) as client:
+            client.get('https://www.googleapis.com/drive/v3/files')
+            use_request_gate(None)
+            client.get('https://www.googleapis.com/drive/v3/files')
+
+        self.assertEqual(free_during_calls, [0, 1])
+        self.assertEqual(self._free_slots(PROVIDER_GOOGLE), 1)
+
+    def test_default_concurrency_scales_with_configurations(self):
+        limits = []
+
+        def pipeline(**kwargs):
+            limits.append(kwargs['limiter'].max_concurrency)
+
+        config_names = get_config_names()[:2]
+        with mock.patch('leveling.modules.evaluation.evaluation.run_evaluation_pipeline', pipeline):
+            run_evaluations(client=None, config_names=config_names, dataset_name='template-1', google_access_token=None)
+
+        self.assertEqual(limits, [DEFAULT_MAX_CONCURRENCY * len(config_names)] * len(config_names))
+
+
+class TemplateSheetPoolTests(SimpleTestCase):
+    """Provisioning uploads count against the Google cap; claims wait for them without holding a slot."""
+
+    def test_claims_are_served_from_provisioned_sheets(self):
+        limiter = ConcurrencyLimiter(provider_limits={PROVIDER_GOOGLE: 1})
+        uploads = []
+
+        def drive(request):
+            uploads.append((threading.current_thread().name, limiter._providers[PROVIDER_GOOGLE]._value))
+            return httpx.Response(200, json={'id': f'sheet-{len(uploads)}'})
+
+        client = create_http_client(httpx.MockTransport(drive))
+        self.addCleanup(client.close)
+        use_request_gate(lambda: limiter.provider(PROVIDER_GOOGLE))
+        self.addCleanup(use_request_gate, None)
+        template_path = os.path.join(settings.BASE_DIR, 'data', 'templates', 'template-1.xlsx')
+
+        with mock.patch.object(file_processing, 'get_http_client', lambda: client):
+            pool = TemplateSheetPool('token', 'run-folder', size=2)
+            pool.warm([template_path] * 4)
+            # Six concurrent runs of a template warmed for four: two create their sheet on demand
+            with ThreadPoolExecutor(max_workers=6) as executor:
+                sheet_ids = list(executor.map(lambda _: pool.claim(template_path), range(6)))
+            pool.close()
+
+        self.assertEqual(len(set(sheet_ids)), 6)
+        self.assertEqual((pool.hits, pool.misses), (4, 2))
+        # Every upload held the only Google slot, and provisioning ran on the pool's threads
+        self.assertEqual({free for _, free in uploads}, {0})
+        self.assertEqual(sum(name.startswith('sheet-pool') for name, _ in uploads), 4)
+
+
+def _paged(pages):
+    """Text and page offsets of a document made of the given pages."""
+    text, page_offsets = "", []
+    for page in pages:
+        page_offsets.append(len(text))
+        text += page + "\n"
+    return text, page_offsets
+
+
+class RepeatedLineTests(SimpleTestCase):
+    """Headers, footers and page numbers are kept once; bid figures are never removed."""
+
+    def test_repeated_headers_and_page_numbers_are_kept_once(self):
+        text, page_offsets = _paged([
+            "ACME Mechanical\nDuctwork\n- 1 -",
+            "ACME Mechanical\nPiping\n- 2 -",
+            "ACME Mechanical\nControls\n- 3 -",
+        ])
+        self.assertEqual(
+            strip_repeated_lines(text, page_offsets),
+            "ACME Mechanical\nDuctwork\n- 1 -\n\nPiping\n\nControls",
+        )
+
+    def test_page_of_footer_on_two_pages(self):
+        text, page_offsets = _paged(["Bid Form\nPlumbing\nPage 1 of 2", "Bid Form\nElectrical\nPage 2 of 2"])
+        self.assertEqual(strip_repeated_lines(text, page_offsets), "Bid Form\nPlumbing\nPage 1 of 2\n\nElectrical")
+
+    def test_amounts_are_never_removed(self):
+        text, page_offsets = _paged([
+            "Item A\n$500\nQty\n12",
+            "Item B\n$700\nQty\n15",
+            "Item C\n$900\nQty\n3",
+        ])
+        stripped = strip_repeated_lines(text, page_offsets)
+        for figure in ("$500", "$700", "$900", "12", "15", "3"):
+            self.assertIn(f"\n{figure}", stripped)
+
+    def test_identical_amounts_on_every_page_are_kept(self):
+        text, page_offsets = _paged(["Roofing\n1,250.00", "Siding\n1,250.00"])
+        self.assertEqual(strip_repeated_lines(text, page_offsets).count("1,250.00"), 2)
+        text, page_offsets = _paged(["Header\nUnit price\n$45.00\n10"] * 3)
+        stripped = strip_repeated_lines(text, page_offsets)
+        self.assertEqual(stripped.count("Header"), 1)
+        self.assertEqual(stripped.count("$45.00"), 3)
+        self.assertEqual(stripped.count("10"), 3)
+
+
+class A1RangeTests(SimpleTestCase):
+    """A1 notation parsing and overlap checks used to invalidate cached ranges."""
+
+    def test_parse_a1_range(self):
+        cases = {
+            'Sheet1!A1:D10': GridRange('sheet1', 1, 10, 1, 4),
+            "'Bid ''Tab'''!B2": GridRange("bid 'tab'", 2, 2, 2, 2),
+            'A:C': GridRange(None, None, None, 1, 3),
+            '2:5': GridRange(None, 2, 5, None, None),
+            'Sheet1!A2:C': GridRange('sheet1', 2, None, 1, 3),
+            'Bid Comparison': GridRange('bid comparison'),
+            'Sheet1': GridRange('sheet1'),
+            'AB12': GridRange(None, 12, 12, 28, 28),
+        }
+        for range_name, expected in cases.items():
+            with self.subTest(range_name=range_name):
+                self.assertEqual(parse_a1_range(range_name), expected)
+
+    def test_ranges_intersect(self):
+        def intersect(a, b):
+            return ranges_intersect(parse_a1_range(a), parse_a1_range(b))
+
+        self.assertTrue(intersect('Sheet1!A1:D10', 'Sheet1!D10:E12'))
+        self.assertFalse(intersect('Sheet1!A1:D10', 'Sheet1!E1:F10'))
+        self.assertFalse(intersect('Sheet1!A1:D10', 'Sheet2!A1:D10'))
+        self.assertTrue(intersect('Sheet1!A:A', 'Sheet1!A500'))
+        self.assertTrue(intersect('Sheet1', 'Sheet1!Z99'))
+        # Without a sheet name a range may be on any sheet
+        self.assertTrue(intersect('A1:B2', 'Sheet2!B2'))
+
+
+class SheetValuesCacheTests(SimpleTestCase):
+    """Writes drop computed values, fence in-flight reads, and unreadable Drive versions are not rechecked."""
+
+    key = ('spreadsheet-id', 'token')
+
+    def setUp(self):
+        self.cache = SpreadsheetValuesCache()
+        self.cache.set_version(self.key, 'v1')
+
+    def _put(self, range_name, render_option, values=(('1',),)):
+        self.cache.put(self.key, range_name, render_option, [list(row) for row in values], self.cache.generation())
+
+    def test_write_drops_computed_values_and_intersecting_formulas(self):
+        self._put('Summary!B20', 'FORMATTED_VALUE')
+        self._put('Summary!B20', 'UNFORMATTED_VALUE')
+        self._put('Summary!B20', 'FORMULA')
+        self._put('Bids!A1:C10', 'FORMULA')
+
+        self.cache.invalidate(self.key, 'Bids!B2:C3')
+
+        # The total on another sheet is computed from the written cells
+        self.assertIsNone(self.cache.get(self.key, 'Summary!B20', 'FORMATTED_VALUE'))
+        self.assertIsNone(self.cache.get(self.key, 'Summary!B20', 'UNFORMATTED_VALUE'))
+        self.assertIsNotNone(self.cache.get(self.key, 'Summary!B20', 'FORMULA'))
+        self.assertIsNone(self.cache.get(self.key, 'Bids!A1:C10', 'FORMULA'))
+
+    def test_read_started_before_a_write_is_not_cached(self):
+        generation = self.cache.generation()
+        self.cache.invalidate(self.key, 'Bids!A1')
+        self.cache.put(self.key, 'Summary!B20', 'FORMATTED_VALUE', [['100']], generation)
+        self.assertIsNone(self.cache.get(self.key, 'Summary!B20', 'FORMATTED_VALUE'))
+
+        self._put('Summary!B20', 'FORMATTED_VALUE', [['150']])
+        self.assertEqual(self.cache.get(self.key, 'Summary!B20', 'FORMATTED_VALUE'), [['150']])
+
+    def test_unreadable_drive_version_is_checked_once(self):
+        calls = []
+
+        def handler(request):
+            calls.append(request.url.host)
+            if request.url.host == 'www.googleapis.com':
+                return httpx.Response(404, json={'error': {'message': 'File not found'}})
+            return httpx.Response(200, json={'values': [['1']]})
+
+        with mock.patch.object(google_sheets_service, '_values_cache', SpreadsheetValuesCache()):
+            service = GoogleSheetsService('token', client=httpx.Client(transport=httpx.MockTransport(handler)))
+            for range_name in ('Bids!A1', 'Bids!A2', 'Bids!A1'):
+                self.assertEqual(service.read_sheet_data('spreadsheet-id', range_name), [['1']])
+
+        self.assertEqual(calls.count('www.googleapis.com'), 1)
+        self.assertEqual(calls.count('sheets.googleapis.com'), 3)
+
+
+class ChunkCoalescingTests(SimpleTestCase):
+    """Text held for coalescing goes out when its window expires, even if the agent pauses."""
+
+    def test_pending_text_is_flushed_while_the_producer_stalls(self):
+        resumed = threading.Event()
+
+        def chunks():
+            yield {'type': 'message', 'delta': 'Hel'}
+            yield {'type': 'message', 'delta': 'lo'}
+            # The model pauses until the text above has reached the client
+            if not resumed.wait(timeout=5):
+                raise AssertionError('pending text was held while the producer stalled')
+            yield {'type': 'message', 'delta': '!'}
+
+        stream = coalesce_chunks(chunks(), ChunkCoalescer(window_seconds=0.01, max_bytes=1024))
+
+        self.assertEqual(next(stream), {'type': 'message', 'delta': 'Hello'})
+        resumed.set()
+        self.assertEqual(list(stream), [{'type': 'message', 'delta': '!'}])
+
+
+class HttpCassetteTests(SimpleTestCase):
+    """Google API calls recorded in one run are answered from the cassette in the next."""
+
+    def setUp(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir, ignore_errors=True)
+        self.cassette_path = os.path.join(temp_dir, 'google.jsonl')
+        self.network_calls = []
+        self.folders = {}
+        patcher = mock.patch.dict(file_processing._folder_ids, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _drive(self, request):
+        self.network_calls.append((request.method, request.url.path))
+        if request.method == 'GET':
+            query = request.url.params['q']
+            return httpx.Response(200, json={'files': [
+                {'id': folder_id} for name, folder_id in self.folders.items() if f"name='{name}'" in query
+            ]})
+        folder_id = f'folder-{len(self.network_calls)}'
+        self.folders[json.loads(request.content)['name']] = folder_id
+        return httpx.Response(200, json={'id': folder_id})
+
+    def _client(self, mode):
+        network = httpx.MockTransport(self._drive) if mode == MODE_RECORD else None
+        return httpx.Client(transport=CassetteTransport(self.cassette_path, mode, transport=network))
+
+    def _create_run_folder(self, client, run_id):
+        with mock.patch.object(file_processing, 'get_http_client', lambda: client):
+            return file_processing.create_run_folder('token', run_id)
+
+    def test_run_folder_replays_with_the_recorded_run_id(self):
+        with self._client(MODE_RECORD) as client:
+            recorded = self._create_run_folder(client, 'run_fixed_default')
+        self.assertEqual(len(self.network_calls), 4)
+        with open(self.cassette_path, encoding='utf-8') as f:
+            cassette = f.read()
+        # One header line, then one line per call, without credentials
+        self.assertEqual(len(cassette.splitlines()), 1 + 4)
+        self.assertNotIn('token', cassette)
+
+        file_processing._folder_ids.clear()
+        with self._client(MODE_REPLAY) as client:
+            self.assertEqual(self._create_run_folder(client, 'run_fixed_default'), recorded)
+            file_processing._folder_ids.clear()
+            # Another run ID searches for another folder, which was never recorded
+            with self.assertRaises(CassetteMissError):
+                self._create_run_folder(client, 'run_other')
+        self.assertEqual(len(self.network_calls), 4)
+
+    def test_recording_appends_to_an_existing_cassette(self):
+        with self._client(MODE_RECORD) as client:
+            self._create_run_folder(client, 'run_first')
+        with self._client(MODE_RECORD) as client:
+            file_processing._folder_ids.clear()
+            self._create_run_folder(client, 'run_second')
+        # A run interrupted mid-write leaves a partial last line, which replay skips
+        with open(self.cassette_path, 'a', encoding='utf-8') as f:
+            f.write('{"request": {"meth')
+
+        file_processing._folder_ids.clear()
+        with self._client(MODE_REPLAY) as client:
+            self.assertIsNotNone(self._create_run_folder(client, 'run_first'))
+            self.assertIsNotNone(self._create_run_folder(client, 'run_second'))
+
+
+class LlmReplayTests(AgentPatchMixin, SimpleTestCase):
+    """Model responses recorded in one run are streamed back in the next, without the provider."""
+
+    def setUp(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir, ignore_errors=True)
+        self.cassette_path = os.path.join(temp_dir, 'llm.jsonl')
+        self.patch_agent(InMemorySaver())
+
+    def _run(self, cassette, conversation_id, turns):
+        with mock.patch.object(construction_agent, 'get_llm_cassette', lambda: cassette):
+            agent = ConstructionAgent('', 'spreadsheet-id', {
+                "configurable": {"model": "gpt-4o", "system_instructions": "Test instructions"}
+            })
+            return [
+                "".join(chunk["delta"] for chunk in agent.process_message_stream("How do the bids compare?", conversation_id))
+                for _ in range(turns)
+            ]
+
+    def _turn(self, cassette, spreadsheet_id, conversation_id):
+        with mock.patch.object(construction_agent, 'get_llm_cassette', lambda: cassette):
+            agent = ConstructionAgent('', spreadsheet_id, {
+                "configurable": {"model": "gpt-4o", "system_instructions": "Test instructions"}
+            })
+            # Like the evaluation's input message, the first message names the run's own sheet
+            message = f"Use spreadsheet with ID {spreadsheet_id} for this task. How do the bids compare?"
+            return "".join(chunk["delta"] for chunk in agent.process_message_stream(message, conversation_id))
+
+    def test_repetitions_replay_their_own_trajectories(self):
+        MODEL_CALLS.clear()
+        recording = LlmCassette(self.cassette_path, MODE_RECORD)
+        # Two repetitions of the same input, interleaved as concurrent runs would be
+        with mock.patch.object(construction_agent, 'ChatOpenAI', lambda model: NumberedReplyChatModel()):
+            for spreadsheet_id in ("sheet-a", "sheet-b", "sheet-a", "sheet-b"):
+                self._turn(recording, spreadsheet_id, f"recorded-{spreadsheet_id}")
+        recording.close()
+        trajectories = {"sheet-a": ["reply 1", "reply 3"], "sheet-b": ["reply 2", "reply 4"]}
+
+        with mock.patch.object(construction_agent, 'ChatOpenAI', side_effect=AssertionError("provider called")):
+            # Replayed sheets (as the HTTP cassette hands them out) follow the trajectory recorded on them
+            replay = LlmCassette(self.cassette_path, MODE_REPLAY)
+            replies = {"sheet-a": [], "sheet-b": []}
+            for spreadsheet_id in ("sheet-b", "sheet-a", "sheet-a", "sheet-b"):
+                replies[spreadsheet_id].append(self._turn(replay, spreadsheet_id, f"replayed-{spreadsheet_id}"))
+            self.assertEqual(replies, trajectories)
+
+            # New sheets each follow one whole recorded trajectory, and only one run can take each
+            construction_agent._model_cache.clear()
+            construction_agent._graph_cache.clear()
+            replay = LlmCassette(self.cassette_path, MODE_REPLAY)
+            replies = {"sheet-c": [], "sheet-d": []}
+            for spreadsheet_id in ("sheet-d", "sheet-c", "sheet-c", "sheet-d"):
+                replies[spreadsheet_id].append(self._turn(replay, spreadsheet_id, f"live-{spreadsheet_id}"))
+            self.assertCountEqual(replies.values(), trajectories.values())
+            with self.assertRaises(LlmCassetteMissError):
+                self._turn(replay, "sheet-e", "live-sheet-e")
+
+    def test_replay_serves_recorded_turns(self):
+        with mock.patch.object(construction_agent, 'ChatOpenAI', lambda model: FixedReplyChatModel()):
+            recorded = self._run(LlmCassette(self.cassette_path, MODE_RECORD), "recorded", 2)
+        self.assertEqual(recorded, ["ok", "ok"])
+
+        replay = LlmCassette(self.cassette_path, MODE_REPLAY)
+        with mock.patch.object(construction_agent, 'ChatOpenAI', side_effect=AssertionError("provider called")):
+            self.assertEqual(self._run(replay, "replayed", 2), recorded)
+            # A third turn was never recorded
+            with self.assertRaises(LlmCassetteMissError):
+                self._run(replay, "replayed", 1)
+
+
+class PdfPoolTests(SimpleTestCase):
+    """In-memory uploads are extracted on the pool without being written to disk."""
+
+    def setUp(self):
+        for patcher in (
+            mock.patch.object(pdf_processor, 'PDF_POOL_WORKERS', 1),
+            mock.patch.object(pdf_processor, 'get_pdf_text_cache', lambda: None),
+            mock.patch.object(pdf_processor, '_pool', None),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(lambda: pdf_processor._pool and pdf_processor._pool.shutdown())
+
+    def test_in_memory_upload_is_not_written_to_a_temporary_file(self):
+        path = os.path.join(settings.BASE_DIR, 'data', 'pdfs', 'electrical_bid_3.pdf')
+        with open(path, 'rb') as f:
+            upload = SimpleUploadedFile('electrical_bid_3.pdf', f.read(), content_type='application/pdf')
+
+        no_disk = AssertionError('in-memory upload written to disk')
+        with mock.patch('tempfile.mkstemp', side_effect=no_disk), \
+                mock.patch('tempfile.NamedTemporaryFile', side_effect=no_disk):
+            [extracted] = pdf_processor.extract_pdfs([upload])
+
+        self.assertIsNotNone(pdf_processor._pool)
+        self.assertIsNone(extracted.error)
+        self.assertEqual(extracted.text, pdf_processor.extract_pdfs([path])[0].text)
+        self.assertIn('Base Bid: $90,000', extracted.text)
+
+
+@skipUnless(os.getenv('DATABASE_URL'), 'needs a database (set DATABASE_URL)')
+class DocumentIngestionTests(TestCase):
+    """Documents are uploaded once, then referenced from chat requests by ID."""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        overridden = override_settings(MEDIA_ROOT=media_root, DOCUMENT_INGEST_WORKERS=0)
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+        for patcher in (
+            mock.patch.object(pdf_processor, 'PDF_POOL_WORKERS', 0),
+            mock.patch.object(pdf_processor, 'get_pdf_text_cache', lambda: None),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _upload(self, name):
+        with open(os.path.join(settings.BASE_DIR, 'data', 'pdfs', name), 'rb') as f:
+            upload = SimpleUploadedFile(name, f.read(), content_type='application/pdf')
+        return self.client.post('/api/documents/', {'pdf_files': [upload]})
+
+    def test_upload_extracts_text(self):
+        response = self._upload('electrical_bid_3.pdf')
+
+        self.assertEqual(response.status_code, 202)
+        document_id = response.json()['documents'][0]['id']
+        status = self.client.get(f'/api/documents/{document_id}/').json()
+        self.assertEqual(status['status'], Document.STATUS_READY)
+        self.assertEqual(status['page_count'], 1)
+        self.assertIn('Base Bid: $90,000', Document.objects.get(id=document_id).extracted_text)
+
+    def _stored_document(self, name, **fields):
+        with open(os.path.join(settings.BASE_DIR, 'data', 'pdfs', name), 'rb') as f:
+            return Document.objects.create(name=name, file=SimpleUploadedFile(name, f.read()), **fields)
+
+    def test_lost_extractions_are_requeued(self):
+        # A task lost before it started, one whose worker died an hour ago, and one still running
+        lost_in_queue = self._stored_document('electrical_bid_3.pdf')
+        crashed = self._stored_document(
+            'electrical_bid_4.pdf', status=Document.STATUS_PROCESSING, processing_started_at=timezone.now() - timedelta(hours=1)
+        )
+        running = self._stored_document(
+            'electrical_bid_4.pdf', status=Document.STATUS_PROCESSING, processing_started_at=timezone.now()
+        )
+
+        for document in (lost_in_queue, crashed):
+            self.assertEqual(self.client.get(f'/api/documents/{document.id}/').json()['status'], Document.STATUS_READY)
+        self.assertEqual(self.client.get(f'/api/documents/{running.id}/').json()['status'], Document.STATUS_PROCESSING)
+        with self.assertRaises(DocumentNotReadyError):
+            load_documents([lost_in_queue.id, running.id])
+
+    def test_upload_with_unknown_project_is_rejected(self):
+        for project_id in ('12345', 'not-a-project'):
+            with open(os.path.join(settings.BASE_DIR, 'data', 'pdfs', 'electrical_bid_3.pdf'), 'rb') as f:
+                upload = SimpleUploadedFile('electrical_bid_3.pdf', f.read(), content_type='application/pdf')
+            response = self.client.post('/api/documents/', {'pdf_files': [upload], 'project_id': project_id})
+
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(Document.objects.exists())
+
+    def test_chat_with_pending_document_is_rejected(self):
+        document = Document.objects.create(
+            name='pending.pdf', file='documents/pending.pdf', status=Document.STATUS_PROCESSING, processing_started_at=timezone.now()
+        )
+
+        response = self.client.post(
+            '/api/chat/stream/', {'message': 'Level the bids', 'document_ids': [document.id]}, content_type='application/json'
+        )
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['documents'][0]['status'], Document.STATUS_PROCESSING)
+
+
+@skipUnless(os.getenv('DATABASE_URL'), 'needs a database (set DATABASE_URL)')
+class DatabaseCheckpointSaverTests(AgentPatchMixin, TransactionTestCase):
+    """Conversations are stored as per-version channel blobs, and only recent checkpoints are kept."""
+
+    turns = 12
+
+    def setUp(self):
+        # LangGraph saves checkpoints from its own threads, so they go through the saver's thread
+        self.saver = DatabaseCheckpointSaver(history=3, prune_every=2, db_threads=1)
+        self.addCleanup(self.saver._executor.shutdown)
+        self.patch_agent(self.saver, FixedReplyChatModel)
+        self.agent = ConstructionAgent('', 'spreadsheet-id', {
+            "configurable": {"model": "gpt-4o", "system_instructions": "Test instructions"}
+        })
+
+    def _converse(self, conversation_id, turns):
+        for _ in range(turns):
+            self.agent.process_message("How do the bids compare?", conversation_id)
+        return self.agent.graph.get_state({"configurable": {"thread_id": conversation_id}}).values["messages"]
+
+    def test_conversation_survives_pruning(self):
+        messages = self._converse("conversation-1", self.turns)
+
+        self.assertEqual(len(messages), 2 * self.turns)
+        # Old checkpoints are pruned, and their message blobs with them
+        checkpoints = AgentCheckpoint.objects.filter(thread_id="conversation-1")
+        self.assertLessEqual(checkpoints.count(), 3 + 2)
+        self.assertLessEqual(AgentCheckpointBlob.objects.filter(thread_id="conversation-1", channel="messages").count(), 3 + 2)
+        # Checkpoint rows hold channel versions, not the conversation
+        for row in checkpoints:
+            self.assertNotIn(b"How do the bids compare?", bytes(row.checkpoint))
+
+    def test_queries_do_not_grow_with_checkpoints(self):
+        self._converse("conversation-2", 2)
+        inline = DatabaseCheckpointSaver(history=0, db_threads=0)
+        config = {"configurable": {"thread_id": "conversation-2"}}
+
+        # Checkpoints, then their writes and blobs: one query each
+        with self.assertNumQueries(3):
+            listed = list(inline.list(config))
+        self.assertGreater(len(listed), 1)
+        with self.assertNumQueries(3):
+            latest = inline.get_tuple(config)
+        self.assertEqual(latest.checkpoint["channel_values"]["messages"], listed[0].checkpoint["channel_values"]["messages"])
+        self.assertEqual(len(latest.checkpoint["channel_values"]["messages"]), 4)
+
+    def test_delete_thread_removes_blobs(self):
+        self._converse("conversation-3", 1)
+
+        self.saver.delete_thread("conversation-3")
+
+        self.assertFalse(AgentCheckpoint.objects.filter(thread_id="conversation-3").exists())
+        self.assertFalse(AgentCheckpointBlob.objects.filter(thread_id="conversation-3").exists())
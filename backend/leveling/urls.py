@@ -4,4 +4,7 @@ from . import views
 urlpatterns = [
     path('', views.hello_world, name='hello_world'),
     path('chat/stream/', views.chat_stream, name='chat_stream'),
+    path('chat/stream/async/', views.chat_stream_async, name='chat_stream_async'),
+    path('documents/', views.upload_documents, name='upload_documents'),
+    path('documents/<int:document_id>/', views.document_detail, name='document_detail'),
 ] 
\ No newline at end of file
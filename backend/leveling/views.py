@@ -6,19 +6,31 @@ from rest_framework import status
 import json
 import os
 import time
+import queue
 import tempfile
+import threading
+import asyncio
 from django.http import StreamingHttpResponse, JsonResponse, HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from asgiref.sync import sync_to_async
 import logging
 import traceback
-from typing import Tuple, Optional, Dict, Any, IO, List
+from typing import Tuple, Optional, Dict, Any, IO, List, AsyncIterator, Callable, Iterator
 
 from leveling.modules.kiyo_agents.construction_agent import ConstructionAgent
-from leveling.modules.kiyo_agents.pdf_processor import process_pdf_upload
+from leveling.modules.kiyo_agents.llm_cassette import llm_replay_active
+from leveling.modules.kiyo_agents.pdf_processor import PdfProgress, extract_pdfs
+from leveling.modules.kiyo_agents.message_builder import AGENT_PDF_FORMAT, build_agent_input_message
+from leveling.modules.config.model_configs import DEFAULT_CONFIG
+from leveling.documents import DocumentNotReadyError, document_status, ingest_uploads, load_documents, parse_document_ids, requeue_stale_documents
+from leveling.models import Document, Project
+from leveling.streaming import PDF_PROGRESS_EVENT, ChunkCoalescer, acoalesce_chunks, coalesce_chunks, create_sse_encoder, parse_stream_protocol, sse_event
 
 logger = logging.getLogger(__name__)
 
-def _parse_request_data(request) -> Tuple[Optional[str], Optional[str], Optional[str], str, List[IO]]:
-    """Parses request data from JSON or FormData."""
+def _parse_request_data(request) -> Tuple[Optional[str], Optional[str], Optional[str], str, List[IO], List[int], int]:
+    """Parses request data from JSON or FormData, including IDs of previously uploaded documents."""
     message = None
     google_access_token = None
     spreadsheet_id = None
@@ -32,83 +44,219 @@ def _parse_request_data(request) -> Tuple[Optional[str], Optional[str], Optional
         google_access_token = data.get('google_access_token')
         spreadsheet_id = data.get('spreadsheet_id')
         conversation_id = data.get('conversation_id', conversation_id)
+        stream_protocol = data.get('stream_protocol')
         pdf_files = request.FILES.getlist('pdf_files')
+        document_ids = data.get('document_ids')
     elif request.content_type.startswith('multipart/form-data'):
         logger.info("Processing FormData request")
         message = request.POST.get('message')
         google_access_token = request.POST.get('google_access_token')
         spreadsheet_id = request.POST.get('spreadsheet_id')
         conversation_id = request.POST.get('conversation_id', conversation_id)
+        stream_protocol = request.POST.get('stream_protocol')
         pdf_files = request.FILES.getlist('pdf_files')
+        document_ids = ','.join(request.POST.getlist('document_ids'))
     else:
         logger.error(f"Unsupported content type: {request.content_type}")
         raise ValueError('Unsupported content type')
 
-    return message, google_access_token, spreadsheet_id, conversation_id, pdf_files
+    return message, google_access_token, spreadsheet_id, conversation_id, pdf_files, parse_document_ids(document_ids), parse_stream_protocol(stream_protocol)
 
 
-def _build_agent_input_message(message: Optional[str], processed_pdfs: List[Dict[str, str]], spreadsheet_id: Optional[str]) -> str:
-    """Builds the final input message for the agent, combining text from multiple PDFs."""
-    final_input_message = ""
-    pdf_combined_content = ""
+def _process_pdf_files(pdf_files: List[IO], on_progress: Optional[Callable[[PdfProgress], None]] = None) -> List[Dict[str, Any]]:
+    """Extracts text from the uploaded PDFs in parallel, skipping duplicates and files that come back empty."""
+    processed_pdfs = []
+    if not pdf_files:
+        return processed_pdfs
+    try:
+        extracted_pdfs = extract_pdfs(pdf_files, on_progress=on_progress)
+    except Exception as pdf_exc:
+        logger.error(f"Error processing PDF files: {pdf_exc}", exc_info=True)
+        return processed_pdfs
+    seen_digests = set()
+    for pdf_file, extracted in zip(pdf_files, extracted_pdfs):
+        pdf_text_content = extracted.text
+        if extracted.sha256 and extracted.sha256 in seen_digests:
+             logger.info(f"Skipping '{pdf_file.name}': the same file is already attached to this message.")
+             continue
+        seen_digests.add(extracted.sha256)
+        if pdf_text_content:
+             processed_pdfs.append({'filename': pdf_file.name, 'content': pdf_text_content, 'page_offsets': extracted.page_offsets})
+             logger.info(f"Successfully processed: {pdf_file.name}")
+        else:
+             logger.warning(f"Processing PDF '{pdf_file.name}' resulted in empty content.")
+    return processed_pdfs
 
-    if processed_pdfs:
-        for pdf_data in processed_pdfs:
-            pdf_combined_content += f"--- PDF Content Start: {pdf_data['filename']} ---\n{pdf_data['content']}\n--- PDF Content End: {pdf_data['filename']} ---\n\n"
-        
-        final_input_message += pdf_combined_content
 
-    if message:
-         final_input_message += f"User Message: {message}"
-    elif not pdf_combined_content:
+def _build_agent_input_message(message: Optional[str], processed_pdfs: List[Dict[str, Any]], spreadsheet_id: Optional[str], pdf_format: str = AGENT_PDF_FORMAT) -> str:
+    """Builds the final input message for the agent, combining the cleaned text of multiple PDFs within the token budget."""
+    if not message and not processed_pdfs:
          logger.warning("Received request with no text message and no valid/processed PDF attachments.")
-         raise ValueError('Message or PDF attachment is required')
-
-    if spreadsheet_id:
-        if message and not message.lower().startswith("use spreadsheet"): 
-            enhanced_message = f"Use spreadsheet with ID {spreadsheet_id} for this task. {final_input_message}"
-            logger.info(f"Enhanced message with spreadsheet ID: {spreadsheet_id}")
-        else:
-            enhanced_message = final_input_message
-    else:
-        enhanced_message = final_input_message
-    
+    enhanced_message = build_agent_input_message(
+        message,
+        processed_pdfs,
+        spreadsheet_id,
+        pdf_format=pdf_format,
+        model_name=DEFAULT_CONFIG["configurable"]["model"],
+    )
     logger.info(f"Final combined message for agent (start): {enhanced_message[:100]}...")
     return enhanced_message
 
 
-def _generate_sse_stream(agent_input: str, conv_id: str, g_token: Optional[str], ss_id: Optional[str]):
-    """Generator function for Server-Sent Events stream."""
+def _pdf_progress_chunk(pdf_files: List[IO], progress: PdfProgress) -> Dict[str, Any]:
+    """Stream chunk reporting the extraction progress of one attached PDF."""
+    if progress.error:
+        status = 'failed'
+    elif progress.done:
+        status = 'cached' if progress.cached else 'done'
+    else:
+        status = 'extracting'
+    return {
+        'type': PDF_PROGRESS_EVENT,
+        'filename': pdf_files[progress.index].name,
+        'pages_done': progress.pages_done,
+        'page_count': progress.page_count,
+        'chars': progress.chars,
+        'elapsed_ms': progress.elapsed_ms,
+        'status': status,
+    }
+
+
+def _queued_pdf_chunks(pdf_files: List[IO]) -> List[Dict[str, Any]]:
+    """First events of a stream: every attached PDF, before its extraction starts."""
+    return [_pdf_progress_chunk(pdf_files, PdfProgress(index, 0, None, 0, 0)) | {'status': 'queued'} for index in range(len(pdf_files))]
+
+
+def _create_agent(g_token: Optional[str], ss_id: Optional[str]) -> ConstructionAgent:
+    """Creates the agent for a stream, failing early if the LLM key is missing (unless responses are replayed)."""
+    api_key = os.environ.get('OPENAI_API_KEY')
+    if not api_key and not llm_replay_active():
+        logger.error("OPENAI_API_KEY environment variable not set.")
+        raise ValueError("API key not configured.")
+
+    return ConstructionAgent(
+        google_access_token=g_token,
+        spreadsheet_id=ss_id
+    )
+
+
+def _generate_sse_stream(message: Optional[str], documents: List[Dict[str, Any]], pdf_files: List[IO], conv_id: str, g_token: Optional[str], ss_id: Optional[str], protocol: int) -> Iterator[str]:
+    """
+    Generator function for Server-Sent Events stream.
+    Attached PDFs are extracted inside the stream, reported with pdf_progress
+    events, so the response starts before parsing does.
+    """
     try:
         logger.info(f"Creating agent instance for stream {conv_id}")
-        api_key = os.environ.get('OPENAI_API_KEY')
-        if not api_key:
-            logger.error("OPENAI_API_KEY environment variable not set.")
-            raise ValueError("API key not configured.")
-            
-        agent = ConstructionAgent(
-            google_access_token=g_token,
-            spreadsheet_id=ss_id
-        )
-        
-        #logger.info(f"Starting message processing stream for {conv_id}")
-        
-        for chunk in agent.process_message_stream(
+        agent = _create_agent(g_token, ss_id)
+        encoder = create_sse_encoder(protocol)
+
+        for chunk in _queued_pdf_chunks(pdf_files):
+            yield encoder.encode(chunk)
+
+        # Extraction runs in a worker thread; its progress comes back through a queue
+        progress_events: queue.Queue = queue.Queue()
+        extraction = {}
+
+        def extract():
+            try:
+                extraction['pdfs'] = _process_pdf_files(pdf_files, lambda progress: progress_events.put(_pdf_progress_chunk(pdf_files, progress)))
+            finally:
+                progress_events.put(None)
+
+        if pdf_files:
+            threading.Thread(target=extract, name=f"pdf-extract-{conv_id}", daemon=True).start()
+            while (chunk := progress_events.get()) is not None:
+                yield encoder.encode(chunk)
+
+        try:
+            agent_input = _build_agent_input_message(message, documents + extraction.get('pdfs', []), ss_id)
+        except ValueError as e:
+            yield sse_event("error", {'error': str(e)})
+            return
+
+        chunks = agent.process_message_stream(
             agent_input, 
             conversation_id=conv_id,
             spreadsheet_id=ss_id
-        ):
-            if chunk["type"] == "message":
-                yield f"event: chunk\ndata: {json.dumps({'text': chunk['text'], 'finished': False})}\n\n"
-            elif chunk["type"] == "tool_call":
-                yield f"event: tool_call\ndata: {json.dumps(chunk['tool_calls'])}\n\n"
-        
-        yield f"event: done\ndata: {json.dumps({'finished': True})}\n\n"
+        )
+        for chunk in coalesce_chunks(chunks, ChunkCoalescer()):
+            frame = encoder.encode(chunk)
+            if frame:
+                yield frame
+        yield encoder.close()
             
     except Exception as e:
         logger.error(f"Error in stream generation for {conv_id}: {str(e)}", exc_info=True)
-        error_payload = json.dumps({'error': 'An error occurred during processing.'})
-        yield f"event: error\ndata: {error_payload}\n\n"
+        yield sse_event("error", {'error': 'An error occurred during processing.'})
+
+
+async def _agenerate_sse_stream(message: Optional[str], documents: List[Dict[str, Any]], pdf_files: List[IO], conv_id: str, g_token: Optional[str], ss_id: Optional[str], protocol: int) -> AsyncIterator[str]:
+    """Async generator for the Server-Sent Events stream, driven by the agent's astream."""
+    try:
+        logger.info(f"Creating agent instance for async stream {conv_id}")
+        agent = _create_agent(g_token, ss_id)
+        encoder = create_sse_encoder(protocol)
+
+        for chunk in _queued_pdf_chunks(pdf_files):
+            yield encoder.encode(chunk)
+
+        processed_pdfs = []
+        if pdf_files:
+            loop = asyncio.get_running_loop()
+            progress_events: asyncio.Queue = asyncio.Queue()
+
+            async def extract():
+                try:
+                    return await sync_to_async(_process_pdf_files, thread_sensitive=False)(
+                        pdf_files, lambda progress: loop.call_soon_threadsafe(progress_events.put_nowait, _pdf_progress_chunk(pdf_files, progress))
+                    )
+                finally:
+                    # Queued after every progress event the worker thread scheduled
+                    loop.call_soon(progress_events.put_nowait, None)
+
+            extraction = asyncio.ensure_future(extract())
+            while (chunk := await progress_events.get()) is not None:
+                yield encoder.encode(chunk)
+            processed_pdfs = await extraction
+
+        try:
+            agent_input = _build_agent_input_message(message, documents + processed_pdfs, ss_id)
+        except ValueError as e:
+            yield sse_event("error", {'error': str(e)})
+            return
+
+        chunks = agent.aprocess_message_stream(
+            agent_input,
+            conversation_id=conv_id,
+            spreadsheet_id=ss_id
+        )
+        async for chunk in acoalesce_chunks(chunks, ChunkCoalescer()):
+            frame = encoder.encode(chunk)
+            if frame:
+                yield frame
+
+        yield encoder.close()
+
+    except Exception as e:
+        logger.error(f"Error in async stream generation for {conv_id}: {str(e)}", exc_info=True)
+        yield sse_event("error", {'error': 'An error occurred during processing.'})
+
+
+def _documents_not_ready_response(error: DocumentNotReadyError) -> JsonResponse:
+    """409 listing the referenced documents that are still being processed, so the client can retry."""
+    return JsonResponse({
+        'error': 'Some documents are still being processed.',
+        'documents': [document_status(document) for document in error.documents],
+    }, status=409)
+
+
+def _sse_response(stream) -> StreamingHttpResponse:
+    """Wraps a (sync or async) SSE generator in a non-buffered streaming response."""
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 
 # API Views
@@ -134,43 +282,102 @@ def chat_stream(request):
     try:
         # 1. Parse Request Data (receives pdf_files list)
         try:
-            message, google_access_token, spreadsheet_id, conversation_id, pdf_files = _parse_request_data(request)
+            message, google_access_token, spreadsheet_id, conversation_id, pdf_files, document_ids, stream_protocol = _parse_request_data(request)
         except ValueError as e:
             return JsonResponse({'error': str(e)}, status=415 if 'content type' in str(e) else 400)
 
-        logger.info(f"Processing chat stream request for conversation {conversation_id}. Message: {message[:50] if message else 'N/A'}. Files received: {len(pdf_files)}")
+        logger.info(f"Processing chat stream request for conversation {conversation_id}. Message: {message[:50] if message else 'N/A'}. Files received: {len(pdf_files)}. Documents: {document_ids}")
 
-        # 2. Process potentially multiple PDFs
-        processed_pdfs = []
-        if pdf_files:
-            #logger.info(f"Processing {len(pdf_files)} uploaded PDF file(s)...")
-            for pdf_file in pdf_files:
-                try:
-                    pdf_text_content = process_pdf_upload(pdf_file)
-                    if pdf_text_content:
-                         processed_pdfs.append({'filename': pdf_file.name, 'content': pdf_text_content})
-                         logger.info(f"Successfully processed: {pdf_file.name}")
-                    else:
-                         logger.warning(f"Processing PDF '{pdf_file.name}' resulted in empty content.")
-                except Exception as pdf_exc:
-                     logger.error(f"Error processing PDF file '{pdf_file.name}': {pdf_exc}", exc_info=True)
-
-        # 3. Build Agent Input Message using processed PDF data
+        # 2. Load previously uploaded documents, then process potentially multiple attached PDFs
         try:
-            agent_input_message = _build_agent_input_message(message, processed_pdfs, spreadsheet_id)
+            documents = load_documents(document_ids)
+        except DocumentNotReadyError as e:
+            return _documents_not_ready_response(e)
         except ValueError as e:
-             return JsonResponse({'error': str(e)}, status=400)
+            return JsonResponse({'error': str(e)}, status=400)
+        if not message and not pdf_files and not documents:
+             logger.warning("Received request with no text message and no PDF attachments.")
+             return JsonResponse({'error': 'Message or PDF attachment is required'}, status=400)
 
-        # 4. Generate and Return SSE Stream
-        #logger.info("Creating SSE response")
-        response = StreamingHttpResponse(
-            _generate_sse_stream(agent_input_message, conversation_id, google_access_token, spreadsheet_id),
-            content_type='text/event-stream'
+        # 3. Generate and Return SSE Stream; attached PDFs are extracted and the
+        # agent input is built inside it, so the response starts right away
+        return _sse_response(
+            _generate_sse_stream(message, documents, pdf_files, conversation_id, google_access_token, spreadsheet_id, stream_protocol)
         )
-        response['Cache-Control'] = 'no-cache'
-        response['X-Accel-Buffering'] = 'no'
-        return response
         
     except Exception as e:
         logger.error(f"Fatal error in chat_stream: {str(e)}", exc_info=True)
         return JsonResponse({'error': 'An internal server error occurred.'}, status=500)
+
+
+@csrf_exempt
+@require_POST
+async def chat_stream_async(request):
+    """
+    Async variant of chat_stream, meant to be served through the ASGI application.
+    Request parsing and PDF extraction run in worker threads; the agent itself is
+    driven through LangGraph's astream so an open stream does not pin a thread.
+    """
+    try:
+        try:
+            message, google_access_token, spreadsheet_id, conversation_id, pdf_files, document_ids, stream_protocol = await sync_to_async(_parse_request_data)(request)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=415 if 'content type' in str(e) else 400)
+
+        logger.info(f"Processing async chat stream request for conversation {conversation_id}. Message: {message[:50] if message else 'N/A'}. Files received: {len(pdf_files)}. Documents: {document_ids}")
+
+        try:
+            documents = await sync_to_async(load_documents)(document_ids)
+        except DocumentNotReadyError as e:
+            return _documents_not_ready_response(e)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        if not message and not pdf_files and not documents:
+             logger.warning("Received request with no text message and no PDF attachments.")
+             return JsonResponse({'error': 'Message or PDF attachment is required'}, status=400)
+
+        return _sse_response(
+            _agenerate_sse_stream(message, documents, pdf_files, conversation_id, google_access_token, spreadsheet_id, stream_protocol)
+        )
+
+    except Exception as e:
+        logger.error(f"Fatal error in chat_stream_async: {str(e)}", exc_info=True)
+        return JsonResponse({'error': 'An internal server error occurred.'}, status=500)
+
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def upload_documents(request):
+    """
+    Upload PDFs once and reference them from chat requests by ID.
+    Responds right away with the new document IDs; text extraction runs in the background.
+    """
+    pdf_files = request.FILES.getlist('pdf_files')
+    if not pdf_files:
+        return JsonResponse({'error': 'At least one file is required in pdf_files'}, status=400)
+    project_id = request.POST.get('project_id') or None
+    if project_id is not None:
+        if not project_id.isdigit() or not Project.objects.filter(id=int(project_id)).exists():
+            return JsonResponse({'error': f'Unknown project_id: {project_id}'}, status=400)
+        project_id = int(project_id)
+    try:
+        documents = ingest_uploads(pdf_files, project_id=project_id)
+    except Exception as e:
+        logger.error(f"Error storing uploaded documents: {e}", exc_info=True)
+        return JsonResponse({'error': 'An internal server error occurred.'}, status=500)
+    logger.info(f"Stored {len(documents)} documents for background processing: {[document.id for document in documents]}")
+    return JsonResponse({'documents': [document_status(document) for document in documents]}, status=202)
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def document_detail(request, document_id):
+    """Ingestion status of an uploaded document (queued again if its extraction was lost)."""
+    try:
+        document = Document.objects.get(id=document_id)
+    except Document.DoesNotExist:
+        return JsonResponse({'error': 'Document not found'}, status=404)
+    if document.status in (Document.STATUS_PENDING, Document.STATUS_PROCESSING):
+        requeue_stale_documents([document.id])
+        document.refresh_from_db()
+    return JsonResponse(document_status(document))